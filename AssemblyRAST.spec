@@ -71,13 +71,33 @@ module AssemblyRAST {
         read_library_name - the name of the PE read library (SE library support in the future)
         output_contig_set_name - the name of the output contigset
 
-        extra_params - assembler specific parameters
+        extra_params - key=value options preprocessing the reads before
+                       assembly: trim_adapter, trim_quality, trim_min_length,
+                       merge_pairs, merge_min_overlap, merge_max_mismatch_rate,
+                       normalize_coverage and normalize_k; the server must
+                       have stage-reads enabled
         min_contig_length - minimum length of contigs to output, default 200
+        assemblers - several assemblers to run concurrently on the same input;
+                     one assembly is saved per assembler, named
+                     <output_contigset_name>.<assembler>, with a single
+                     comparative report
+        race - run the assemblers (default megahit, velvet, miniasm) and keep
+               the first assembly meeting the thresholds below; the other
+               ARAST jobs are cancelled
+        min_n50 - minimum N50 of an acceptable assembly when racing
+        min_total_len - minimum total contig length when racing
+        max_contigs - maximum number of contigs when racing
 
         @optional recipe
         @optional assembler
+        @optional assemblers
         @optional pipeline
         @optional min_contig_len
+        @optional race
+        @optional min_n50
+        @optional min_total_len
+        @optional max_contigs
+        @optional extra_params
     */
     typedef structure {
         string workspace_name;
@@ -86,11 +106,58 @@ module AssemblyRAST {
         string output_contigset_name;
         string recipe;
         string assembler;
+        list<string> assemblers;
         string pipeline;
         int min_contig_len;
+        int race;
+        int min_n50;
+        int min_total_len;
+        int max_contigs;
+        list<string> extra_params;
     } ArastParams;
 
     funcdef run_arast(ArastParams params) returns (AssemblyOutput output)
         authentication required;
 
+
+    /*
+        One assembly of a batch.
+
+        read_library_refs - the read libraries to assemble together
+        output_contigset_name - the name of the output contigset
+        assembler, recipe, pipeline - how to assemble, as in ArastParams
+
+        @optional assembler
+        @optional recipe
+        @optional pipeline
+    */
+    typedef structure {
+        list<string> read_library_refs;
+        string output_contigset_name;
+        string assembler;
+        string recipe;
+        string pipeline;
+    } BatchAssemblyItem;
+
+    /*
+        Run many assemblies through AssemblyRAST.
+
+        workspace_name - the name of the workspace for output
+        items - the assemblies to run
+        max_concurrency - maximum number of ARAST jobs in flight, default 4
+        min_contig_len - minimum length of contigs to output, default 300
+
+        @optional max_concurrency
+        @optional min_contig_len
+    */
+    typedef structure {
+        string workspace_name;
+        list<BatchAssemblyItem> items;
+        int max_concurrency;
+        int min_contig_len;
+    } BatchAssemblyParams;
+
+    funcdef run_arast_batch(BatchAssemblyParams params) returns (AssemblyOutput output)
+        authentication required;
+
 };
@@ -259,15 +259,31 @@ class AssemblyRAST(object):
            workspace_name - the name of the workspace for input/output
            read_library_name - the name of the PE read library (SE library
            support in the future) output_contig_set_name - the name of the
-           output contigset extra_params - assembler specific parameters
-           min_contig_length - minimum length of contigs to output, default
-           200 @optional recipe @optional assembler @optional pipeline
-           @optional min_contig_len) -> structure: parameter "workspace_name"
-           of String, parameter "read_library_names" of list of String,
-           parameter "read_library_refs" of list of String, parameter
-           "output_contigset_name" of String, parameter "recipe" of String,
-           parameter "assembler" of String, parameter "pipeline" of String,
-           parameter "min_contig_len" of Long
+           output contigset extra_params - key=value options preprocessing the
+           reads before assembly: trim_adapter, trim_quality, trim_min_length,
+           merge_pairs, merge_min_overlap, merge_max_mismatch_rate,
+           normalize_coverage and normalize_k; the server must have
+           stage-reads enabled min_contig_length - minimum length of contigs
+           to output, default 200 assemblers - several assemblers to run
+           concurrently on the same input; one assembly is saved per
+           assembler, named <output_contigset_name>.<assembler>, with a single
+           comparative report race - run the assemblers (default megahit,
+           velvet, miniasm) and keep the first assembly meeting the thresholds
+           below; the other ARAST jobs are cancelled min_n50 - minimum N50 of
+           an acceptable assembly when racing min_total_len - minimum total
+           contig length when racing max_contigs - maximum number of contigs
+           when racing @optional recipe @optional assembler @optional
+           assemblers @optional pipeline @optional min_contig_len @optional
+           race @optional min_n50 @optional min_total_len @optional
+           max_contigs @optional extra_params) -> structure: parameter
+           "workspace_name" of String, parameter "read_library_names" of list
+           of String, parameter "read_library_refs" of list of String,
+           parameter "output_contigset_name" of String, parameter "recipe" of
+           String, parameter "assembler" of String, parameter "assemblers" of
+           list of String, parameter "pipeline" of String, parameter
+           "min_contig_len" of Long, parameter "race" of Long, parameter
+           "min_n50" of Long, parameter "min_total_len" of Long, parameter
+           "max_contigs" of Long, parameter "extra_params" of list of String
         :returns: instance of type "AssemblyOutput" -> structure: parameter
            "report_name" of String, parameter "report_ref" of String
         """
@@ -275,6 +291,32 @@ class AssemblyRAST(object):
             'AssemblyRAST.run_arast',
             [params], self._service_ver, context)
 
+    def run_arast_batch(self, params, context=None):
+        """
+        :param params: instance of type "BatchAssemblyParams" (Run many
+           assemblies through AssemblyRAST. workspace_name - the name of the
+           workspace for output items - the assemblies to run
+           max_concurrency - maximum number of ARAST jobs in flight, default
+           4 min_contig_len - minimum length of contigs to output, default
+           300 @optional max_concurrency @optional min_contig_len) ->
+           structure: parameter "workspace_name" of String, parameter "items"
+           of list of type "BatchAssemblyItem" (One assembly of a batch.
+           read_library_refs - the read libraries to assemble together
+           output_contigset_name - the name of the output contigset
+           assembler, recipe, pipeline - how to assemble, as in ArastParams
+           @optional assembler @optional recipe @optional pipeline) ->
+           structure: parameter "read_library_refs" of list of String,
+           parameter "output_contigset_name" of String, parameter "assembler"
+           of String, parameter "recipe" of String, parameter "pipeline" of
+           String, parameter "max_concurrency" of Long, parameter
+           "min_contig_len" of Long
+        :returns: instance of type "AssemblyOutput" -> structure: parameter
+           "report_name" of String, parameter "report_ref" of String
+        """
+        return self._client.call_method(
+            'AssemblyRAST.run_arast_batch',
+            [params], self._service_ver, context)
+
     def status(self, context=None):
         return self._client.call_method('AssemblyRAST.status',
                                         [], self._service_ver, context)
@@ -2,26 +2,35 @@
 #BEGIN_HEADER
 import os
 import sys
-import shutil
-import hashlib
-import subprocess
-import traceback
 import uuid
 import logging
-import pprint
 import json
-import tempfile
-import re
+import multiprocessing
+import threading
 from datetime import datetime
 from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
-from pprint import pprint, pformat
-from collections import Iterable
-
-import numpy as np
-
-from Bio import SeqIO
-
-from biokbase.workspace.client import Workspace as workspaceService
+from AssemblyRAST.arast_client import ArastError, CLIENT_VERSION
+from AssemblyRAST.console_log import ConsoleLog
+from AssemblyRAST.contig_stats import ContigStats, filter_contigs, format_stats, check_thresholds
+from AssemblyRAST.diginorm import DigitalNormalization
+from AssemblyRAST.job_journal import (JobJournal, SUBMITTED, COMPLETED, CONTIGS_FETCHED,
+                                      ASSEMBLY_SAVED, REPORT_SAVED)
+from AssemblyRAST.job_loop import Call, JobLoop, Return, run_sync
+from AssemblyRAST.job_waiter import JobWaiter, ArastJobCancelled, ArastJobFailed, QUEUED
+from AssemblyRAST.merge import PairMerging
+from AssemblyRAST.read_check import ReadChecker
+from AssemblyRAST.read_profile import ReadProfiler, choose_assembler, format_profile
+from AssemblyRAST.read_stager import LocalShock, ReadCache, ReadStager
+from AssemblyRAST.result_cache import ResultCache, make_key as make_cache_key
+from AssemblyRAST.request_context import RequestContext
+from AssemblyRAST.scratch_manager import ScratchManager
+from AssemblyRAST.shock_download import DownloadError, RangedDownloader
+from AssemblyRAST.trim import Trimming
+from AssemblyRAST.workspace_fetch import ObjectCache, fetch_read_libs
+from pprint import pformat
+from collections import Iterable, deque
+
+from Workspace.WorkspaceClient import Workspace as workspaceService
 
 
 # logging.basicConfig(format="[%(asctime)s %(levelname)s %(name)s] %(message)s", level=logging.DEBUG)
@@ -53,20 +62,19 @@ This modules run assemblers supported in the AssemblyRAST service.
     #BEGIN_CLASS_HEADER
     workspaceURL = None
 
-    # target is a list for collecting log messages
+    # fast assemblers raced when run_arast is called with race but no assemblers
+    RACE_ASSEMBLERS = ['megahit', 'velvet', 'miniasm']
+
+    # ARAST log lines kept with a result; the whole log still goes to the console
+    LOG_TAIL_LINES = 1000
+
+    # target is the ConsoleLog of the call, which batches the writes to stdout
     def log(self, target, message):
-        # we should do something better here...
         if target is not None:
             target.append(message)
-        print(message)
-        sys.stdout.flush()
-
-    def create_temp_json(self, attrs):
-        f = tempfile.NamedTemporaryFile(delete=False)
-        outjson = f.name
-        f.write(json.dumps(attrs))
-        f.close()
-        return outjson
+        else:
+            print(message)
+            sys.stdout.flush()
 
     # combine multiple read library objects into a kbase_assembly_input
     def combine_read_libs(self, libs):
@@ -117,15 +125,7 @@ This modules run assemblers supported in the AssemblyRAST service.
         logger.debug('kbase_assembly_input = {}'.format(json.dumps(assembly_input)))
         return assembly_input
 
-    # template
-    def arast_run(self, ctx, params, assembler, server='http://localhost:8000/'):
-        output = None
-
-        console = []
-        self.log(console,'Running run_{} with params='.format(assembler))
-        self.log(console, pformat(params))
-
-        #### do some basic checks
+    def check_params(self, params):
         if 'workspace_name' not in params:
             raise ValueError('workspace_name parameter is required')
         if 'read_library_refs' not in params and 'read_library_names' not in params:
@@ -138,14 +138,12 @@ This modules run assemblers supported in the AssemblyRAST service.
                 raise ValueError('read_library_names must be a list')
         if 'output_contigset_name' not in params:
             raise ValueError('output_contigset_name parameter is required')
-        min_contig_len = params.get('min_contig_len') or 300
-
-        token = ctx['token']
+        if 'extra_params' in params and type(params['extra_params']) != list:
+            raise ValueError('extra_params must be a list')
+        # fail before anything is submitted if the reads cannot be preprocessed
+        self.preprocess_stages(params)
 
-        os.environ["KB_AUTH_TOKEN"] = token
-        os.environ["ARAST_URL"] =  server
-
-        ws = workspaceService(self.workspaceURL)
+    def get_read_libs(self, ws, params):
         ws_libs = []
         if 'read_library_refs' in params:
             for lib_ref in params['read_library_refs']:
@@ -155,78 +153,10 @@ This modules run assemblers supported in the AssemblyRAST service.
                 ws_libs.append({'ref': params['workspace_name'] + '/' + lib_name})
         if len(ws_libs)==0:
             raise ValueError('At least one read library must be provided in read_library_refs or read_library_names')
-        libs = ws.get_objects2({'objects': ws_libs})['data']
-
-        wsid = libs[0]['info'][6]
-
-        kbase_assembly_input = self.combine_read_libs(libs)
-        tmp_data = self.create_temp_json(kbase_assembly_input)
-
-        mode = ''
-        cmd = ['ar-run', '--data-json', tmp_data]
-        if assembler:
-            cmd = cmd + ['-a', assembler]
-            mode = 'assembler: ' + assembler
-        elif 'pipeline' in params and params['pipeline']:
-            cmd = cmd + ['-p', params['pipeline']]
-            mode = 'assembly pipeline: ' + params['pipeline']
-        else:
-            cmd = cmd + ['-r', params.get('recipe', 'auto')]
-            mode = 'assembly recipe: ' + params['recipe']
-
-        logger.info('Start {}'.format(mode))
-        logger.debug('CMD: {}'.format(' '.join(cmd)))
-
-        p = subprocess.Popen(cmd,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT, shell=False)
-
-        out, err = p.communicate()
-        logger.debug(out)
-
-        if p.returncode != 0:
-            raise ValueError('Error running ar_run, return code: {}\n'.format(p.returncode))
-
-        job_id = None
-        match = re.search('(\d+)', out)
-        if match:
-            job_id = match.group(1)
-        else:
-            raise ValueError('No integer job ID found: {}\n'.format(out))
-
-        timestamp = int((datetime.utcnow() - datetime.utcfromtimestamp(0)).total_seconds()*1000)
-        output_dir = os.path.join(self.scratch, 'output.'+str(timestamp))
-        output_contigs = os.path.join(output_dir, 'contigs.fa')
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        cmd = ['ar-get', '-j', job_id, '-w', '-l']
-        logger.debug('CMD: {}'.format(' '.join(cmd)))
-        ar_log = subprocess.check_output(cmd)
-
-        self.log(console, ar_log)
-
-        cmdstr = 'ar-get -j {} -w -p | ar-filter -l {} > {}'.format(job_id, min_contig_len, output_contigs)
-        logger.debug('CMD: {}'.format(cmdstr))
-        subprocess.check_call(cmdstr, shell=True)
-
-        cmd = ['ar-get', '-j', job_id, '-w', '-r']
-        logger.debug('CMD: {}'.format(' '.join(cmd)))
-        ar_report = subprocess.check_output(cmd)
-
-        self.log(console, "\nDONE\n")
-
-        client = AssemblyUtil(self.callback_url)
-        assembly_ref = client.save_assembly_from_fasta({
-                        'file':{'path':output_contigs},
-                        'workspace_name':params['workspace_name'],
-                        'assembly_name':params['output_contigset_name']
-               	})
-        
-        lengths = []
-        for seq_record in SeqIO.parse(output_contigs, 'fasta'):
-            lengths.append(len(seq_record.seq))
+        return fetch_read_libs(ws, [lib['ref'] for lib in ws_libs], cache=self.ws_cache,
+                               chunk_size=self.ws_chunk_size, workers=self.ws_fetch_workers)
 
+    def get_provenance(self, ctx, params):
         provenance = [{}]
         if 'provenance' in ctx:
             provenance = ctx['provenance']
@@ -235,35 +165,298 @@ This modules run assemblers supported in the AssemblyRAST service.
             provenance[0]['input_ws_objects']=[params['workspace_name']+'/'+x for x in params['read_library_names']]
         elif 'read_library_refs' in params:
             provenance[0]['input_ws_objects']=[x for x in params['read_library_refs']]
+        return provenance
+
+    # per-call state; never store call specific values on self or in os.environ
+    def request_context(self, ctx, server):
+        spill_path = on_close = None
+        if self.console_config['spill']:
+            # kept under the scratch quota, and evictable once the call is over
+            spill_dir = self.scratch_manager.allocate('console')
+            spill_path = os.path.join(spill_dir, 'console.log.gz')
+            on_close = lambda: self.scratch_manager.release(spill_dir)
+        console = ConsoleLog(max_lines=self.console_config['max_lines'],
+                             flush_lines=self.console_config['flush_lines'],
+                             flush_interval=self.console_config['flush_interval'],
+                             spill_path=spill_path,
+                             json_lines=self.console_config['json_lines'],
+                             call_id=ctx.get('call_id'),
+                             on_close=on_close)
+        return RequestContext.from_ctx(ctx, server, self.scratch, console=console)
+
+    def workspace(self, rctx):
+        return workspaceService(self.workspaceURL, token=rctx.token)
+
+    # submit one ARAST job, wait for it and fetch its filtered contigs
+    def arast_job(self, arast, kbase_assembly_input, params, assembler, console, journal=None):
+        return run_sync(self.arast_job_co(arast, kbase_assembly_input, params, assembler,
+                                          console, journal=journal))
+
+    # coroutine behind arast_job, see job_loop
+    def arast_job_co(self, arast, kbase_assembly_input, params, assembler, console, journal=None):
+        if journal is not None and journal.done(CONTIGS_FETCHED):
+            fetched = journal.get(CONTIGS_FETCHED)
+            if os.path.exists(fetched['output_contigs']) and os.path.exists(fetched['stats']):
+                self.log(console, 'Resuming with the contigs of ARAST job {}'.format(fetched['job_id']))
+                raise Return({'job_id': fetched['job_id'],
+                              'mode': fetched['mode'],
+                              'output_dir': fetched['output_dir'],
+                              'output_contigs': fetched['output_contigs'],
+                              'stats': ContigStats.load(fetched['stats']),
+                              'ar_log': '',
+                              'ar_report': fetched['ar_report'],
+                              'preprocessing': fetched.get('preprocessing', [])})
+        job = None
+        if journal is not None and journal.done(SUBMITTED):
+            job = journal.get(SUBMITTED)
+            state, _ = yield Call(JobWaiter(arast).poll, job['job_id'])
+            if job.get('staged') and state == QUEUED:
+                # its reads were served by the LocalShock of the process that
+                # submitted it, which does not serve them any more
+                self.log(console, 'ARAST job {} has not fetched its staged reads yet, '
+                                  'submitting it again'.format(job['job_id']))
+                yield Call(self.kill_jobs, arast, {job['mode']: job}, console)
+                journal.clear()
+                job = None
+            else:
+                self.log(console, 'Reattaching to ARAST job {} for {}'.format(job['job_id'], job['mode']))
+        if job is None:
+            cached = yield Call(self.cached_result, kbase_assembly_input, params, assembler, console)
+            if cached:
+                raise Return(cached)
+            job = yield Call(self.arast_submit, arast, kbase_assembly_input, params, assembler, console)
+            if journal is not None:
+                # LocalShock node ids only mean something to this process
+                entry = dict((key, value) for key, value in job.items() if key != 'local_nodes')
+                entry['staged'] = bool(job['local_nodes'])
+                journal.record(SUBMITTED, **entry)
+        try:
+            result = yield self.arast_collect_co(arast, job, params, console, journal=journal)
+        except ArastJobFailed:
+            # a retry should submit a fresh job rather than reattach to this one
+            if journal is not None:
+                journal.clear()
+            raise
+        raise Return(result)
+
+    def cached_result(self, kbase_assembly_input, params, assembler, console):
+        cache_key = self.cache_key(kbase_assembly_input, params, assembler)
+        if cache_key:
+            output_dir = self.make_output_dir('cached')
+            cached = self.result_cache.get(cache_key, output_dir)
+            if cached:
+                self.log(console, 'Reusing cached assembly from ARAST job {} for {}'.format(
+                    cached['job_id'], self.describe_mode(params, assembler)))
+                cached['mode'] = self.describe_mode(params, assembler) + ' (cached)'
+                cached['output_dir'] = output_dir
+                cached['ar_log'] = ''
+                return cached
+            self.scratch_manager.discard(output_dir)
+        return None
+
+    def cache_key(self, kbase_assembly_input, params, assembler):
+        return make_cache_key(kbase_assembly_input,
+                              assembler=assembler,
+                              pipeline=params.get('pipeline'),
+                              recipe=params.get('recipe', 'auto'),
+                              extra_params=params.get('extra_params'),
+                              min_contig_len=params.get('min_contig_len') or 300,
+                              arast_version=self.arast_version)
+
+    def describe_mode(self, params, assembler):
+        if assembler:
+            return 'assembler: ' + assembler
+        elif 'pipeline' in params and params['pipeline']:
+            return 'assembly pipeline: ' + params['pipeline']
+        else:
+            return 'assembly recipe: ' + params.get('recipe', 'auto')
+
+    # profile the reads, and pick an assembler when the caller left the choice to ARAST
+    def profile_reads(self, rctx, kbase_assembly_input, params, assembler):
+        try:
+            profile = self.read_profiler.profile(kbase_assembly_input, rctx.token)
+        except DownloadError as e:
+            self.log(rctx.console, 'Unable to profile the reads: {}'.format(e))
+            return None, assembler
+        self.log(rctx.console, format_profile(profile))
+        if not assembler and not params.get('pipeline') and params.get('recipe', 'auto') == 'auto':
+            chosen = choose_assembler(profile)
+            if chosen:
+                self.log(rctx.console, 'Selected assembler {} from the read profile'.format(chosen))
+                profile['selected_assembler'] = chosen
+                assembler = chosen
+        return profile, assembler
+
+    # extra_params entries of the form key=value
+    def extra_options(self, params):
+        options = {}
+        for entry in params.get('extra_params') or []:
+            key, sep, value = entry.partition('=')
+            if sep:
+                options[key.strip()] = value.strip()
+        return options
+
+    # the pre-assembly stages requested through extra_params, in the order they run
+    def preprocess_stages(self, params):
+        options = self.extra_options(params)
+        stages = []
+        if 'trim_adapter' in options or 'trim_quality' in options:
+            try:
+                quality = int(options['trim_quality']) if 'trim_quality' in options else None
+                min_length = int(options.get('trim_min_length', 30))
+            except ValueError:
+                raise ValueError('trim_quality and trim_min_length must be integers')
+            stages.append(Trimming(adapter=options.get('trim_adapter'), quality=quality,
+                                   min_length=min_length, workers=self.preprocess_workers,
+                                   pool=self.worker_pool))
+        if options.get('merge_pairs', '').lower() in ('1', 'true', 'yes'):
+            try:
+                min_overlap = int(options.get('merge_min_overlap', 20))
+                max_mismatch_rate = float(options.get('merge_max_mismatch_rate', 0.1))
+            except ValueError:
+                raise ValueError('merge_min_overlap must be an integer and '
+                                 'merge_max_mismatch_rate a number')
+            stages.append(PairMerging(min_overlap=min_overlap, max_mismatch_rate=max_mismatch_rate,
+                                      workers=self.preprocess_workers, pool=self.worker_pool))
+        if 'normalize_coverage' in options:
+            try:
+                target = int(options['normalize_coverage'])
+                k = int(options.get('normalize_k', 20))
+            except ValueError:
+                raise ValueError('normalize_coverage and normalize_k must be integers')
+            stages.append(DigitalNormalization(target=target, k=k,
+                                               sketch_bytes=self.diginorm_sketch_bytes))
+        if stages and self.read_stager is None:
+            raise ValueError('The reads cannot be preprocessed ({}): this server does not '
+                             'stage reads, which needs stage-reads = true in deploy.cfg'.format(
+                                 ', '.join(stage.name for stage in stages)))
+        return stages
+
+    def make_output_dir(self, job_id):
+        timestamp = int((datetime.utcnow() - datetime.utcfromtimestamp(0)).total_seconds()*1000)
+        return self.scratch_manager.allocate('{}.{}'.format(timestamp, job_id))
 
+    def arast_submit(self, arast, kbase_assembly_input, params, assembler, console):
+        mode = self.describe_mode(params, assembler)
 
-        os.remove(tmp_data)
-        #shutil.rmtree(output_dir)
-
-        # create a Report
-        report = ''
-        report += '============= Raw Contigs ============\n' + ar_report + '\n'
-
-        report += '========== Filtered Contigs ==========\n'
-        report += 'ContigSet saved to: '+params['workspace_name']+'/'+params['output_contigset_name']+'\n'
-        report += 'Assembled into '+str(len(lengths)) + ' contigs.\n'
-        report += 'Average Length: '+str(sum(lengths)/float(len(lengths))) + ' bp.\n'
-
-        # compute a simple contig length distribution
-        bins = 10
-        counts, edges = np.histogram(lengths, bins)
-        report += 'Contig Length Distribution (# of contigs -- min to max basepairs):\n'
-        for c in range(bins):
-            report += '   '+str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' + str(edges[c+1]) + ' bp\n'
+        logger.info('Start {}'.format(mode))
 
-        print report
+        submitted_input = kbase_assembly_input
+        preprocessing = []
+        local_nodes = []
+        if self.read_stager is not None:
+            def on_stage(message):
+                self.log(console, message)
+                preprocessing.append(message)
+
+            submitted_input = self.read_stager.stage_input(kbase_assembly_input, arast.token,
+                                                           stream=self.stream_reads,
+                                                           stages=self.preprocess_stages(params),
+                                                           on_stage=on_stage,
+                                                           checker=self.read_checker)
+            local_nodes = self.read_stager.nodes_of(submitted_input)
+            self.log(console, 'Staged reads locally for {}'.format(mode))
+
+        try:
+            job_id = arast.submit_job(submitted_input,
+                                      assembler=assembler,
+                                      pipeline=params.get('pipeline'),
+                                      recipe=params.get('recipe', 'auto'))
+        except Exception:
+            self.release_reads(local_nodes)
+            raise
+        self.log(console, 'Submitted ARAST job {} for {}'.format(job_id, mode))
+        return {'job_id': job_id, 'mode': mode, 'preprocessing': preprocessing,
+                'local_nodes': local_nodes,
+                'cache_key': self.cache_key(kbase_assembly_input, params, assembler)}
+
+    # the staged reads of a job are no longer needed once it finished
+    def release_reads(self, local_nodes):
+        if self.read_stager is not None:
+            self.read_stager.release(local_nodes)
+
+    def arast_collect(self, arast, job, params, console, cancel=None, journal=None):
+        return run_sync(self.arast_collect_co(arast, job, params, console,
+                                              cancel=cancel, journal=journal))
+
+    # coroutine behind arast_collect: waiting is a Sleep, fetching runs on a worker
+    def arast_collect_co(self, arast, job, params, console, cancel=None, journal=None):
+        job_id = job['job_id']
+
+        def on_state(state, status):
+            self.log(console, 'ARAST job {} is {}: {}'.format(job_id, state, status))
+
+        try:
+            yield JobWaiter(arast).wait_co(job_id, on_state=on_state, cancel=cancel)
+        finally:
+            self.release_reads(job.get('local_nodes', []))
+        if journal is not None:
+            journal.record(COMPLETED, job_id=job_id)
+        result = yield Call(self.arast_fetch, arast, job, params, console, journal=journal)
+        raise Return(result)
+
+    # fetch the log, filtered contigs and report of a finished ARAST job
+    def arast_fetch(self, arast, job, params, console, journal=None):
+        job_id = job['job_id']
+        min_contig_len = params.get('min_contig_len') or 300
 
+        output_dir = self.make_output_dir(job_id)
+        try:
+            output_contigs = os.path.join(output_dir, 'contigs.fa')
+
+            # forward the log as it streams in, keeping only its tail in memory
+            ar_log = deque(maxlen=self.LOG_TAIL_LINES)
+            for line in arast.iter_log_lines(job_id):
+                self.log(console, line)
+                ar_log.append(line)
+            ar_log = '\n'.join(ar_log)
+
+            stats, removed = filter_contigs(arast.iter_contigs(job_id),
+                                            output_contigs, min_contig_len)
+            self.log(console, 'Kept {} contigs, removed {} shorter than {} bp'.format(
+                stats.count, removed.count, min_contig_len))
+
+            ar_report = arast.get_report(job_id)
+
+            if job.get('cache_key'):
+                self.result_cache.put(job['cache_key'], output_contigs, stats, ar_report, job_id)
+            if journal is not None:
+                stats_path = os.path.join(output_dir, 'stats.bin')
+                stats.save(stats_path)
+                self.scratch_manager.pin(output_dir, 'journal')
+                journal.record(CONTIGS_FETCHED, job_id=job_id, mode=job['mode'],
+                               output_dir=output_dir, output_contigs=output_contigs,
+                               stats=stats_path, ar_report=ar_report,
+                               preprocessing=job.get('preprocessing', []))
+
+            return {'job_id': job_id,
+                    'mode': job['mode'],
+                    'output_dir': output_dir,
+                    'output_contigs': output_contigs,
+                    'stats': stats,
+                    'ar_log': ar_log,
+                    'ar_report': ar_report,
+                    'preprocessing': job.get('preprocessing', [])}
+        except Exception:
+            # nothing refers to a directory whose fetch failed
+            self.scratch_manager.discard(output_dir)
+            raise
+
+    def save_assembly(self, rctx, workspace_name, assembly_name, contigs_path):
+        client = AssemblyUtil(self.callback_url, token=rctx.token)
+        with self.scratch_manager.pinned(os.path.dirname(contigs_path), 'upload'):
+            return client.save_assembly_from_fasta({
+                            'file':{'path':contigs_path},
+                            'workspace_name':workspace_name,
+                            'assembly_name':assembly_name
+                   	})
+
+    def save_report(self, ws, wsid, provenance, reportName, report, objects_created):
         reportObj = {
-            'objects_created':[{'ref':params['workspace_name']+'/'+params['output_contigset_name'], 'description':'Assembled contigs'}],
+            'objects_created': objects_created,
             'text_message': report
         }
 
-        reportName = '{}.report.{}'.format(assembler, job_id)
         report_obj_info = ws.save_objects({
                 'id': wsid,
                 'objects': [
@@ -278,14 +471,373 @@ This modules run assemblers supported in the AssemblyRAST service.
                 ]
             })[0]
 
-        output = { 'report_name': reportName, 'report_ref': str(report_obj_info[6]) + '/' + str(report_obj_info[0]) + '/' + str(report_obj_info[4]) }
+        return { 'report_name': reportName, 'report_ref': str(report_obj_info[6]) + '/' + str(report_obj_info[0]) + '/' + str(report_obj_info[4]) }
 
-        # At some point might do deeper type checking...
-        if not isinstance(output, dict):
-            raise ValueError('Method filter_contigs return value ' +
-                             'returnVal is not type dict as required.')
-        # return the results
-        return output
+    def log_call(self, console, description, params):
+        self.log(console, 'Running {} with params='.format(description))
+        self.log(console, pformat(params))
+
+    # the setup shared by every call on read libraries: check the parameters
+    # and fetch the libraries; returns the workspace, its id and the reads
+    def start_call(self, rctx, description, params):
+        self.log_call(rctx.console, description, params)
+
+        #### do some basic checks
+        self.check_params(params)
+
+        ws = self.workspace(rctx)
+        libs = self.get_read_libs(ws, params)
+
+        wsid = libs[0]['info'][6]
+
+        return ws, wsid, self.combine_read_libs(libs)
+
+    # log the report of a call and save it with the provenance of its reads
+    def finish_call(self, ctx, rctx, params, ws, wsid, reportName, report, objects_created):
+        self.log(rctx.console, report)
+        provenance = self.get_provenance(ctx, params)
+        return self.save_report(ws, wsid, provenance, reportName, report, objects_created)
+
+    # template
+    def arast_run(self, ctx, params, assembler, server='http://localhost:8000/'):
+        output = None
+
+        rctx = self.request_context(ctx, server)
+        console = rctx.console
+        try:
+            ws, wsid, kbase_assembly_input = self.start_call(rctx, 'run_' + assembler, params)
+
+            journal = JobJournal.for_call(os.path.join(rctx.scratch, 'journal'),
+                                          rctx.user_id, assembler, params)
+            if journal.done(REPORT_SAVED):
+                self.log(console, 'Returning the report saved by an earlier attempt of this call')
+                output = journal.get(REPORT_SAVED)['output']
+                journal.clear()
+                return output
+
+            profile = None
+            if self.read_profiler is not None:
+                profile, assembler = self.profile_reads(rctx, kbase_assembly_input, params, assembler)
+
+            arast = rctx.arast_client()
+            try:
+                result = self.arast_job(arast, kbase_assembly_input, params, assembler, console,
+                                        journal=journal)
+            finally:
+                arast.close()
+
+            self.log(console, "\nDONE\n")
+
+            try:
+                if not journal.done(ASSEMBLY_SAVED):
+                    assembly_ref = self.save_assembly(rctx, params['workspace_name'], params['output_contigset_name'],
+                                                      result['output_contigs'])
+                    journal.record(ASSEMBLY_SAVED, assembly_ref=assembly_ref)
+                output = self.arast_run_report(ctx, rctx, params, assembler, ws, wsid, result,
+                                               profile=profile)
+                journal.record(REPORT_SAVED, output=output)
+                self.scratch_manager.unpin(result['output_dir'], 'journal')
+                # only an interrupted call resumes; calling again makes a new assembly
+                journal.clear()
+            finally:
+                self.scratch_manager.release(result['output_dir'])
+
+            # At some point might do deeper type checking...
+            if not isinstance(output, dict):
+                raise ValueError('Method filter_contigs return value ' +
+                                 'returnVal is not type dict as required.')
+            # return the results
+            return output
+        finally:
+            console.close()
+
+    def arast_run_report(self, ctx, rctx, params, assembler, ws, wsid, result, profile=None):
+        # create a Report
+        report = ''
+        if profile is not None:
+            report += '============= Read Profile ============\n' + format_profile(profile)
+            if profile.get('selected_assembler'):
+                report += 'Selected assembler: ' + profile['selected_assembler'] + '\n'
+        if result.get('preprocessing'):
+            report += '============= Preprocessing ============\n'
+            report += ''.join(line + '\n' for line in result['preprocessing'])
+        report += '============= Raw Contigs ============\n' + result['ar_report'] + '\n'
+
+        report += '========== Filtered Contigs ==========\n'
+        report += 'ContigSet saved to: '+params['workspace_name']+'/'+params['output_contigset_name']+'\n'
+        report += format_stats(result['stats'])
+
+        objects_created = [{'ref':params['workspace_name']+'/'+params['output_contigset_name'], 'description':'Assembled contigs'}]
+        # a cached result carries the job id of an earlier call, so the id alone is not unique
+        reportName = '{}.report.{}.{}'.format(assembler, result['job_id'], uuid.uuid4())
+        return self.finish_call(ctx, rctx, params, ws, wsid, reportName, report, objects_created)
+
+    # run several assemblers concurrently on the same input and compare them
+    def arast_compare(self, ctx, params, assemblers, server='http://localhost:8000/'):
+        rctx = self.request_context(ctx, server)
+        console = rctx.console
+        try:
+            if len(set(assemblers)) != len(assemblers):
+                raise ValueError('assemblers must not contain duplicates')
+            ws, wsid, kbase_assembly_input = self.start_call(
+                rctx, 'run_arast comparing ' + ', '.join(assemblers), params)
+
+            def run_one(assembler):
+                arast = rctx.arast_client()
+                try:
+                    result = yield self.arast_job_co(arast, kbase_assembly_input, params, assembler, console)
+                except Exception as e:
+                    self.log(console, 'Assembler {} failed: {}'.format(assembler, e))
+                    raise Return((assembler, None, str(e)))
+                finally:
+                    arast.close()
+                name = '{}.{}'.format(params['output_contigset_name'], assembler)
+                try:
+                    yield Call(self.save_assembly, rctx, params['workspace_name'], name, result['output_contigs'])
+                finally:
+                    self.scratch_manager.release(result['output_dir'])
+                result['assembly_name'] = name
+                raise Return((assembler, result, None))
+
+            # one loop drives every assembler; threads are only used for the short blocking calls
+            results = JobLoop(workers=self.job_loop_workers).run(run_one(a) for a in assemblers)
+
+            if all(result is None for _, result, _ in results):
+                raise ValueError('All assemblers failed:\n' +
+                                 '\n'.join('{}: {}'.format(a, err) for a, _, err in results))
+
+            self.log(console, "\nDONE\n")
+
+            # create a comparative Report
+            report = '========== Assembler Comparison ==========\n'
+            report += '{:<12}{:>10}{:>14}{:>10}{:>8}{:>8}\n'.format(
+                'assembler', 'contigs', 'total bp', 'N50', 'L50', 'GC')
+            objects_created = []
+            for assembler, result, err in results:
+                if result is None:
+                    report += '{:<12}failed: {}\n'.format(assembler, err)
+                    continue
+                s = result['stats'].to_dict()
+                report += '{:<12}{:>10}{:>14}{:>10}{:>8}{:>8.1%}\n'.format(
+                    assembler, s['count'], s['total_length'], s['n50'], s['l50'], s['gc_content'])
+                objects_created.append({'ref': params['workspace_name'] + '/' + result['assembly_name'],
+                                        'description': 'Contigs assembled by ' + assembler})
+
+            for assembler, result, err in results:
+                if result is None:
+                    continue
+                report += '\n============= ' + assembler + ' ============\n'
+                report += '============= Raw Contigs ============\n' + result['ar_report'] + '\n'
+                report += '========== Filtered Contigs ==========\n'
+                report += 'ContigSet saved to: '+params['workspace_name']+'/'+result['assembly_name']+'\n'
+                report += format_stats(result['stats'])
+
+            job_ids = [result['job_id'] for _, result, _ in results if result is not None]
+            reportName = 'compare.report.{}.{}'.format('_'.join(job_ids), uuid.uuid4())
+            return self.finish_call(ctx, rctx, params, ws, wsid, reportName, report, objects_created)
+        finally:
+            console.close()
+
+    def kill_jobs(self, arast, jobs, console):
+        for assembler, job in jobs.items():
+            try:
+                arast.kill_job(job['job_id'])
+                self.log(console, 'Cancelled ARAST job {} ({})'.format(job['job_id'], assembler))
+            except ArastError as e:
+                self.log(console, 'Unable to cancel ARAST job {}: {}'.format(job['job_id'], e))
+
+    # run several assemblers and keep the first one meeting the quality thresholds
+    def arast_race(self, ctx, params, assemblers, server='http://localhost:8000/'):
+        rctx = self.request_context(ctx, server)
+        console = rctx.console
+        try:
+            if len(set(assemblers)) != len(assemblers):
+                raise ValueError('assemblers must not contain duplicates')
+            ws, wsid, kbase_assembly_input = self.start_call(
+                rctx, 'run_arast racing ' + ', '.join(assemblers), params)
+            thresholds = {'min_n50': params.get('min_n50'),
+                          'min_total_length': params.get('min_total_len'),
+                          'max_contigs': params.get('max_contigs')}
+
+            arast = rctx.arast_client()
+            jobs = {}
+            try:
+                try:
+                    for assembler in assemblers:
+                        jobs[assembler] = self.arast_submit(arast, kbase_assembly_input, params, assembler, console)
+                except Exception:
+                    # do not leave the assemblers already submitted running
+                    self.kill_jobs(arast, jobs, console)
+                    raise
+
+                cancel = threading.Event()
+                outcomes = {}
+                won = []
+
+                def run_one(assembler):
+                    client = rctx.arast_client()
+                    try:
+                        result = yield self.arast_collect_co(client, jobs[assembler], params, console,
+                                                             cancel=cancel)
+                    except ArastJobCancelled:
+                        result, reason = None, 'cancelled'
+                    except Exception as e:
+                        result, reason = None, str(e)
+                    finally:
+                        client.close()
+                    if result is not None:
+                        failures = check_thresholds(result['stats'], **thresholds)
+                        # coroutines only run on the loop thread, so the first to get here wins
+                        if not failures and not won:
+                            won.append((assembler, result))
+                            outcomes[assembler] = 'accepted'
+                            self.log(console, 'Assembler {} meets the quality thresholds'.format(assembler))
+                            cancel.set()
+                            yield Call(self.kill_jobs, arast,
+                                       dict((other, job) for other, job in jobs.items()
+                                            if other != assembler and other not in outcomes),
+                                       console)
+                            return
+                        self.scratch_manager.release(result['output_dir'])
+                        reason = 'rejected: ' + ('; '.join(failures) or 'another assembler won')
+                    outcomes[assembler] = reason
+                    self.log(console, 'Assembler {} {}'.format(assembler, reason))
+
+                # one loop waits for every assembler; threads are only used for the short blocking calls
+                JobLoop(workers=self.job_loop_workers).run(run_one(a) for a in assemblers)
+            finally:
+                arast.close()
+
+            winner, winning = won[0] if won else (None, None)
+            if winner is None:
+                raise ValueError('No assembler met the quality thresholds:\n' +
+                                 '\n'.join('{}: {}'.format(a, outcomes[a]) for a in assemblers))
+
+            self.log(console, "\nDONE\n")
+
+            try:
+                self.save_assembly(rctx, params['workspace_name'], params['output_contigset_name'],
+                                   winning['output_contigs'])
+            finally:
+                self.scratch_manager.release(winning['output_dir'])
+
+            # create a Report
+            report = '============= Assembler Race ============\n'
+            report += 'Winner: ' + winner + '\n'
+            for assembler in assemblers:
+                report += '   {}\t{}\n'.format(assembler, outcomes.get(assembler, 'cancelled'))
+            report += '============= Raw Contigs ============\n' + winning['ar_report'] + '\n'
+
+            report += '========== Filtered Contigs ==========\n'
+            report += 'ContigSet saved to: '+params['workspace_name']+'/'+params['output_contigset_name']+'\n'
+            report += format_stats(winning['stats'])
+
+            objects_created = [{'ref':params['workspace_name']+'/'+params['output_contigset_name'],
+                                'description':'Contigs assembled by ' + winner}]
+            reportName = '{}.report.{}'.format(winner, winning['job_id'])
+            return self.finish_call(ctx, rctx, params, ws, wsid, reportName, report, objects_created)
+        finally:
+            console.close()
+
+    # run many independent assemblies with at most max_concurrency in flight
+    def arast_batch(self, ctx, params, server='http://localhost:8000/'):
+        rctx = self.request_context(ctx, server)
+        console = rctx.console
+        try:
+            self.log_call(console, 'run_arast_batch', params)
+
+            if 'workspace_name' not in params:
+                raise ValueError('workspace_name parameter is required')
+            items = params.get('items')
+            if not items or type(items) != list:
+                raise ValueError('items must be a non-empty list')
+            names = set()
+            for item in items:
+                if not item.get('read_library_refs') or type(item['read_library_refs']) != list:
+                    raise ValueError('read_library_refs must be a non-empty list in every item')
+                if 'output_contigset_name' not in item:
+                    raise ValueError('output_contigset_name is required in every item')
+                if item['output_contigset_name'] in names:
+                    raise ValueError('duplicate output_contigset_name ' + item['output_contigset_name'])
+                names.add(item['output_contigset_name'])
+            max_concurrency = params.get('max_concurrency') or 4
+            if max_concurrency < 1:
+                raise ValueError('max_concurrency must be at least 1')
+
+            # fetch every distinct read library once for the whole batch
+            ws = self.workspace(rctx)
+            refs = []
+            for item in items:
+                for ref in item['read_library_refs']:
+                    if ref not in refs:
+                        refs.append(ref)
+            libs = dict(zip(refs, self.get_read_libs(ws, {'read_library_refs': refs})))
+            wsid = libs[refs[0]]['info'][6]
+
+            def run_one(item):
+                item_params = dict(item)
+                item_params['workspace_name'] = params['workspace_name']
+                item_params['min_contig_len'] = params.get('min_contig_len')
+                kbase_assembly_input = self.combine_read_libs([libs[r] for r in item['read_library_refs']])
+                arast = rctx.arast_client()
+                try:
+                    result = yield self.arast_job_co(arast, kbase_assembly_input, item_params,
+                                                     item.get('assembler'), console)
+                    try:
+                        yield Call(self.save_assembly, rctx, params['workspace_name'],
+                                   item['output_contigset_name'], result['output_contigs'])
+                    finally:
+                        self.scratch_manager.release(result['output_dir'])
+                except Exception as e:
+                    result, err = None, str(e)
+                else:
+                    err = None
+                finally:
+                    arast.close()
+                # coroutines only run on the loop thread, so results needs no lock
+                results.append((item, result, err))
+                if result is None:
+                    self.log(console, '[{}/{}] {} failed: {}'.format(
+                        len(results), len(items), item['output_contigset_name'], err))
+                else:
+                    self.log(console, '[{}/{}] {} saved, {} contigs, N50 {}'.format(
+                        len(results), len(items), item['output_contigset_name'],
+                        result['stats'].count, result['stats'].n50()[0]))
+
+            results = []
+            JobLoop(workers=self.job_loop_workers).run((run_one(item) for item in items),
+                                                      limit=max_concurrency)
+
+            if all(result is None for _, result, _ in results):
+                raise ValueError('All assemblies failed:\n' +
+                                 '\n'.join('{}: {}'.format(i['output_contigset_name'], err)
+                                           for i, _, err in results))
+
+            self.log(console, "\nDONE\n")
+
+            # one summary report for the whole batch, in input order
+            order = dict((item['output_contigset_name'], n) for n, item in enumerate(items))
+            results.sort(key=lambda r: order[r[0]['output_contigset_name']])
+            report = '========== Batch Assembly ==========\n'
+            report += '{} of {} assemblies succeeded\n'.format(
+                sum(1 for _, result, _ in results if result is not None), len(items))
+            objects_created = []
+            for item, result, err in results:
+                name = item['output_contigset_name']
+                if result is None:
+                    report += '{}\tfailed: {}\n'.format(name, err)
+                    continue
+                s = result['stats'].to_dict()
+                report += '{}\t{}\tjob {}\t{} contigs\t{} bp\tN50 {}\n'.format(
+                    name, result['mode'], result['job_id'], s['count'], s['total_length'], s['n50'])
+                objects_created.append({'ref': params['workspace_name'] + '/' + name,
+                                        'description': 'Assembled contigs'})
+
+            reportName = 'batch.report.{}'.format(uuid.uuid4())
+            return self.finish_call(ctx, rctx, {'read_library_refs': refs}, ws, wsid,
+                                    reportName, report, objects_created)
+        finally:
+            console.close()
 
     #END_CLASS_HEADER
 
@@ -298,6 +850,53 @@ This modules run assemblers supported in the AssemblyRAST service.
         self.callback_url = os.environ['SDK_CALLBACK_URL']
         if not os.path.exists(self.scratch):
             os.makedirs(self.scratch)
+        self.arast_version = config.get('arast-version') or CLIENT_VERSION
+        self.scratch_manager = ScratchManager(
+            self.scratch, int(config.get('scratch-quota-bytes') or 20 * 1024**3))
+        JobJournal.sweep(os.path.join(self.scratch, 'journal'))
+        self.preprocess_workers = int(config.get('preprocess-workers') or 4)
+        check_workers = int(config.get('check-workers') or 4)
+        self.read_stager = None
+        self.worker_pool = None
+        self.stream_reads = config.get('stream-reads', 'false').lower() == 'true'
+        if config.get('stage-reads', 'false').lower() == 'true':
+            # the worker processes of preprocessing and read checks are forked
+            # here, before LocalShock or any call starts a thread whose locks
+            # they would inherit
+            self.worker_pool = multiprocessing.Pool(max(self.preprocess_workers, check_workers))
+            self.read_stager = ReadStager(
+                ReadCache(config.get('read-cache-dir') or os.path.join(self.scratch, 'read_cache'),
+                          int(config.get('read-cache-max-bytes') or 100 * 1024**3)),
+                LocalShock(),
+                RangedDownloader(parallelism=int(config.get('download-parallelism') or 4),
+                                 part_size=int(config.get('download-part-bytes') or 64 * 1024**2)))
+        self.read_checker = None
+        if config.get('check-reads', 'false').lower() == 'true':
+            if self.read_stager is None:
+                logger.warning('check-reads needs stage-reads, not checking reads')
+            else:
+                self.read_checker = ReadChecker(workers=check_workers, pool=self.worker_pool)
+        self.diginorm_sketch_bytes = int(config.get('diginorm-sketch-bytes') or 256 * 1024**2)
+        self.read_profiler = None
+        if config.get('profile-reads', 'false').lower() == 'true':
+            self.read_profiler = ReadProfiler(
+                self.read_stager.downloader if self.read_stager is not None else RangedDownloader(),
+                sample_bytes=int(config.get('profile-sample-bytes') or 4 * 1024**2))
+        self.ws_cache = ObjectCache(
+            max_entries=int(config.get('ws-cache-max-entries') or 1000),
+            max_bytes=int(config.get('ws-cache-max-bytes') or 256 * 1024**2))
+        self.ws_chunk_size = int(config.get('ws-chunk-size') or 100)
+        self.ws_fetch_workers = int(config.get('ws-fetch-workers') or 4)
+        self.job_loop_workers = int(config.get('job-loop-workers') or 4)
+        self.console_config = {
+            'max_lines': int(config.get('console-max-lines') or 10000),
+            'flush_lines': int(config.get('console-flush-lines') or 100),
+            'flush_interval': float(config.get('console-flush-interval') or 2.0),
+            'spill': config.get('console-spill', 'false').lower() == 'true',
+            'json_lines': config.get('console-format', 'text') == 'json'}
+        self.result_cache = ResultCache(
+            config.get('result-cache-dir') or os.path.join(self.scratch, 'result_cache'),
+            int(config.get('result-cache-max-bytes') or 10 * 1024**3))
         #END_CONSTRUCTOR
         pass
 
@@ -618,22 +1217,46 @@ This modules run assemblers supported in the AssemblyRAST service.
            workspace_name - the name of the workspace for input/output
            read_library_name - the name of the PE read library (SE library
            support in the future) output_contig_set_name - the name of the
-           output contigset extra_params - assembler specific parameters
-           min_contig_length - minimum length of contigs to output, default
-           200 @optional recipe @optional assembler @optional pipeline
-           @optional min_contig_len) -> structure: parameter "workspace_name"
-           of String, parameter "read_library_names" of list of String,
-           parameter "read_library_refs" of list of String, parameter
-           "output_contigset_name" of String, parameter "recipe" of String,
-           parameter "assembler" of String, parameter "pipeline" of String,
-           parameter "min_contig_len" of Long
+           output contigset extra_params - key=value options preprocessing the
+           reads before assembly: trim_adapter, trim_quality, trim_min_length,
+           merge_pairs, merge_min_overlap, merge_max_mismatch_rate,
+           normalize_coverage and normalize_k; the server must have
+           stage-reads enabled min_contig_length - minimum length of contigs
+           to output, default 200 assemblers - several assemblers to run
+           concurrently on the same input; one assembly is saved per
+           assembler, named <output_contigset_name>.<assembler>, with a single
+           comparative report race - run the assemblers (default megahit,
+           velvet, miniasm) and keep the first assembly meeting the thresholds
+           below; the other ARAST jobs are cancelled min_n50 - minimum N50 of
+           an acceptable assembly when racing min_total_len - minimum total
+           contig length when racing max_contigs - maximum number of contigs
+           when racing @optional recipe @optional assembler @optional
+           assemblers @optional pipeline @optional min_contig_len @optional
+           race @optional min_n50 @optional min_total_len @optional
+           max_contigs @optional extra_params) -> structure: parameter
+           "workspace_name" of String, parameter "read_library_names" of list
+           of String, parameter "read_library_refs" of list of String,
+           parameter "output_contigset_name" of String, parameter "recipe" of
+           String, parameter "assembler" of String, parameter "assemblers" of
+           list of String, parameter "pipeline" of String, parameter
+           "min_contig_len" of Long, parameter "race" of Long, parameter
+           "min_n50" of Long, parameter "min_total_len" of Long, parameter
+           "max_contigs" of Long, parameter "extra_params" of list of String
         :returns: instance of type "AssemblyOutput" -> structure: parameter
            "report_name" of String, parameter "report_ref" of String
         """
         # ctx is the context object
         # return variables are: output
         #BEGIN run_arast
-        output = self.arast_run(ctx, params, params.get('assembler', ""))
+        assemblers = [a for a in params.get('assemblers') or [] if a]
+        if params.get('race'):
+            output = self.arast_race(ctx, params, assemblers or self.RACE_ASSEMBLERS)
+        elif len(assemblers) > 1:
+            output = self.arast_compare(ctx, params, assemblers)
+        elif assemblers:
+            output = self.arast_run(ctx, params, assemblers[0])
+        else:
+            output = self.arast_run(ctx, params, params.get('assembler', ""))
         #END run_arast
 
         # At some point might do deeper type checking...
@@ -642,12 +1265,49 @@ This modules run assemblers supported in the AssemblyRAST service.
                              'output is not type dict as required.')
         # return the results
         return [output]
+
+    def run_arast_batch(self, ctx, params):
+        """
+        :param params: instance of type "BatchAssemblyParams" (Run many
+           assemblies through AssemblyRAST. workspace_name - the name of the
+           workspace for output items - the assemblies to run
+           max_concurrency - maximum number of ARAST jobs in flight, default
+           4 min_contig_len - minimum length of contigs to output, default
+           300 @optional max_concurrency @optional min_contig_len) ->
+           structure: parameter "workspace_name" of String, parameter "items"
+           of list of type "BatchAssemblyItem" (One assembly of a batch.
+           read_library_refs - the read libraries to assemble together
+           output_contigset_name - the name of the output contigset
+           assembler, recipe, pipeline - how to assemble, as in ArastParams
+           @optional assembler @optional recipe @optional pipeline) ->
+           structure: parameter "read_library_refs" of list of String,
+           parameter "output_contigset_name" of String, parameter "assembler"
+           of String, parameter "recipe" of String, parameter "pipeline" of
+           String, parameter "max_concurrency" of Long, parameter
+           "min_contig_len" of Long
+        :returns: instance of type "AssemblyOutput" -> structure: parameter
+           "report_name" of String, parameter "report_ref" of String
+        """
+        # ctx is the context object
+        # return variables are: output
+        #BEGIN run_arast_batch
+        output = self.arast_batch(ctx, params)
+        #END run_arast_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(output, dict):
+            raise ValueError('Method run_arast_batch return value ' +
+                             'output is not type dict as required.')
+        # return the results
+        return [output]
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
                      'message': "",
                      'version': self.VERSION,
                      'git_url': self.GIT_URL,
-                     'git_commit_hash': self.GIT_COMMIT_HASH}
+                     'git_commit_hash': self.GIT_COMMIT_HASH,
+                     'scratch_usage': self.scratch_manager.usage(),
+                     'ws_cache': self.ws_cache.stats()}
         #END_STATUS
         return [returnVal]
@@ -377,6 +377,10 @@ class Application(object):
                              name='AssemblyRAST.run_arast',
                              types=[dict])
         self.method_authentication['AssemblyRAST.run_arast'] = 'required'  # noqa
+        self.rpc_service.add(impl_AssemblyRAST.run_arast_batch,
+                             name='AssemblyRAST.run_arast_batch',
+                             types=[dict])
+        self.method_authentication['AssemblyRAST.run_arast_batch'] = 'required'  # noqa
         self.rpc_service.add(impl_AssemblyRAST.status,
                              name='AssemblyRAST.status',
                              types=[dict])
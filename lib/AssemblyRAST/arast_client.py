@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+In-process client for the ARAST (arastd) router.
+
+This replaces the ar-run / ar-get / ar-filter command line chain: all calls
+for a job go over one pooled HTTP session instead of forking a Python
+interpreter per step.
+"""
+import json
+import logging
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# version reported to the router with every submission, mirrors ar-run
+CLIENT_VERSION = '0.5.2'
+
+
+class ArastError(ValueError):
+    '''
+    An error reported by the ARAST router or while talking to it. Fields:
+    message - a human readable error message.
+    status_code - the HTTP status code, if the error came from a response.
+    job_id - the ARAST job the error refers to, if any.
+    '''
+
+    def __init__(self, message, status_code=None, job_id=None):
+        super(ArastError, self).__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.job_id = job_id
+
+
+class ArastClient(object):
+    '''
+    Talks to the arastd router for a single user.
+
+    url - the router url, e.g. http://localhost:8000/
+    user - the user id the router expects in job urls
+    token - a KBase authentication token
+    timeout - seconds before an individual HTTP request fails
+    pool_size - max number of pooled connections per host
+    '''
+
+    def __init__(self, url, user, token, timeout=300, pool_size=10,
+                 session=None):
+        if not url:
+            raise ValueError('An ARAST url is required')
+        if not user:
+            raise ValueError('An ARAST user id is required')
+        self.url = url.rstrip('/')
+        self.user = user
+        self.token = token
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._headers = {'Accept': 'text/plain'}
+        if token:
+            self._headers['Authorization'] = token
+        self._shock_url = None
+
+    def _job_url(self, job_id, resource):
+        return '{}/user/{}/job/{}/{}'.format(self.url, self.user, job_id,
+                                              resource)
+
+    def _request(self, method, url, job_id=None, **kwargs):
+        headers = dict(self._headers)
+        headers.update(kwargs.pop('headers', {}))
+        kwargs.setdefault('timeout', self.timeout)
+        logger.debug('{} {}'.format(method, url))
+        try:
+            resp = self.session.request(method, url, headers=headers,
+                                        **kwargs)
+        except requests.RequestException as e:
+            raise ArastError('Error contacting ARAST at {}: {}'.format(
+                url, e), job_id=job_id)
+        if not resp.ok:
+            raise ArastError('ARAST request {} failed ({}): {}'.format(
+                url, resp.status_code, resp.text.strip()),
+                status_code=resp.status_code, job_id=job_id)
+        return resp
+
+    def _get_text(self, url, job_id=None):
+        return self._request('GET', url, job_id=job_id).text
+
+    def _get_json(self, url, job_id=None):
+        resp = self._request('GET', url, job_id=job_id)
+        try:
+            return resp.json()
+        except ValueError:
+            raise ArastError('ARAST returned invalid JSON from {}: {}'.format(
+                url, resp.text[:200]), job_id=job_id)
+
+    @staticmethod
+    def _parse_job_id(text):
+        text = text.strip()
+        try:
+            value = json.loads(text)
+        except ValueError:
+            value = text
+        if isinstance(value, dict):
+            value = value.get('job_id', value.get('id'))
+        if isinstance(value, (int, long)):
+            return str(value)
+        if isinstance(value, basestring):
+            match = re.match(r'^(?:job id:\s*)?(\d+)$', value.strip(), re.I)
+            if match:
+                return match.group(1)
+        raise ArastError('No integer job ID in ARAST response: {}'.format(
+            text[:200]))
+
+    def submit_job(self, assembly_input, assembler=None, pipeline=None,
+                   recipe=None, message=None):
+        '''
+        Submit a kbase_assembly_input to ARAST and return the job ID.
+        Exactly one of assembler, pipeline or recipe is used, in that order
+        of precedence; recipe defaults to 'auto'.
+        '''
+        msg = {'kbase_assembly_input': assembly_input,
+               'client': 'AssemblyRAST',
+               'version': CLIENT_VERSION}
+        if assembler:
+            msg['assemblers'] = [assembler]
+        elif pipeline:
+            msg['pipeline'] = [pipeline.split()]
+        else:
+            msg['recipe'] = [recipe or 'auto']
+        if message:
+            msg['message'] = message
+        url = '{}/user/{}/job/new'.format(self.url, self.user)
+        resp = self._request('POST', url, data=json.dumps(msg, sort_keys=True),
+                             headers={'Content-type': 'application/json'})
+        return self._parse_job_id(resp.text)
+
+    def get_status(self, job_id):
+        return self._get_text(self._job_url(job_id, 'status'),
+                              job_id=job_id).strip()
+
+    def get_log(self, job_id):
+        return self._get_text(self._job_url(job_id, 'log'), job_id=job_id)
+
+    def iter_log_lines(self, job_id):
+        '''Stream the job log line by line instead of reading it whole'''
+        return self._iter_lines(self._job_url(job_id, 'log'), job_id=job_id)
+
+    def get_report(self, job_id):
+        return self._get_text(self._job_url(job_id, 'report'), job_id=job_id)
+
+    def get_assemblies(self, job_id):
+        '''
+        Return the assemblies of a finished job, best first, as a list of
+        file info dicts with 'filename', 'shock_url' and 'shock_id'.
+        '''
+        return self._get_json(self._job_url(job_id, 'assemblies'),
+                              job_id=job_id)
+
+    def kill_job(self, job_id):
+        return self._get_text(self._job_url(job_id, 'kill'),
+                              job_id=job_id).strip()
+
+    def get_shock_url(self):
+        if self._shock_url is None:
+            res = self._get_json('{}/shock'.format(self.url))
+            self._shock_url = res['shockurl'].rstrip('/')
+        return self._shock_url
+
+    def iter_shock_lines(self, file_info, job_id=None):
+        '''Stream the lines of a Shock node described by an ARAST file info'''
+        shock_url = (file_info.get('shock_url') or
+                     self.get_shock_url()).rstrip('/')
+        if not shock_url.startswith('http'):
+            shock_url = 'http://' + shock_url
+        url = '{}/node/{}?download'.format(shock_url, file_info['shock_id'])
+        headers = {}
+        if self.token:
+            headers['Authorization'] = 'OAuth {}'.format(self.token)
+        return self._iter_lines(url, job_id=job_id, headers=headers)
+
+    def _iter_lines(self, url, job_id=None, headers=None):
+        resp = self._request('GET', url, job_id=job_id, headers=headers or {},
+                             stream=True)
+        try:
+            for line in resp.iter_lines(chunk_size=1 << 16):
+                yield line
+        finally:
+            resp.close()
+
+    def iter_contigs(self, job_id):
+        '''
+        Stream the contigs of the best assembly of a job as
+        (header, sequence) tuples, header without the leading '>'.
+        '''
+        assemblies = self.get_assemblies(job_id)
+        if not assemblies:
+            raise ArastError('ARAST job {} has no assemblies'.format(job_id),
+                             job_id=job_id)
+        header = None
+        seq = []
+        for line in self.iter_shock_lines(assemblies[0], job_id=job_id):
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(seq)
+                header = line[1:].strip()
+                seq = []
+            elif line:
+                seq.append(line.strip())
+        if header is not None:
+            yield header, ''.join(seq)
+
+    def close(self):
+        self.session.close()
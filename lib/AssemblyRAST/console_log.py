@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded console log for a call.
+
+Messages are kept in a ring buffer rather than an ever growing list, and
+written to stdout in batches instead of one print and flush per line. A
+timer writes out a batch whose oldest message has waited flush_interval
+seconds, so that the log keeps up while the call blocks on ARAST. The full
+log can optionally be spilled to a gzip file in scratch, and written as
+JSON lines for machine parsing.
+"""
+import gzip
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+
+class ConsoleLog(object):
+    '''
+    The console of one call.
+
+    max_lines - number of recent messages kept in memory
+    flush_lines - write out once this many messages are pending
+    flush_interval - or once the oldest pending message is this many
+        seconds old
+    spill_path - if given, every message is also appended to this gzip file
+    on_close - called once the console is closed, e.g. to give up the
+        directory of the spill file
+    json_lines - write {"time", "call_id", "message"} records instead of text
+    call_id - tags JSON records
+    stream - where messages are written, stdout by default
+    '''
+
+    def __init__(self, max_lines=10000, flush_lines=100, flush_interval=2.0,
+                 spill_path=None, json_lines=False, call_id=None, stream=None,
+                 on_close=None):
+        self.lines = deque(maxlen=max_lines)
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.json_lines = json_lines
+        self.call_id = call_id
+        self.stream = stream
+        self.on_close = on_close
+        self.count = 0
+        self._pending = []
+        self._first_pending = None
+        self._timer = None
+        self._spill = gzip.open(spill_path, 'ab') if spill_path else None
+        self._lock = threading.Lock()
+
+    def _format(self, message):
+        if self.json_lines:
+            return json.dumps({'time': time.time(), 'call_id': self.call_id,
+                               'message': message})
+        return message
+
+    def append(self, message):
+        message = message if isinstance(message, basestring) else str(message)
+        with self._lock:
+            self.lines.append(message)
+            self.count += 1
+            now = time.time()
+            if not self._pending:
+                self._first_pending = now
+            self._pending.append(self._format(message))
+            if len(self._pending) >= self.flush_lines or \
+                    now - self._first_pending >= self.flush_interval:
+                self._flush()
+            elif self._timer is None:
+                # write the batch out in time even if no message follows
+                self._timer = threading.Timer(
+                    self._first_pending + self.flush_interval - now, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        text = '\n'.join(self._pending) + '\n'
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self._pending = []
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+        if self._spill is not None:
+            self._spill.write(text)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        '''Write out anything pending and close the spill file'''
+        with self._lock:
+            self._flush()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+    def tail(self, n=None):
+        '''Return the last n messages kept in memory'''
+        with self._lock:
+            lines = list(self.lines)
+        return lines if n is None else lines[-n:]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass contig filtering and assembly statistics.
+
+Contigs stream through once: they are length filtered, written out as FASTA
+and folded into a ContigStats accumulator. Only one integer per kept contig
+is retained (for N50 and the length histogram), never the sequences.
+"""
+import struct
+from array import array
+
+import numpy as np
+
+
+class ContigStats(object):
+    '''
+    Running statistics over a set of contigs. Fields:
+    count - the number of contigs.
+    total_length - the sum of the contig lengths in bp.
+    gc_count - the number of G and C bases.
+    '''
+
+    def __init__(self):
+        self.lengths = array('L')
+        self.total_length = 0
+        self.gc_count = 0
+
+    @property
+    def count(self):
+        return len(self.lengths)
+
+    def add(self, seq):
+        n = len(seq)
+        self.lengths.append(n)
+        self.total_length += n
+        self.gc_count += (seq.count('G') + seq.count('C') +
+                          seq.count('g') + seq.count('c'))
+
+    def add_length(self, length, gc_count=0):
+        self.lengths.append(length)
+        self.total_length += length
+        self.gc_count += gc_count
+
+    def _array(self):
+        return np.array(self.lengths, dtype=np.int64)
+
+    def average_length(self):
+        if not self.lengths:
+            return 0.0
+        return self.total_length / float(len(self.lengths))
+
+    def gc_content(self):
+        if not self.total_length:
+            return 0.0
+        return self.gc_count / float(self.total_length)
+
+    def n50(self):
+        '''Return (N50, L50); both 0 for an empty set'''
+        if not self.lengths:
+            return 0, 0
+        lengths = np.sort(self._array())[::-1]
+        cumulative = np.cumsum(lengths)
+        idx = int(np.searchsorted(cumulative, self.total_length / 2.0))
+        return int(lengths[idx]), idx + 1
+
+    def histogram(self, bins=10):
+        '''Return (counts, edges) as numpy.histogram does'''
+        if not self.lengths:
+            return np.zeros(bins, dtype=int), np.zeros(bins + 1)
+        return np.histogram(self._array(), bins)
+
+    def save(self, path):
+        '''Write the stats to path; the lengths are stored as raw integers'''
+        with open(path, 'wb') as f:
+            f.write(struct.pack('<QQQ', self.gc_count, self.total_length,
+                                len(self.lengths)))
+            np.array(self.lengths, dtype='<i8').tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        with open(path, 'rb') as f:
+            stats.gc_count, stats.total_length, count = struct.unpack(
+                '<QQQ', f.read(24))
+            stats.lengths.fromlist(
+                np.fromfile(f, dtype='<i8', count=count).tolist())
+        return stats
+
+    def to_dict(self):
+        n50, l50 = self.n50()
+        return {'count': self.count,
+                'total_length': self.total_length,
+                'average_length': self.average_length(),
+                'gc_content': self.gc_content(),
+                'n50': n50,
+                'l50': l50}
+
+
+def filter_contigs(contigs, out_path, min_len):
+    '''
+    Write contigs of at least min_len bp to out_path as FASTA.
+
+    contigs - an iterable of (header, sequence) tuples.
+    Returns a (kept, removed) pair of ContigStats.
+    '''
+    kept = ContigStats()
+    removed = ContigStats()
+    with open(out_path, 'w') as out:
+        for header, seq in contigs:
+            if len(seq) >= min_len:
+                out.write('>')
+                out.write(header)
+                out.write('\n')
+                out.write(seq)
+                out.write('\n')
+                kept.add(seq)
+            else:
+                removed.add_length(len(seq))
+    return kept, removed
+
+
+def format_stats(stats, bins=10):
+    '''Render the filtered contig section of the assembly report'''
+    n50, l50 = stats.n50()
+    report = 'Assembled into ' + str(stats.count) + ' contigs.\n'
+    report += 'Total Length: ' + str(stats.total_length) + ' bp.\n'
+    report += 'Average Length: ' + str(stats.average_length()) + ' bp.\n'
+    report += 'N50: ' + str(n50) + ' bp, L50: ' + str(l50) + '.\n'
+    report += 'GC Content: {:.2%}\n'.format(stats.gc_content())
+
+    # compute a simple contig length distribution
+    counts, edges = stats.histogram(bins)
+    report += 'Contig Length Distribution (# of contigs -- min to max basepairs):\n'
+    for c in range(bins):
+        report += '   '+str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' + str(edges[c+1]) + ' bp\n'
+    return report
+
+
+def check_thresholds(stats, min_n50=None, min_total_length=None,
+                     max_contigs=None):
+    '''Return the list of quality thresholds stats falls short of'''
+    failures = []
+    n50, _ = stats.n50()
+    if not stats.count:
+        failures.append('no contigs')
+    if min_n50 and n50 < min_n50:
+        failures.append('N50 {} < {}'.format(n50, min_n50))
+    if min_total_length and stats.total_length < min_total_length:
+        failures.append('total length {} < {}'.format(stats.total_length,
+                                                      min_total_length))
+    if max_contigs and stats.count > max_contigs:
+        failures.append('{} contigs > {}'.format(stats.count, max_contigs))
+    return failures
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Digital normalization: capping the k-mer coverage of reads before assembly.
+
+Reads stream through once. A read whose median k-mer abundance among the
+reads kept so far has reached the target coverage adds nothing new and is
+dropped, otherwise it is kept and its k-mers are counted. Mates are kept or
+dropped together, and a pair is kept if either mate is still below target.
+
+Abundances are held in a count-min sketch of fixed size, so memory does not
+grow with the input. K-mers are hashed in their canonical form, the lesser
+of the k-mer and its reverse complement, so both strands count together.
+
+Reads are scored in batches with numpy. A read is compared against the
+counts of the batches before its own, so a batch can keep a few more reads
+than one at a time would; with batches much smaller than the coverage of
+the input the difference is negligible.
+"""
+import logging
+
+import numpy as np
+
+from AssemblyRAST.preprocess import (INTERLEAVED, PAIRED, LibraryWriter, Stage, iter_library,
+                                     read_mask, units)
+
+logger = logging.getLogger(__name__)
+
+# A, C, G and T to 0..3, everything else, such as N, to 4
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _n, _bases in enumerate(('Aa', 'Cc', 'Gg', 'Tt')):
+    for _base in _bases:
+        _CODES[ord(_base)] = _n
+
+# odd multipliers of the hash of each sketch row
+_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                         0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53],
+                        dtype=np.uint64)
+
+_MAX_COUNT = np.iinfo(np.uint16).max
+
+
+class CountMinSketch(object):
+    '''
+    Approximate counts of 64 bit keys in depth rows of 2**bits saturating
+    16 bit counters. A count is never underestimated.
+    '''
+
+    def __init__(self, bits=22, depth=4):
+        if not 1 <= depth <= len(_MULTIPLIERS):
+            raise ValueError('depth must be between 1 and {}'.format(len(_MULTIPLIERS)))
+        self.bits = bits
+        self.depth = depth
+        self.table = np.zeros((depth, 1 << bits), dtype=np.uint16)
+
+    @classmethod
+    def for_bytes(cls, max_bytes, depth=4):
+        '''Return the largest sketch of depth rows within max_bytes'''
+        bits = int(np.log2(max(max_bytes // (depth * 2), 2)))
+        return cls(bits=bits, depth=depth)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def _slots(self, keys):
+        shift = np.uint64(64 - self.bits)
+        mixed = keys ^ (keys >> np.uint64(29))
+        return [(mixed * _MULTIPLIERS[row]) >> shift for row in range(self.depth)]
+
+    def get(self, keys):
+        '''Return the counts of an array of uint64 keys'''
+        if not len(keys):
+            return np.zeros(0, dtype=np.uint16)
+        slots = self._slots(keys)
+        counts = self.table[0][slots[0]]
+        for row in range(1, self.depth):
+            counts = np.minimum(counts, self.table[row][slots[row]])
+        return counts
+
+    def add(self, keys):
+        '''Count every occurrence of an array of uint64 keys'''
+        if not len(keys):
+            return
+        for row, slots in enumerate(self._slots(keys)):
+            slots, counts = np.unique(slots, return_counts=True)
+            total = self.table[row][slots].astype(np.int64) + counts
+            self.table[row][slots] = np.minimum(total, _MAX_COUNT)
+
+
+def kmer_hashes(batch, k):
+    '''
+    Return (keys, record) for the canonical k-mers of a RecordBatch: keys
+    as uint64, and the index of the record each came from. K-mers spanning
+    a base other than ACGT, or a line break, are skipped.
+    '''
+    if not 0 < k <= 32:
+        raise ValueError('k must be between 1 and 32')
+    positions = len(batch.buffer) - k + 1
+    if not len(batch) or positions <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    # everything outside the sequences is invalid, so no k-mer spans two reads
+    codes = np.where(batch.seq_mask(), _CODES[batch.buffer], 4)
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = np.flatnonzero((invalid[k:] - invalid[:positions]) == 0)
+    forward = np.zeros(len(valid), dtype=np.uint64)
+    reverse = np.zeros(len(valid), dtype=np.uint64)
+    bases = codes.astype(np.uint64)
+    for j in range(k):
+        window = bases[valid + j]
+        forward = (forward << np.uint64(2)) | window
+        reverse = reverse | ((np.uint64(3) - window) << np.uint64(2 * j))
+    return np.minimum(forward, reverse), batch.record_of(valid)
+
+
+def median_abundance(sketch, batch, k):
+    '''
+    Return the median sketch count of the k-mers of each record of a batch,
+    -1 for records without any, and the k-mer keys and record indices.
+    '''
+    keys, record = kmer_hashes(batch, k)
+    medians = np.full(len(batch), -1, dtype=np.int64)
+    if not len(keys):
+        return medians, keys, record
+    counts = sketch.get(keys)
+    # sorted by record, then count, the median of a record is in the middle of its run
+    order = np.lexsort((counts, record))
+    per_record = np.bincount(record, minlength=len(batch))
+    first = np.concatenate(([0], np.cumsum(per_record)[:-1]))
+    has = per_record > 0
+    middle = first[has] + (per_record[has] - 1) // 2
+    medians[has] = counts[order][middle]
+    return medians, keys, record
+
+
+class DigitalNormalization(Stage):
+    '''
+    target - the k-mer coverage kept reads are capped at
+    k - the k-mer size
+    sketch_bytes - the memory of the count-min sketch
+    batch_size - the number of reads or pairs scored at once
+    '''
+
+    name = 'diginorm'
+
+    def __init__(self, target=20, k=20, sketch_bytes=256 * 1024**2, batch_size=2000):
+        if target < 1:
+            raise ValueError('the normalization target must be at least 1')
+        if not 0 < k <= 32:
+            raise ValueError('k must be between 1 and 32')
+        self.target = target
+        self.k = k
+        self.sketch_bytes = sketch_bytes
+        self.batch_size = batch_size
+
+    def key(self):
+        # the sketch size changes which reads collide, so it is part of the key
+        return 'diginorm:target={}:k={}:bytes={}:batch={}'.format(
+            self.target, self.k, self.sketch_bytes, self.batch_size)
+
+    def run(self, layout, inputs, outputs):
+        sketch = CountMinSketch.for_bytes(self.sketch_bytes)
+        units_in = units_kept = bases_in = bases_kept = 0
+        with LibraryWriter(layout, outputs) as writer:
+            for batches in iter_library(layout, inputs, self.batch_size):
+                scored = [median_abundance(sketch, batch, self.k) for batch in batches]
+                # reads without k-mers tell nothing about coverage, so they are kept
+                below = [medians < self.target for medians, _, _ in scored]
+                if layout == PAIRED:
+                    keep = below[0] | below[1]
+                elif layout == INTERLEAVED:
+                    keep = below[0][0::2] | below[0][1::2]
+                else:
+                    keep = below[0]
+                reads = keep if layout == PAIRED else read_mask(layout, keep)
+                for batch, (_, keys, record) in zip(batches, scored):
+                    sketch.add(keys[reads[record]])
+                    bases_in += int(batch.lengths.sum())
+                    bases_kept += int(batch.lengths[reads].sum())
+                units_in += units(layout, batches)
+                units_kept += int(keep.sum())
+                writer.write(batches, keep)
+        logger.info('Normalized {} of {} reads or pairs to coverage {}'.format(
+            units_kept, units_in, self.target))
+        return {'units_in': units_in, 'units_kept': units_kept,
+                'bases_in': bases_in, 'bases_kept': bases_kept}
+
+    def describe(self, stats):
+        return 'Digital normalization to {}x (k={}): kept {} of {} reads or pairs, {} of {} bp'.format(
+            self.target, self.k, stats['units_kept'], stats['units_in'],
+            stats['bases_kept'], stats['bases_in'])
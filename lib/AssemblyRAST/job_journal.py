@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+A small durable journal of the stages of one assembly call.
+
+If the async job runner is restarted mid-job, a retried call with the same
+parameters finds the journal in scratch and resumes from the last stage it
+recorded, e.g. by reattaching to the ARAST job it had already submitted
+instead of starting the assembly again.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+SUBMITTED = 'submitted'
+COMPLETED = 'completed'
+CONTIGS_FETCHED = 'contigs_fetched'
+ASSEMBLY_SAVED = 'assembly_saved'
+REPORT_SAVED = 'report_saved'
+
+STAGES = (SUBMITTED, COMPLETED, CONTIGS_FETCHED, ASSEMBLY_SAVED, REPORT_SAVED)
+
+
+def call_key(user_id, method, params):
+    '''Identify a call by who made it, what it runs and its parameters'''
+    return hashlib.sha256(json.dumps([user_id, method, params],
+                                     sort_keys=True)).hexdigest()
+
+
+class JobJournal(object):
+    '''
+    The journal of one call, stored as JSON at path. Each recorded stage
+    maps to the data needed to resume after it.
+
+    finished_ttl - seconds a journal that reached REPORT_SAVED is honoured;
+        after that an identical call is treated as a new one
+    stale_ttl - seconds an unfinished journal is kept since it last changed
+    '''
+
+    def __init__(self, path, finished_ttl=3600, stale_ttl=7 * 24 * 3600):
+        self.path = path
+        self.stages = {}
+        try:
+            with open(path) as f:
+                self.stages = json.load(f)
+        except (IOError, ValueError):
+            self.stages = {}
+        finished = self.stages.get(REPORT_SAVED)
+        if finished and time.time() - finished['time'] > finished_ttl:
+            self.clear()
+        elif self.stages:
+            logger.info('Resuming from journal {} at stage {}'.format(
+                path, self.last_stage()))
+
+    @classmethod
+    def for_call(cls, directory, user_id, method, params, **kwargs):
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        cls.sweep(directory, **kwargs)
+        key = call_key(user_id, method, params)
+        return cls(os.path.join(directory, key + '.json'), **kwargs)
+
+    @staticmethod
+    def sweep(directory, finished_ttl=3600, stale_ttl=7 * 24 * 3600):
+        '''
+        Remove the journals in directory of calls that are never repeated:
+        finished ones past finished_ttl and ones unchanged for stale_ttl,
+        with the temporary files of writes that did not complete.
+        '''
+        now = time.time()
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                expired = now - os.path.getmtime(path) > stale_ttl
+                if not expired and name.endswith('.json'):
+                    with open(path) as f:
+                        finished = json.load(f).get(REPORT_SAVED)
+                    expired = bool(finished) and now - finished['time'] > finished_ttl
+                if expired:
+                    os.remove(path)
+                    logger.info('Removed expired journal {}'.format(path))
+            except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+                continue
+
+    def done(self, stage):
+        return stage in self.stages
+
+    def get(self, stage):
+        return self.stages.get(stage)
+
+    def last_stage(self):
+        for stage in reversed(STAGES):
+            if stage in self.stages:
+                return stage
+        return None
+
+    def record(self, stage, **data):
+        if stage not in STAGES:
+            raise ValueError('Unknown journal stage ' + stage)
+        data['time'] = time.time()
+        self.stages[stage] = data
+        directory = os.path.dirname(self.path)
+        fd, tmp = tempfile.mkstemp(prefix='.journal.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.stages, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def clear(self):
+        self.stages = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
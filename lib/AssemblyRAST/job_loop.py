@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+A small coroutine loop for driving many ARAST jobs from one thread.
+
+Python 2 has no asyncio, so coroutines are plain generators in the style of
+tornado.gen: they yield what they wait for and finish with raise Return(v).
+
+    Sleep(seconds)       resume after the given time
+    Call(fn, *args)      run a blocking call on a worker thread, resume with
+                         its result (or have its exception raised inside)
+    another generator    run it as a sub-coroutine, resume with its result
+
+Nearly all the wall time of an assembly is spent waiting for ARAST, which
+is a Sleep, so one JobLoop can keep dozens of jobs in flight with only a
+handful of worker threads for the short blocking calls. run_sync() drives
+the same coroutines on the calling thread for the synchronous methods.
+"""
+import collections
+import heapq
+import itertools
+import logging
+import sys
+import time
+import types
+import Queue
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+class Return(Exception):
+    '''Raised by a coroutine to finish with a value'''
+
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+class Sleep(object):
+    '''
+    Wait before resuming. Fields:
+    seconds - how long to wait.
+    job_id - the ARAST job being waited for, if any.
+    cancel - a threading.Event that cuts the sleep short once set.
+    '''
+
+    def __init__(self, seconds, job_id=None, cancel=None):
+        self.seconds = seconds
+        self.job_id = job_id
+        self.cancel = cancel
+
+
+class Call(object):
+    '''A blocking call to run off the loop thread'''
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.fn(*self.args, **self.kwargs)
+
+
+def _sleep(step):
+    if step.cancel is not None:
+        step.cancel.wait(step.seconds)
+    else:
+        time.sleep(step.seconds)
+
+
+def run_sync(coro, sleep=_sleep):
+    '''
+    Drive a coroutine to completion on the calling thread and return its
+    value. sleep(step) is called for every Sleep the coroutine yields.
+    '''
+    value = None
+    exc_info = None
+    while True:
+        try:
+            if exc_info is not None:
+                step = coro.throw(*exc_info)
+            else:
+                step = coro.send(value)
+        except Return as r:
+            return r.value
+        except StopIteration:
+            return None
+        value = None
+        exc_info = None
+        try:
+            if isinstance(step, Sleep):
+                sleep(step)
+            elif isinstance(step, Call):
+                value = step()
+            elif isinstance(step, types.GeneratorType):
+                value = run_sync(step, sleep)
+            else:
+                raise TypeError('Cannot wait for {!r}'.format(step))
+        except Exception:
+            exc_info = sys.exc_info()
+
+
+class _Task(object):
+
+    def __init__(self, coro, parent=None):
+        self.coro = coro
+        self.parent = parent
+        self.result = None
+        self.exc_info = None
+
+
+class JobLoop(object):
+    '''
+    Runs coroutines concurrently on one thread.
+
+    workers - the number of threads for Call steps
+    '''
+
+    def __init__(self, workers=4):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.workers = workers
+
+    def run(self, coros, limit=None):
+        '''
+        Run the coroutines, at most limit at a time if given, and return
+        their values in order. If any of them raised, the first such
+        exception is re-raised once all of them have finished.
+        '''
+        coros = list(coros)
+        tasks = []
+        self._ready = collections.deque()
+        self._timers = []
+        self._completed = Queue.Queue()
+        self._seq = itertools.count()
+        self._calls = 0
+        active = 0
+        pool = ThreadPool(self.workers)
+        try:
+            while True:
+                while len(tasks) < len(coros) and (limit is None or active < limit):
+                    task = _Task(coros[len(tasks)])
+                    tasks.append(task)
+                    self._ready.append((task, None, None))
+                    active += 1
+                if not active:
+                    break
+                while self._ready:
+                    task, value, exc_info = self._ready.popleft()
+                    if self._step(pool, task, value, exc_info) and task.parent is None:
+                        active -= 1
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    self._ready.append((heapq.heappop(self._timers)[2], None, None))
+                # a task may have cancelled the sleep of others
+                cancelled = [timer for timer in self._timers
+                             if timer[3] is not None and timer[3].is_set()]
+                if cancelled:
+                    self._timers = [timer for timer in self._timers if timer not in cancelled]
+                    heapq.heapify(self._timers)
+                    self._ready.extend((timer[2], None, None) for timer in cancelled)
+                if self._ready or not active:
+                    continue
+                if self._timers:
+                    timeout = self._timers[0][0] - now
+                elif self._calls:
+                    timeout = 3600
+                else:
+                    raise RuntimeError('JobLoop has unfinished tasks with nothing to wait for')
+                try:
+                    self._ready.append(self._completed.get(timeout=timeout))
+                    self._calls -= 1
+                except Queue.Empty:
+                    pass
+        finally:
+            pool.close()
+            pool.join()
+        for task in tasks:
+            if task.exc_info is not None:
+                raise task.exc_info[0], task.exc_info[1], task.exc_info[2]
+        return [task.result for task in tasks]
+
+    def _step(self, pool, task, value, exc_info):
+        '''Advance a task by one step; return True once it has finished'''
+        try:
+            if exc_info is not None:
+                step = task.coro.throw(*exc_info)
+            else:
+                step = task.coro.send(value)
+        except Return as r:
+            return self._finish(task, r.value, None)
+        except StopIteration:
+            return self._finish(task, None, None)
+        except Exception:
+            return self._finish(task, None, sys.exc_info())
+        if isinstance(step, Sleep):
+            heapq.heappush(self._timers, (time.time() + step.seconds, next(self._seq), task,
+                                          step.cancel))
+        elif isinstance(step, Call):
+            self._calls += 1
+            pool.apply_async(self._work, (task, step))
+        elif isinstance(step, types.GeneratorType):
+            self._ready.append((_Task(step, parent=task), None, None))
+        else:
+            try:
+                raise TypeError('Cannot wait for {!r}'.format(step))
+            except TypeError:
+                self._ready.append((task, None, sys.exc_info()))
+        return False
+
+    def _work(self, task, call):
+        try:
+            self._completed.put((task, call(), None))
+        except Exception:
+            self._completed.put((task, None, sys.exc_info()))
+
+    def _finish(self, task, value, exc_info):
+        if task.parent is not None:
+            self._ready.append((task.parent, value, exc_info))
+        else:
+            task.result = value
+            task.exc_info = exc_info
+        return True
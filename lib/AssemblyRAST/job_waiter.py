@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Waiting for ARAST jobs without blocking on ar-get -w.
+
+JobWaiter polls the job status with an adaptive backoff, reports state
+transitions, and raises as soon as ARAST reports a terminal failure. A
+notifier can wake the waiter early, e.g. when a local stand-in backend
+signals that a job changed state.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from AssemblyRAST.arast_client import ArastError
+from AssemblyRAST.job_loop import Call, Return, Sleep, run_sync
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+TERMINAL_STATES = frozenset([COMPLETE, FAILED])
+
+# the words ARAST starts a terminal failure status with; the status of a
+# running job names its stage, which may well contain 'error' or 'kill'
+_FAILURE = re.compile(r'(fail|failed|terminated|killed|exception)\b')
+
+
+def classify_status(status):
+    '''Map a free text ARAST job status onto one of the job states'''
+    lowered = (status or '').strip().lower()
+    if lowered.startswith('complete'):
+        return COMPLETE
+    if _FAILURE.match(lowered):
+        return FAILED
+    if not lowered or 'queue' in lowered or 'pending' in lowered:
+        return QUEUED
+    return RUNNING
+
+
+class ArastJobFailed(ArastError):
+    '''
+    An ARAST job reached a terminal failure state. Fields:
+    status - the status string reported by ARAST.
+    log - the tail of the ARAST job log, if it could be fetched.
+    '''
+
+    def __init__(self, job_id, status, log=None):
+        message = 'ARAST job {} failed: {}'.format(job_id, status)
+        if log:
+            message += '\n' + log
+        super(ArastJobFailed, self).__init__(message, job_id=job_id)
+        self.status = status
+        self.log = log
+
+
+class ArastJobCancelled(ArastError):
+    '''Waiting for an ARAST job was abandoned by the caller'''
+
+    def __init__(self, job_id):
+        super(ArastJobCancelled, self).__init__(
+            'Stopped waiting for ARAST job {}'.format(job_id), job_id=job_id)
+
+
+class SleepNotifier(object):
+    '''The default notifier, which simply sleeps out the poll interval'''
+
+    def wait(self, job_id, timeout):
+        time.sleep(timeout)
+        return False
+
+
+class EventNotifier(object):
+    '''
+    A notifier a local backend can signal with notify(job_id) to wake up
+    anybody waiting on that job before their poll interval ends.
+    '''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = set()
+
+    def notify(self, job_id):
+        with self._cond:
+            self._pending.add(str(job_id))
+            self._cond.notify_all()
+
+    def wait(self, job_id, timeout):
+        job_id = str(job_id)
+        deadline = time.time() + timeout
+        with self._cond:
+            while job_id not in self._pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._pending.discard(job_id)
+            return True
+
+
+class JobWaiter(object):
+    '''
+    Waits for ARAST jobs to finish.
+
+    client - an ArastClient
+    notifier - an object with wait(job_id, timeout), see EventNotifier
+    initial_interval - seconds before the first re-poll
+    scale - factor the interval grows by while the state is unchanged
+    max_interval - cap on the poll interval in seconds
+    max_wait - give up after this many seconds, None waits forever
+    log_lines - number of trailing log lines attached to a failure
+    '''
+
+    def __init__(self, client, notifier=None, initial_interval=1.0,
+                 scale=1.5, max_interval=60.0, max_wait=None, log_lines=50):
+        self.client = client
+        self.notifier = notifier or SleepNotifier()
+        self.initial_interval = initial_interval
+        self.scale = scale
+        self.max_interval = max_interval
+        self.max_wait = max_wait
+        self.log_lines = log_lines
+
+    def _failure(self, job_id, status):
+        try:
+            log = '\n'.join(deque(self.client.iter_log_lines(job_id),
+                                  maxlen=self.log_lines))
+        except ArastError as e:
+            logger.warning('Unable to fetch log for job {}: {}'.format(
+                job_id, e))
+            log = None
+        return ArastJobFailed(job_id, status, log)
+
+    def poll(self, job_id):
+        '''Return the (state, status) of a job right now'''
+        status = self.client.get_status(job_id)
+        return classify_status(status), status
+
+    def sleep(self, step):
+        '''Sleep out a Sleep step of wait_co on the calling thread'''
+        if step.cancel is not None and isinstance(self.notifier, SleepNotifier):
+            step.cancel.wait(step.seconds)
+        else:
+            self.notifier.wait(step.job_id, step.seconds)
+
+    def wait(self, job_id, on_state=None, cancel=None):
+        '''
+        Block until the job completes and return its final status string.
+        on_state(state, status) is called on every state transition.
+        Raises ArastJobFailed as soon as ARAST reports a failure, and
+        ArastJobCancelled once the cancel threading.Event is set.
+        '''
+        return run_sync(self.wait_co(job_id, on_state, cancel), self.sleep)
+
+    def wait_co(self, job_id, on_state=None, cancel=None):
+        '''The coroutine behind wait, for use in a JobLoop'''
+        start = time.time()
+        interval = self.initial_interval
+        last_state = None
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise ArastJobCancelled(job_id)
+            state, status = yield Call(self.poll, job_id)
+            if state != last_state:
+                logger.info('ARAST job {} is {}: {}'.format(
+                    job_id, state, status))
+                if on_state is not None:
+                    on_state(state, status)
+                last_state = state
+                interval = self.initial_interval
+            if state == COMPLETE:
+                raise Return(status)
+            if state == FAILED:
+                raise (yield Call(self._failure, job_id, status))
+            if self.max_wait is not None and \
+                    time.time() - start + interval > self.max_wait:
+                raise ArastError('Timed out after {}s waiting for ARAST job '
+                                 '{} ({})'.format(self.max_wait, job_id,
+                                                  status), job_id=job_id)
+            yield Sleep(interval, job_id=job_id, cancel=cancel)
+            interval = min(interval * self.scale, self.max_interval)
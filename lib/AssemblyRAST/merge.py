@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Merging of overlapping mates into single reads before assembly.
+
+When the insert of a pair is shorter than its two reads together, the end
+of read 1 and the reverse complement of read 2 cover the same bases, and
+the pair can be replaced by one longer read. Every overlap from
+min_overlap on is scored for a whole batch of pairs at once, as the
+mismatches between the tail of read 1 and the head of the reverse
+complement of read 2, both held as rows of a numpy matrix. The overlap
+with the lowest mismatch rate, the longest of equals, is taken if that rate
+is at most max_mismatch_rate. Where the mates disagree the base of higher
+quality wins. Mates overlapping past each other's start, where the insert
+is shorter than a read, are left to adapter trimming and not merged.
+
+PairMerging is a ChunkedStage: chunks of pairs are merged in worker
+processes. Every paired library comes out as the pairs that did not merge,
+in their own layout, and a single end library of the merged reads. FASTA
+pairs have no qualities and are passed through unmerged.
+"""
+import io
+import logging
+
+import numpy as np
+
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED, SINGLE, ChunkedStage
+from AssemblyRAST.seqfile import FASTQ, gather
+
+logger = logging.getLogger(__name__)
+
+_N = ord('N')
+
+_COMPLEMENT = np.arange(256, dtype=np.uint8)
+for _base, _other in zip('ACGTNacgtn', 'TGCANtgcan'):
+    _COMPLEMENT[ord(_base)] = ord(_other)
+
+
+def _rows(buf, starts, lengths, width, right=False):
+    '''Return the slices of buf at starts as the rows of a matrix, padded with zeros'''
+    rows = np.zeros((len(starts), width), dtype=np.uint8)
+    columns = np.arange(width)
+    if right:
+        mask = columns >= width - lengths[:, None]
+    else:
+        mask = columns < lengths[:, None]
+    rows[mask] = gather(buf, starts, lengths)
+    return rows
+
+
+def best_overlaps(tails, heads, lengths_1, lengths_2, min_overlap=20, max_mismatch_rate=0.1):
+    '''
+    Return the overlap of every pair, 0 for pairs not overlapping well
+    enough. tails holds read 1 of every pair right aligned, heads the
+    reverse complement of read 2 left aligned. N matches any base.
+    '''
+    best = np.zeros(len(tails), dtype=np.int64)
+    best_rate = np.full(len(tails), np.inf)
+    longest = np.minimum(lengths_1, lengths_2)
+    for overlap in range(min_overlap, min(tails.shape[1], heads.shape[1]) + 1):
+        tail = tails[:, tails.shape[1] - overlap:]
+        head = heads[:, :overlap]
+        mismatches = ((tail != head) & (tail != _N) & (head != _N)).sum(axis=1)
+        rate = mismatches / float(overlap)
+        better = (overlap <= longest) & (rate <= max_mismatch_rate) & (rate <= best_rate)
+        best[better] = overlap
+        best_rate[better] = rate[better]
+    return best
+
+
+def merge_pairs(batch_1, batch_2, min_overlap=20, max_mismatch_rate=0.1):
+    '''
+    Merge the overlapping mates of two FASTQ RecordBatches. Return a bool
+    array of the pairs merged, the lengths of the merged reads, and the
+    merged reads as FASTQ bytes, named after read 1.
+    '''
+    lengths_1, lengths_2 = batch_1.lengths, batch_2.lengths
+    width_1, width_2 = int(lengths_1.max()), int(lengths_2.max())
+    seqs_1 = _rows(batch_1.buffer, batch_1.seq_starts, lengths_1, width_1)
+    quals_1 = _rows(batch_1.buffer, batch_1.qual_starts, lengths_1, width_1)
+    # read 2 reverse complemented: its rows right aligned and read backwards
+    seqs_2 = _COMPLEMENT[_rows(batch_2.buffer, batch_2.seq_starts, lengths_2, width_2, True)[:, ::-1]]
+    quals_2 = _rows(batch_2.buffer, batch_2.qual_starts, lengths_2, width_2, True)[:, ::-1]
+    tails = _rows(batch_1.buffer, batch_1.seq_starts, lengths_1, width_1, True)
+    overlaps = best_overlaps(tails, seqs_2, lengths_1, lengths_2, min_overlap, max_mismatch_rate)
+    merged = overlaps > 0
+    index = np.flatnonzero(merged)
+    if not len(index):
+        return merged, np.zeros(0, dtype=np.int64), b''
+
+    lengths_1, lengths_2, overlaps = lengths_1[index], lengths_2[index], overlaps[index]
+    shift = (lengths_1 - overlaps)[:, None]
+    columns = np.arange(width_1 + width_2, dtype=np.int32)[None, :]
+    in_1 = columns < lengths_1[:, None]
+    at_2 = columns - shift
+    in_2 = (at_2 >= 0) & (at_2 < lengths_2[:, None])
+    rows = index[:, None]
+    at_1 = np.minimum(columns, width_1 - 1)
+    at_2 = np.clip(at_2, 0, width_2 - 1)
+    base_1, qual_1 = seqs_1[rows, at_1], quals_1[rows, at_1]
+    base_2, qual_2 = seqs_2[rows, at_2], quals_2[rows, at_2]
+    from_2 = in_2 & (~in_1 | (qual_2 > qual_1))
+    merged_lengths = lengths_1 + lengths_2 - overlaps
+    valid = columns < merged_lengths[:, None]
+    bases = np.where(from_2, base_2, base_1)[valid]
+    quals = np.where(from_2, qual_2, qual_1)[valid]
+
+    starts, ends = batch_1.name_bounds()
+    starts, ends = starts[index], ends[index]
+    buf = batch_1.buffer
+    # read 1 is named r/1 or r, the merged read r
+    suffix = (ends - starts >= 2) & (buf[np.maximum(ends - 2, 0)] == ord('/')) & \
+        (buf[np.maximum(ends - 1, 0)] == ord('1'))
+    ends = ends - 2 * suffix
+    source = np.concatenate((buf, bases, quals, np.frombuffer(b'\n+\n@', dtype=np.uint8)))
+    seq_at = len(buf) + np.concatenate(([0], np.cumsum(merged_lengths)[:-1]))
+    qual_at = seq_at + len(bases)
+    literal = len(buf) + 2 * len(bases)
+    n = len(index)
+    # "@", name, "\n", bases, "\n+\n", qualities, "\n"
+    segments = np.column_stack((np.full(n, literal + 3), starts, np.full(n, literal), seq_at,
+                                np.full(n, literal), qual_at, np.full(n, literal)))
+    sizes = np.column_stack((np.ones(n, np.int64), ends - starts, np.ones(n, np.int64),
+                             merged_lengths, np.full(n, 3), merged_lengths, np.ones(n, np.int64)))
+    return merged, merged_lengths, gather(source, segments.ravel(), sizes.ravel()).tostring()
+
+
+class PairMerging(ChunkedStage):
+    '''
+    min_overlap - the fewest bases mates must overlap by to be merged
+    max_mismatch_rate - the largest fraction of the overlap the mates may disagree on
+    workers - the number of chunks merged at once in pool
+    pool - the multiprocessing.Pool chunks are merged in, None to merge in this process
+    chunk_size - the number of pairs merged by a worker at once
+    '''
+
+    name = 'merge'
+    stat_keys = ('pairs_in', 'pairs_merged', 'mate_bases', 'merged_bases')
+
+    def __init__(self, min_overlap=20, max_mismatch_rate=0.1, workers=4, chunk_size=20000,
+                 pool=None):
+        if min_overlap < 1:
+            raise ValueError('the minimum overlap must be at least 1')
+        if not 0 <= max_mismatch_rate < 1:
+            raise ValueError('the mismatch rate must be at least 0 and below 1')
+        self.min_overlap = min_overlap
+        self.max_mismatch_rate = max_mismatch_rate
+        self.workers = workers
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+    def key(self):
+        return 'merge:min_overlap={}:max_mismatch_rate={}'.format(
+            self.min_overlap, self.max_mismatch_rate)
+
+    def applies_to(self, layout):
+        return layout in (PAIRED, INTERLEAVED)
+
+    def output_layouts(self, layout):
+        return [(layout, None), (SINGLE, 'merged')]
+
+    def process_chunk(self, layout, batches):
+        if layout == PAIRED:
+            mates = batches
+        else:
+            batch = batches[0]
+            mates = [batch.subset(np.arange(0, len(batch), 2)),
+                     batch.subset(np.arange(1, len(batch), 2))]
+        merged, lengths, data = np.zeros(len(mates[0]), dtype=bool), np.zeros(0, np.int64), b''
+        if all(mate.format == FASTQ for mate in mates):
+            merged, lengths, data = merge_pairs(mates[0], mates[1], self.min_overlap,
+                                                self.max_mismatch_rate)
+        outputs = []
+        for batch in batches:
+            out = io.BytesIO()
+            batch.write(out, ~merged if layout == PAIRED else np.repeat(~merged, 2))
+            outputs.append(out.getvalue())
+        outputs.append(data)
+        stats = {'pairs_in': len(merged), 'pairs_merged': int(merged.sum()),
+                 'mate_bases': sum(int(mate.lengths[merged].sum()) for mate in mates),
+                 'merged_bases': int(lengths.sum())}
+        return outputs, stats
+
+    def run(self, layout, inputs, outputs):
+        stats = ChunkedStage.run(self, layout, inputs, outputs)
+        logger.info('Merged {} of {} pairs'.format(stats['pairs_merged'], stats['pairs_in']))
+        return stats
+
+    def describe(self, stats):
+        return 'Pair merging (min overlap {}): merged {} of {} pairs, {} bp of mates into {} bp'.format(
+            self.min_overlap, stats['pairs_merged'], stats['pairs_in'],
+            stats['mate_bases'], stats['merged_bases'])
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-assembly stages run on staged reads.
+
+A stage reads the local files of one library and writes new files, which
+replace the originals in the kbase_assembly_input sent to ARAST. Most
+stages write a library of the same layout; a stage may also split off
+further libraries, such as single reads made of merged pairs. Stages are
+deterministic, so ReadStager caches their output under a key made of the
+stage and its input, and a library is only processed once for a given
+setting.
+
+Libraries come in three layouts: paired (handle_1 and handle_2), interleaved
+(mates one after the other in one file) and single. Stages read a library
+in batches of reads or pairs, as one seqfile.RecordBatch per file, and
+decide with numpy which of them to keep. A ChunkedStage hands chunks of a
+library to a pool of worker processes and writes what they return in order.
+
+The pool is made once, by the caller, before any thread is started: its
+workers are forked, and a child forked while another thread holds a lock,
+such as that of logging or of the read cache, can deadlock on it. The
+server makes its pool in the AssemblyRAST constructor, before LocalShock
+starts serving.
+"""
+import collections
+import itertools
+import logging
+
+import numpy as np
+
+from AssemblyRAST.seqfile import iter_batches, parse_buffer
+
+logger = logging.getLogger(__name__)
+
+PAIRED = 'paired'
+INTERLEAVED = 'interleaved'
+SINGLE = 'single'
+
+LAYOUT_SLOTS = ((PAIRED, ('handle_1', 'handle_2')),
+                (INTERLEAVED, ('handle_1',)),
+                (SINGLE, ('handle',)))
+
+
+def slots_of(layout):
+    '''Return the handle slots of a layout'''
+    return dict(LAYOUT_SLOTS)[layout]
+
+
+def layout_of(lib):
+    '''
+    Return (layout, slots) of a read library, (None, ()) if it has no reads.
+    An interleaved library holds its file in handle_1, with the interleaved
+    flag set and no handle_2, as combine_read_libs builds it.
+    '''
+    if isinstance(lib.get('handle_1'), dict):
+        if isinstance(lib.get('handle_2'), dict):
+            return PAIRED, slots_of(PAIRED)
+        if lib.get('interleaved'):
+            return INTERLEAVED, slots_of(INTERLEAVED)
+    if isinstance(lib.get('handle'), dict):
+        return SINGLE, slots_of(SINGLE)
+    return None, ()
+
+
+def iter_library(layout, paths, batch_size):
+    '''
+    Yield the reads of a library in batches of batch_size reads or pairs,
+    as a list of one RecordBatch per file. Both batches of a paired library
+    hold the same number of reads, and the batches of an interleaved one an
+    even number, mates following each other.
+    '''
+    if layout == PAIRED:
+        for batch_1, batch_2 in itertools.izip_longest(iter_batches(paths[0], max_records=batch_size),
+                                                       iter_batches(paths[1], max_records=batch_size)):
+            if batch_1 is None or batch_2 is None or len(batch_1) != len(batch_2):
+                raise ValueError('{} and {} have different numbers of reads'.format(*paths))
+            yield [batch_1, batch_2]
+    elif layout == INTERLEAVED:
+        for batch in iter_batches(paths[0], max_records=2 * batch_size):
+            if len(batch) % 2:
+                raise ValueError('{} has an odd number of reads'.format(paths[0]))
+            yield [batch]
+    else:
+        for batch in iter_batches(paths[0], max_records=batch_size):
+            yield [batch]
+
+
+def units(layout, batches):
+    '''Return the number of reads or pairs in the batches of a library'''
+    return len(batches[0]) // 2 if layout == INTERLEAVED else len(batches[0])
+
+
+def read_mask(layout, keep):
+    '''Expand a mask over the reads or pairs of an interleaved batch to its reads'''
+    return np.repeat(keep, 2) if layout == INTERLEAVED else keep
+
+
+class LibraryWriter(object):
+    '''Writes the kept reads of library batches, keeping mates together'''
+
+    def __init__(self, layout, paths):
+        self.layout = layout
+        self.files = [open(path, 'wb') for path in paths]
+
+    def write(self, batches, keep=None):
+        '''Write the reads or pairs of batches where the bool array keep is set'''
+        if keep is not None:
+            keep = read_mask(self.layout, keep)
+        for f, batch in zip(self.files, batches):
+            batch.write(f, keep)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Stage(object):
+    '''
+    A pre-assembly stage. Subclasses set name and implement key, run and
+    describe.
+    '''
+
+    name = None
+
+    def key(self):
+        '''Return a string identifying the stage and every setting changing its output'''
+        raise NotImplementedError()
+
+    def applies_to(self, layout):
+        '''Return False if libraries of layout are to be passed by unchanged'''
+        return True
+
+    def output_layouts(self, layout):
+        '''
+        Return (layout, label) of every library written from a library of
+        layout, the first being the one it is processed into, of its own
+        layout. Files of the others are named after their label.
+        '''
+        return [(layout, None)]
+
+    def run(self, layout, inputs, outputs):
+        '''
+        Process the library in the files inputs into the files outputs, those
+        of every library of output_layouts in turn, and return a dict of
+        statistics for describe.
+        '''
+        raise NotImplementedError()
+
+    def describe(self, stats):
+        '''Return a line for the report from the statistics of run'''
+        raise NotImplementedError()
+
+
+def run_chunk(task):
+    '''Process one chunk of a library in a pool worker, task being (stage, layout, data)'''
+    stage, layout, data = task
+    batches = [parse_buffer(np.frombuffer(chunk, dtype=np.uint8), True)[0] for chunk in data]
+    return stage.process_chunk(layout, batches)
+
+
+class ChunkedStage(Stage):
+    '''
+    A stage processing a library chunk by chunk in worker processes.
+    Subclasses set stat_keys, the statistics summed over the chunks, and
+    implement process_chunk. Fields:
+    pool - the multiprocessing.Pool chunks are processed in, made before
+        any thread started; None to process them in this process.
+    workers - the number of chunks processed in the pool at once.
+    chunk_size - the number of reads or pairs of a chunk.
+    '''
+
+    stat_keys = ()
+    pool = None
+    workers = 1
+    chunk_size = 50000
+
+    def __getstate__(self):
+        # the stage goes to the workers with every chunk, its pool stays here
+        state = dict(self.__dict__)
+        state.pop('pool', None)
+        return state
+
+    def process_chunk(self, layout, batches):
+        '''
+        Process one chunk, one RecordBatch per file of the library, and
+        return the bytes to append to every output file and a dict of
+        statistics.
+        '''
+        raise NotImplementedError()
+
+    def _tasks(self, layout, inputs):
+        for batches in iter_library(layout, inputs, self.chunk_size):
+            yield self, layout, [batch.buffer[batch.starts[0]:batch.ends[-1]].tostring()
+                                 for batch in batches]
+
+    def _results(self, layout, inputs):
+        '''Yield the results of the chunks in order, keeping the pool a few chunks ahead at most'''
+        tasks = self._tasks(layout, inputs)
+        if self.pool is None or self.workers <= 1:
+            for task in tasks:
+                yield run_chunk(task)
+            return
+        # the pool is shared, so chunks still in flight on an error simply finish
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(self.pool.apply_async(run_chunk, (task,)))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def run(self, layout, inputs, outputs):
+        stats = dict((key, 0) for key in self.stat_keys)
+        files = [open(path, 'wb') for path in outputs]
+        try:
+            for data, chunk_stats in self._results(layout, inputs):
+                for f, chunk in zip(files, data):
+                    f.write(chunk)
+                for key, value in chunk_stats.items():
+                    stats[key] += value
+        finally:
+            for f in files:
+                f.close()
+        return stats
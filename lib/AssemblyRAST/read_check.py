@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Integrity checks of staged reads before they are submitted to ARAST.
+
+Truncated files, mates out of step and interleaved files with a read
+missing otherwise only show up once ARAST has queued the job, copied the
+reads and run part of the pipeline. ReadChecker reads every file once, in
+a process pool, and returns every problem found, so a job with broken
+input fails before it is submitted.
+
+Each file is scanned on its own, in a multiprocessing.Pool made before any
+thread started, since its forked workers would inherit the locks other
+threads hold (see preprocess). A file must parse, and in FASTQ its
+sequence and quality lengths must agree; the mates of an interleaved file
+must follow each other. The two files of a paired library are compared
+through what their workers send back: the record counts, and a digest of
+the read names of every block of reads. Names are compared without their
+/1 and /2 suffix, and Casava 1.8 headers differ only after the whitespace.
+Only when a block digest differs are the two files read again, up to that
+block, to name the first read out of step.
+"""
+import itertools
+import logging
+
+import numpy as np
+
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED
+from AssemblyRAST.seqfile import FASTQ, iter_batches
+
+logger = logging.getLogger(__name__)
+
+_POWER = np.uint64(0x100000001B3)
+_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def _mix(keys):
+    keys = keys ^ (keys >> np.uint64(31))
+    keys = keys * _MIX
+    return keys ^ (keys >> np.uint64(29))
+
+
+def pair_keys(batch):
+    '''
+    Return a uint64 hash of the name of each record of a RecordBatch,
+    leaving out a /1 or /2 suffix so that mates hash alike.
+    '''
+    buf = batch.buffer
+    starts, ends = batch.name_bounds()
+    last = buf[np.maximum(ends - 1, 0)]
+    suffix = (ends - starts >= 2) & (buf[np.maximum(ends - 2, 0)] == ord('/')) & \
+        ((last == ord('1')) | (last == ord('2')))
+    ends = ends - 2 * suffix
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return _mix(lengths.astype(np.uint64))
+    firsts = np.concatenate(([0], np.cumsum(lengths)))
+    # the position of every name byte within its name
+    within = np.arange(total) - np.repeat(firsts[:-1], lengths)
+    powers = np.full(int(lengths.max()), _POWER, dtype=np.uint64)
+    powers[0] = 1
+    powers = np.cumprod(powers, dtype=np.uint64)
+    values = (buf[np.repeat(starts, lengths) + within].astype(np.uint64) + np.uint64(1)) * \
+        powers[within]
+    sums = np.zeros(total + 1, dtype=np.uint64)
+    np.cumsum(values, out=sums[1:])
+    return _mix((sums[firsts[1:]] - sums[firsts[:-1]]) ^ lengths.astype(np.uint64))
+
+
+def _describe_record(batch, i, first):
+    return 'read {} ({})'.format(first + i + 1, batch.name(i))
+
+
+def scan_file(task):
+    '''
+    Check one read file, task being (path, block, interleaved). Runs in a
+    pool worker, so the result is a plain dict. Fields:
+    path - the file checked.
+    format - FASTQ or FASTA, None if empty or unreadable.
+    records, bases - the number of reads and bases read.
+    digests - a digest of the read names of every block of reads.
+    problems - what is wrong with the file on its own.
+    '''
+    path, block, interleaved = task
+    result = {'path': path, 'format': None, 'records': 0, 'bases': 0,
+              'digests': [], 'problems': []}
+    problems = result['problems']
+    bad_lengths = bad_mates = 0
+    try:
+        for batch in iter_batches(path, max_records=block):
+            first = result['records']
+            result['format'] = batch.format
+            result['records'] += len(batch)
+            result['bases'] += int(batch.lengths.sum())
+            keys = pair_keys(batch)
+            order = np.arange(first, first + len(batch), dtype=np.uint64)
+            result['digests'].append(int(_mix(keys + order).sum(dtype=np.uint64)))
+            if batch.format == FASTQ:
+                bad = np.flatnonzero(batch.lengths != batch.qual_lengths())
+                if len(bad) and not bad_lengths:
+                    problems.append('{} has {} bases but {} qualities'.format(
+                        _describe_record(batch, bad[0], first), batch.lengths[bad[0]],
+                        batch.qual_lengths()[bad[0]]))
+                bad_lengths += len(bad)
+            if interleaved:
+                pairs = len(batch) // 2 * 2
+                bad = np.flatnonzero(keys[0:pairs:2] != keys[1:pairs:2])
+                if len(bad) and not bad_mates:
+                    problems.append('{} is followed by {} instead of its mate'.format(
+                        _describe_record(batch, 2 * bad[0], first), batch.name(2 * bad[0] + 1)))
+                bad_mates += len(bad)
+    except (IOError, ValueError) as e:
+        problems.append('cannot be read: {}'.format(e))
+        return result
+    if bad_lengths > 1:
+        problems.append('{} reads in all have sequence and quality lengths that differ'.format(
+            bad_lengths))
+    if bad_mates > 1:
+        problems.append('{} reads in all are not followed by their mate'.format(bad_mates))
+    if interleaved and result['records'] % 2:
+        problems.append('has an odd number of reads, {}, for an interleaved library'.format(
+            result['records']))
+    return result
+
+
+def first_unpaired(paths, block, start_block):
+    '''
+    Return a message naming the first read of the files of a paired library
+    whose mate differs, looking from block start_block on, or None.
+    '''
+    batches = [iter_batches(path, max_records=block) for path in paths]
+    for n, (batch_1, batch_2) in enumerate(itertools.izip(*batches)):
+        if n < start_block:
+            continue
+        bad = np.flatnonzero(pair_keys(batch_1) != pair_keys(batch_2))
+        if len(bad):
+            i = bad[0]
+            return 'read {} is {} in one file and {} in the other'.format(
+                n * block + i + 1, batch_1.name(i), batch_2.name(i))
+    return None
+
+
+class ReadChecker(object):
+    '''
+    workers - the number of files checked at once in pool
+    block - the number of reads whose names make one digest
+    pool - the multiprocessing.Pool files are checked in, None to check
+        them in this process
+    '''
+
+    def __init__(self, workers=4, block=65536, pool=None):
+        if block < 2 or block % 2:
+            raise ValueError('the block size must be even')
+        self.workers = workers
+        self.block = block
+        self.pool = pool
+
+    def _scan(self, tasks):
+        if self.pool is None or self.workers <= 1 or len(tasks) <= 1:
+            return [scan_file(task) for task in tasks]
+        results = []
+        for start in range(0, len(tasks), self.workers):
+            results.extend(self.pool.map(scan_file, tasks[start:start + self.workers], chunksize=1))
+        return results
+
+    def check(self, libraries):
+        '''
+        Check read libraries, each a tuple (layout, paths, names) of the
+        local files of the library in the order of its slots and the file
+        names to report them by. Return a list of problems, empty if none.
+        '''
+        tasks = []
+        for layout, paths, _ in libraries:
+            for path in paths:
+                task = (path, self.block, layout == INTERLEAVED)
+                if task not in tasks:
+                    tasks.append(task)
+        logger.info('Checking {} read files'.format(len(tasks)))
+        scans = dict(((task[0], task[2]), scan)
+                     for task, scan in zip(tasks, self._scan(tasks)))
+
+        problems = []
+        for layout, paths, names in libraries:
+            results = [scans[(path, layout == INTERLEAVED)] for path in paths]
+            for name, result in zip(names, results):
+                problems.extend('{}: {}'.format(name, problem) for problem in result['problems'])
+                if not result['records'] and not result['problems']:
+                    problems.append('{}: has no reads'.format(name))
+            if layout != PAIRED or any(result['problems'] for result in results):
+                continue
+            result_1, result_2 = results
+            pair = '{} and {}'.format(*names)
+            if result_1['records'] != result_2['records']:
+                problems.append('{} have different numbers of reads, {} and {}'.format(
+                    pair, result_1['records'], result_2['records']))
+            elif result_1['format'] != result_2['format']:
+                problems.append('{} are in different formats, {} and {}'.format(
+                    pair, result_1['format'], result_2['format']))
+            elif result_1['digests'] != result_2['digests']:
+                start = [a == b for a, b in zip(result_1['digests'],
+                                                result_2['digests'])].index(False)
+                problems.append('{} are out of step: {}'.format(
+                    pair, first_unpaired(paths, self.block, start)))
+        return problems
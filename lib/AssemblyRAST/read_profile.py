@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-flight profiling of input reads, and the cost model that picks an
+assembler from the profile.
+
+Only a bounded head of every read file is fetched from Shock. The sample
+gives the format, read length distribution and base qualities, and together
+with the node size an estimate of the number of reads and bases. The cost
+model then estimates the run time of each assembler able to handle reads
+like these, so a small isolate goes to a fast assembler instead of down a
+slow pipeline.
+"""
+import logging
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from AssemblyRAST.preprocess import SINGLE, layout_of
+from AssemblyRAST.seqfile import FASTQ, parse_buffer
+
+logger = logging.getLogger(__name__)
+
+# rough run time of each assembler: fixed seconds plus seconds per Gbp of
+# input, and the inputs it copes with. max_gbases is where it runs out of
+# memory on an ARAST worker, min_quality the mean base quality below which
+# it gives fragmented assemblies; spades corrects errors before assembling.
+ASSEMBLER_COSTS = {
+    'velvet': {'setup': 30, 'per_gbase': 800, 'max_gbases': 1.5,
+               'max_read_len': 500, 'min_quality': 20},
+    'megahit': {'setup': 240, 'per_gbase': 500,
+                'max_read_len': 500, 'min_quality': 20},
+    'spades': {'setup': 300, 'per_gbase': 3600, 'max_gbases': 20,
+               'max_read_len': 500},
+    'miniasm': {'setup': 60, 'per_gbase': 300, 'min_read_len': 1000},
+}
+
+def _is_gzip(handle, head):
+    return head[:2] == b'\x1f\x8b' or \
+        (handle.get('file_name') or '').endswith('.gz')
+
+
+def profile_sample(head, size, gzipped=False):
+    '''
+    Profile one read file from its first bytes. Fields of the result:
+    format - fastq, fasta or unknown.
+    size - the size of the file in bytes.
+    sampled_reads - the number of reads in the sample.
+    exact - True if the sample was the whole file.
+    estimated_reads, estimated_bases - extrapolated to the whole file.
+    min_length, median_length, mean_length, max_length - read lengths.
+    mean_quality - the mean Phred quality, None without qualities.
+    low_quality_fraction - the fraction of bases below Q20.
+    '''
+    complete = len(head) >= size
+    raw_length = len(head)
+    if gzipped:
+        text = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head)
+    else:
+        text = head
+    profile = {'format': 'unknown', 'size': size, 'sampled_reads': 0,
+               'exact': complete, 'estimated_reads': 0, 'estimated_bases': 0,
+               'min_length': 0, 'median_length': 0, 'mean_length': 0,
+               'max_length': 0, 'mean_quality': None, 'low_quality_fraction': None}
+    try:
+        batch, parsed = parse_buffer(np.frombuffer(text, dtype=np.uint8), complete)
+    except ValueError as e:
+        logger.warning('Unable to parse a read sample: {}'.format(e))
+        return profile
+    if batch is None:
+        return profile
+    lengths = batch.lengths
+    profile.update(format=batch.format, sampled_reads=len(batch),
+                   min_length=int(lengths.min()), max_length=int(lengths.max()),
+                   median_length=int(np.median(lengths)),
+                   mean_length=float(lengths.mean()))
+    if batch.format == FASTQ and lengths.sum():
+        scores = batch.buffer[batch.qual_mask()]
+        profile['mean_quality'] = float(batch.quality_sums().sum()) / len(scores)
+        profile['low_quality_fraction'] = float((scores < 33 + 20).mean())
+    if complete:
+        reads = len(batch)
+    else:
+        # bytes of the file per read, from the part of the sample that was parsed
+        ratio = float(raw_length) / len(text) if gzipped else 1.0
+        reads = int(size / (parsed * ratio / len(batch)))
+    profile['estimated_reads'] = reads
+    profile['estimated_bases'] = int(reads * profile['mean_length'])
+    return profile
+
+
+class ReadProfiler(object):
+    '''
+    downloader - the RangedDownloader the samples are read through
+    sample_bytes - how much of the head of every read file is profiled
+    workers - the number of files sampled at once
+    '''
+
+    def __init__(self, downloader, sample_bytes=4 * 1024**2, workers=4):
+        self.downloader = downloader
+        self.sample_bytes = sample_bytes
+        self.workers = workers
+
+    def profile_handle(self, handle, token):
+        '''Return the profile of the reads of one Shock handle'''
+        size = self.downloader.node_size(handle, token)
+        head = self.downloader.read_head(handle, token, self.sample_bytes)
+        if size is None:
+            size = len(head)
+        profile = profile_sample(head, size, gzipped=_is_gzip(handle, head))
+        profile['file_name'] = handle.get('file_name')
+        return profile
+
+    def profile(self, assembly_input, token):
+        '''
+        Profile every read library of a kbase_assembly_input. Fields of the
+        result:
+        libraries - per library, its layout (paired, interleaved or single),
+            the profiles of its files and its estimated_reads and
+            estimated_bases; a pair counts as two reads.
+        estimated_bases - of all libraries together.
+        mean_read_length, mean_quality - weighted by the bases of each file.
+        max_read_length - of all libraries.
+        paired - True if any library is paired.
+        '''
+        layouts = []
+        handles = []
+        for kind in ('paired_end_libs', 'single_end_libs'):
+            for lib in assembly_input.get(kind) or []:
+                layout, slots = layout_of(lib)
+                if layout is not None:
+                    layouts.append((layout, len(handles), len(handles) + len(slots)))
+                    handles.extend(lib[slot] for slot in slots)
+        pool = ThreadPool(max(1, min(self.workers, len(handles))))
+        try:
+            files = pool.map(lambda h: self.profile_handle(h, token), handles)
+        finally:
+            pool.close()
+            pool.join()
+
+        libs = []
+        for layout, start, end in layouts:
+            lib_files = files[start:end]
+            libs.append({'layout': layout, 'files': lib_files,
+                         'estimated_reads': sum(f['estimated_reads'] for f in lib_files),
+                         'estimated_bases': sum(f['estimated_bases'] for f in lib_files)})
+
+        bases = sum(f['estimated_bases'] for f in files)
+        qualified = [f for f in files if f['mean_quality'] is not None]
+        qual_bases = sum(f['estimated_bases'] for f in qualified)
+        return {
+            'libraries': libs,
+            'estimated_bases': bases,
+            'mean_read_length': float(sum(f['mean_length'] * f['estimated_bases'] for f in files))
+                                / bases if bases else 0.0,
+            'mean_quality': float(sum(f['mean_quality'] * f['estimated_bases'] for f in qualified))
+                            / qual_bases if qual_bases else None,
+            'max_read_length': max([f['max_length'] for f in files] or [0]),
+            'paired': any(lib['layout'] != SINGLE for lib in libs)}
+
+
+def estimate_costs(profile, costs=ASSEMBLER_COSTS):
+    '''
+    Return [(assembler, seconds, reason)] for every assembler in costs,
+    fastest first. seconds is None, with the reason, for assemblers unfit
+    for the profiled reads.
+    '''
+    gbases = profile['estimated_bases'] / 1e9
+    read_len = profile['mean_read_length']
+    quality = profile['mean_quality']
+    estimates = []
+    for assembler, cost in sorted(costs.items()):
+        reason = None
+        if cost.get('max_read_len') and read_len > cost['max_read_len']:
+            reason = 'reads longer than {} bp'.format(cost['max_read_len'])
+        elif cost.get('min_read_len') and read_len < cost['min_read_len']:
+            reason = 'reads shorter than {} bp'.format(cost['min_read_len'])
+        elif cost.get('max_gbases') and gbases > cost['max_gbases']:
+            reason = 'more than {} Gbp'.format(cost['max_gbases'])
+        elif cost.get('min_quality') and quality is not None and quality < cost['min_quality']:
+            reason = 'mean quality below {}'.format(cost['min_quality'])
+        if reason is not None:
+            estimates.append((assembler, None, reason))
+        else:
+            estimates.append((assembler, cost['setup'] + cost['per_gbase'] * gbases, None))
+    estimates.sort(key=lambda e: (e[1] is None, e[1]))
+    return estimates
+
+
+def choose_assembler(profile, costs=ASSEMBLER_COSTS):
+    '''Return the assembler expected to finish first, None if none fits'''
+    if not profile['estimated_bases']:
+        return None
+    assembler, seconds, _ = estimate_costs(profile, costs)[0]
+    return assembler if seconds is not None else None
+
+
+def format_profile(profile, costs=ASSEMBLER_COSTS):
+    '''Render the read profile section of the assembly report'''
+    report = ''
+    for n, lib in enumerate(profile['libraries']):
+        report += 'Library {}: {}, ~{} reads, ~{} bp\n'.format(
+            n + 1, lib['layout'], lib['estimated_reads'], lib['estimated_bases'])
+        for f in lib['files']:
+            report += '   {}: {}, {} bytes, {} reads {}\n'.format(
+                f['file_name'], f['format'], f['size'], f['sampled_reads'],
+                'in full' if f['exact'] else 'sampled')
+            report += '      read length {} / {} / {:.1f} / {} bp (min / median / mean / max)\n'.format(
+                f['min_length'], f['median_length'], f['mean_length'], f['max_length'])
+            if f['mean_quality'] is not None:
+                report += '      mean quality {:.1f}, {:.1%} of bases below Q20\n'.format(
+                    f['mean_quality'], f['low_quality_fraction'])
+    report += 'Estimated input: {} bp\n'.format(profile['estimated_bases'])
+    report += 'Estimated assembler run times:\n'
+    for assembler, seconds, reason in estimate_costs(profile, costs):
+        if seconds is None:
+            report += '   {}\tunsuitable: {}\n'.format(assembler, reason)
+        else:
+            report += '   {}\t~{} s\n'.format(assembler, int(seconds))
+    return report
@@ -0,0 +1,809 @@
+# -*- coding: utf-8 -*-
+"""
+Local staging of input reads.
+
+Every ARAST job downloads its reads from Shock, even when the same library
+was assembled minutes earlier on the same worker. ReadStager downloads each
+Shock node once into a content addressed ReadCache, keyed on the node ID and
+the handle's remote_md5, and hands ARAST handles that point at LocalShock,
+a loopback server which serves the cached files the way Shock would. The
+ARAST backend runs next to this module, so its downloads never leave the
+host.
+
+In streaming mode a job is submitted while its reads are still being
+staged: LocalShock serves each file as it grows, so the transfer to ARAST
+overlaps the download from Shock. The last byte is held back until the
+download passed its MD5 check, so a corrupt download fails the transfer
+instead of reaching the assembler.
+
+Reads published to a job are held in the cache until the job finished and
+release() is called, which also stops LocalShock serving them. Held reads
+count against the cache quota: once they alone fill it, further reads are
+not staged and ARAST fetches them from Shock itself.
+"""
+import BaseHTTPServer
+import SocketServer
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urlparse
+import uuid
+
+from AssemblyRAST.preprocess import INTERLEAVED, SINGLE, layout_of, slots_of
+from AssemblyRAST.shock_download import RangedDownloader, file_md5
+
+logger = logging.getLogger(__name__)
+
+_HANDLE_SLOTS = ('handle_1', 'handle_2', 'interleaved', 'handle')
+
+
+class CacheFull(ValueError):
+    '''The reads held for jobs fill the cache, so no more can be staged'''
+
+
+class ReadCache(object):
+    '''
+    root - the cache directory
+    max_bytes - evict least recently used reads beyond this size
+    hold_seconds - a hold not released for this long no longer keeps its
+        reads from eviction, as when the job holding them was lost
+    on_evict - if given, on_evict(key) is called for every evicted entry
+    '''
+
+    READS = 'reads'
+    META = 'meta.json'
+    PARTIAL = '.partial'
+
+    def __init__(self, root, max_bytes, hold_seconds=6 * 3600, on_evict=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.hold_seconds = hold_seconds
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # key -> (number of holds, time of the last one)
+        self._holds = {}
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    @staticmethod
+    def key(handle):
+        '''Return the cache key of a handle, None if it has no remote_md5'''
+        if not handle.get('id') or not handle.get('remote_md5'):
+            return None
+        return hashlib.sha1('{}:{}'.format(handle['id'],
+                                           handle['remote_md5'])).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        '''Return the path of the cached reads for key, or None'''
+        entry = self._entry(key)
+        try:
+            # the meta file's mtime is the entry's last use for LRU eviction
+            os.utime(os.path.join(entry, self.META), None)
+        except OSError:
+            return None
+        return os.path.join(entry, self.READS)
+
+    def hold(self, key):
+        '''Keep the reads for key from eviction until release(key)'''
+        with self._lock:
+            count, _ = self._holds.get(key, (0, 0))
+            self._holds[key] = (count + 1, time.time())
+
+    def release(self, key):
+        with self._lock:
+            count, since = self._holds.get(key, (0, 0))
+            if count > 1:
+                self._holds[key] = (count - 1, since)
+            else:
+                self._holds.pop(key, None)
+
+    def _held(self, key, now):
+        count, since = self._holds.get(key, (0, 0))
+        return count > 0 and since > now - self.hold_seconds
+
+    def full(self):
+        '''Return True if held reads alone fill the cache'''
+        with self._lock:
+            now = time.time()
+            held = sum(size for _, size, entry in self.entries()
+                       if self._held(os.path.basename(entry), now))
+        return held >= self.max_bytes
+
+    def partial_path(self, key):
+        '''Return where the reads for key are downloaded to before they are cached'''
+        partial_dir = os.path.join(self.root, self.PARTIAL)
+        if not os.path.exists(partial_dir):
+            try:
+                os.makedirs(partial_dir)
+            except OSError:
+                pass
+        return os.path.join(partial_dir, key)
+
+    def meta(self, key):
+        with open(os.path.join(self._entry(key), self.META)) as f:
+            return json.load(f)
+
+    def put(self, key, fetch, meta):
+        '''
+        Return the path of the reads for key, calling fetch(path) to
+        download them first if they are not cached yet. Concurrent puts of
+        the same key in this process download only once. A failed fetch
+        leaves its partial download behind for the next put to resume.
+        '''
+        return self.put_group([key], lambda paths: fetch(paths[0]), meta)[0]
+
+    def put_group(self, keys, fetch, meta):
+        '''
+        Return the paths of the reads for keys, calling fetch(paths) once to
+        write all of them if any is not cached yet. A dict returned by fetch
+        is added to the meta of every entry.
+        '''
+        locks = [self._key_lock(key) for key in sorted(set(keys))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            paths = [self.get(key) for key in keys]
+            if None not in paths:
+                return paths
+            if self.full():
+                raise CacheFull('The read cache is full of reads held by queued jobs')
+            entries = [self._entry(key) for key in keys]
+            for entry in entries:
+                parent = os.path.dirname(entry)
+                if not os.path.exists(parent):
+                    try:
+                        os.makedirs(parent)
+                    except OSError:
+                        pass
+            partials = [self.partial_path(key) for key in keys]
+            meta = dict(meta, **(fetch(partials) or {}))
+            for entry, partial in zip(entries, partials):
+                parent = os.path.dirname(entry)
+                tmp = tempfile.mkdtemp(prefix='.tmp.', dir=parent)
+                os.rename(partial, os.path.join(tmp, self.READS))
+                with open(os.path.join(tmp, self.META), 'w') as f:
+                    json.dump(dict(meta, created=time.time()), f)
+                try:
+                    os.rename(tmp, entry)
+                except OSError:
+                    # another worker staged the same reads first
+                    shutil.rmtree(tmp, ignore_errors=True)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        self.evict()
+        return [self.get(key) for key in keys]
+
+    def entries(self):
+        '''Return (last_used, size, path) for every entry, oldest first'''
+        result = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if prefix == self.PARTIAL or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.startswith('.tmp.'):
+                    continue
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry, self.META))
+                    size = os.path.getsize(os.path.join(entry, self.READS))
+                except OSError:
+                    continue
+                result.append((last_used, size, entry))
+        result.sort()
+        return result
+
+    def evict(self):
+        evicted = []
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            now = time.time()
+            held = now - self.hold_seconds
+            for last_used, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._held(os.path.basename(entry), now):
+                    continue
+                logger.info('Evicting staged reads {}'.format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                evicted.append(os.path.basename(entry))
+                total -= size
+            # downloads abandoned long ago will not be resumed any more
+            partial_dir = os.path.join(self.root, self.PARTIAL)
+            for name in os.listdir(partial_dir) if os.path.isdir(partial_dir) else []:
+                try:
+                    if os.path.getmtime(os.path.join(partial_dir, name)) < held:
+                        os.remove(os.path.join(partial_dir, name))
+                except OSError:
+                    pass
+            if total > self.max_bytes:
+                logger.warning('Staged reads use {} bytes, over the {} byte quota'
+                               .format(total, self.max_bytes))
+        if self.on_evict is not None:
+            for key in evicted:
+                self.on_evict(key)
+
+
+def _parse_range(header, size):
+    '''Return (start, end) of a single "bytes=a-b" Range header, else None'''
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].partition('-')
+    try:
+        if not start:
+            start, end = size - int(end), size - 1
+        else:
+            start, end = int(start), int(end) if end else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start < 0 or start > end:
+        return None
+    return start, end
+
+
+class GrowingFile(object):
+    '''
+    A staged file that is still being downloaded. Fields:
+    path - where the file can be read; its final path once finished.
+    size - the size the file will have.
+    written - the number of bytes downloaded so far.
+    finished - True once the download completed and was verified.
+    error - the exception the download failed with, if it did.
+    '''
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.written = 0
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def advance(self, written):
+        with self._cond:
+            self.written = written
+            self._cond.notify_all()
+
+    def finish(self, path):
+        with self._cond:
+            self.path = path
+            self.written = self.size
+            self.finished = True
+            self._cond.notify_all()
+
+    def fail(self, error):
+        with self._cond:
+            self.error = error
+            self._cond.notify_all()
+
+    def open(self, timeout=300):
+        '''
+        Open the file for reading. Between being moved into the cache and
+        finish() it is at neither path, so wait for its final path.
+        '''
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                try:
+                    return open(self.path, 'rb')
+                except IOError:
+                    remaining = deadline - time.time()
+                    if self.finished or self.error is not None or remaining <= 0:
+                        raise
+                self._cond.wait(remaining)
+
+    def wait_for(self, offset, timeout=300):
+        '''
+        Block until more than offset bytes may be read and return how many
+        may be. The last byte is only readable once the download finished.
+        Raises IOError if the download failed or stalled for timeout seconds.
+        '''
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                if self.error is not None:
+                    raise IOError('Download of {} failed: {}'.format(self.path, self.error))
+                if self.finished:
+                    return self.size
+                readable = min(self.written, self.size - 1)
+                if readable > offset:
+                    return readable
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError('Download of {} stalled'.format(self.path))
+                self._cond.wait(remaining)
+
+
+class _ShockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        parts = parsed.path.strip('/').split('/')
+        node = None
+        if len(parts) == 2 and parts[0] == 'node':
+            node = self.server.lookup(parts[1])
+        if node is None:
+            self.send_error(404, 'Node not found')
+            return
+        path, info, growing = node
+        size = growing.size if growing is not None else os.path.getsize(path)
+        if 'download' not in urlparse.parse_qs(parsed.query,
+                                               keep_blank_values=True):
+            body = json.dumps({'status': 200, 'error': None, 'data': {
+                'id': parts[1],
+                'file': {'name': info['file_name'], 'size': size,
+                         'checksum': {'md5': info['remote_md5']}}}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if growing is not None:
+            self._follow(growing, info)
+            return
+        start, end = 0, size - 1
+        ranged = _parse_range(self.headers.getheader('range'), size)
+        if ranged is not None:
+            start, end = ranged
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self.send_response(206 if ranged is not None else 200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            if ranged is not None:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+            self.send_header('Content-Disposition',
+                             'attachment; filename={}'.format(info['file_name']))
+            self.end_headers()
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def _follow(self, growing, info):
+        '''Send a file as it is being downloaded; Range requests get all of it'''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(growing.size))
+        self.send_header('Content-Disposition',
+                         'attachment; filename={}'.format(info['file_name']))
+        self.end_headers()
+        offset = 0
+        try:
+            readable = growing.wait_for(0)
+            with growing.open() as f:
+                while offset < growing.size:
+                    while offset < readable:
+                        chunk = f.read(min(readable - offset, 1 << 20))
+                        if not chunk:
+                            raise IOError('{} is shorter than expected'.format(growing.path))
+                        self.wfile.write(chunk)
+                        offset += len(chunk)
+                    if offset < growing.size:
+                        readable = growing.wait_for(offset)
+        except IOError as e:
+            # closing the connection short of Content-Length fails the transfer
+            logger.warning('Aborted streaming {} after {} bytes: {}'.format(
+                info['file_name'], offset, e))
+            self.close_connection = 1
+
+
+class LocalShock(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    A loopback HTTP server answering Shock's node and download urls for
+    files registered with it. Node ids are random, so a node can only be
+    fetched by whoever was handed its handle.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _ShockHandler)
+        self._nodes = {}
+        self._nodes_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.server_address[0], self.server_port)
+
+    def register(self, path, info, on_serve=None, growing=None):
+        '''
+        Serve path as a new node and return its id. If the file is still
+        being downloaded, growing is its GrowingFile.
+        '''
+        node_id = uuid.uuid4().hex
+        with self._nodes_lock:
+            self._nodes[node_id] = (path, info, on_serve, growing)
+        return node_id
+
+    def unregister(self, node_id):
+        '''Stop serving a node'''
+        with self._nodes_lock:
+            self._nodes.pop(node_id, None)
+
+    def lookup(self, node_id):
+        '''Return (path, info, growing) of a node, None if it cannot be served'''
+        with self._nodes_lock:
+            node = self._nodes.get(node_id)
+        if node is None:
+            return None
+        path, info, on_serve, growing = node
+        if growing is not None:
+            if growing.error is not None:
+                return None
+            if not growing.finished:
+                return growing.path, info, growing
+            path = growing.path
+        if on_serve is not None:
+            on_serve()
+        if not os.path.exists(path):
+            return None
+        return path, info, None
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ReadStager(object):
+    '''
+    cache - the ReadCache reads are staged into
+    local_shock - the LocalShock staged reads are handed to ARAST through
+    downloader - the RangedDownloader fetching the reads from Shock
+    '''
+
+    def __init__(self, cache, local_shock, downloader=None):
+        self.cache = cache
+        self.local_shock = local_shock
+        self.downloader = downloader or RangedDownloader()
+        self._growing = {}
+        self._checked = set()
+        # node id -> cache key of every LocalShock node published
+        self._nodes = {}
+        self._lock = threading.Lock()
+        cache.on_evict = self._evicted
+
+    def stage_handle(self, handle, token):
+        '''
+        Return the local path of the reads of a Shock handle, downloading
+        them if needed, or None if the handle cannot be content addressed.
+        '''
+        key = self.cache.key(handle)
+        if key is None:
+            return None
+        path = self.cache.get(key)
+        if path is None:
+            logger.info('Staging Shock node {}'.format(handle['id']))
+            path = self.cache.put(
+                key, lambda p: self.downloader.download(handle, token, p),
+                self._meta(handle))
+        return path
+
+    @staticmethod
+    def _meta(handle):
+        return {'node': handle['id'], 'remote_md5': handle['remote_md5'],
+                'file_name': handle.get('file_name')}
+
+    def stage_in_background(self, handle, token):
+        '''
+        Start staging the reads of a Shock handle and return their
+        GrowingFile, or None if the size of the node is not known up front.
+        '''
+        key = self.cache.key(handle)
+        # the caller goes on to point its handle at LocalShock
+        handle = dict(handle)
+        with self._lock:
+            growing = self._growing.get(key)
+            if growing is not None:
+                return growing
+        # a request to Shock, so not made holding the lock
+        size = self.downloader.node_size(handle, token)
+        if size is None or self.cache.full():
+            return None
+        with self._lock:
+            growing = self._growing.get(key)
+            if growing is not None:
+                return growing
+            growing = GrowingFile(self.cache.partial_path(key), size)
+            self._growing[key] = growing
+
+        def run():
+            try:
+                path = self.cache.put(
+                    key, lambda p: self.downloader.download(handle, token, p, size=size,
+                                                            progress=growing.advance),
+                    self._meta(handle))
+                growing.finish(path)
+            except Exception as e:
+                logger.error('Staging Shock node {} failed: {}'.format(handle['id'], e))
+                growing.fail(e)
+            finally:
+                with self._lock:
+                    self._growing.pop(key, None)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return growing
+
+    def stage_input(self, assembly_input, token, stream=False, stages=(), on_stage=None,
+                    checker=None):
+        '''
+        Return a copy of a kbase_assembly_input whose Shock handles point
+        at LocalShock, staging their reads first. Handles without a
+        remote_md5, and handles whose reads do not fit in the cache, are
+        passed through unchanged. With stream, reads not yet cached are
+        staged in the background and served while they arrive. Call
+        release(nodes_of(staged)) once the job using it finished.
+
+        With stages, the reads of every library are run through the
+        preprocess stages in order, and the handles point at the output of
+        the last one. Libraries a stage splits off, such as merged pairs,
+        are added to paired_end_libs or single_end_libs. Stages need whole
+        files, so stream is then ignored.
+        on_stage(message) is called with the report line of every stage.
+
+        With a ReadChecker as checker, the reads of every library are staged
+        and checked before anything else, and a ValueError listing all the
+        problems found is raised if any are. Checking needs whole files, so
+        stream is then ignored too.
+        '''
+        staged = copy.deepcopy(assembly_input)
+        if checker is not None:
+            self.check_input(staged, token, checker)
+            stream = False
+        # libraries split off by stages, such as merged pairs
+        split = {'paired_end_libs': [], 'single_end_libs': []}
+        for kind in ('paired_end_libs', 'single_end_libs', 'references'):
+            if kind not in staged:
+                continue
+            libs = []
+            for lib in staged[kind] or []:
+                if stages and kind != 'references':
+                    processed = self._preprocess(lib, token, stages, on_stage)
+                    if processed is not None:
+                        for layout, processed_lib in processed:
+                            if processed_lib is lib:
+                                libs.append(lib)
+                            elif layout == SINGLE:
+                                split['single_end_libs'].append(processed_lib)
+                            else:
+                                split['paired_end_libs'].append(processed_lib)
+                        continue
+                for slot in _HANDLE_SLOTS:
+                    handle = lib.get(slot)
+                    if not isinstance(handle, dict):
+                        continue
+                    key = self.cache.key(handle)
+                    if key is None:
+                        continue
+                    # held from the start, so it cannot be evicted before it is published
+                    self.cache.hold(key)
+                    try:
+                        path = self.cache.get(key)
+                        growing = None
+                        if path is None and stream:
+                            growing = self.stage_in_background(handle, token)
+                        if growing is not None:
+                            path = growing.path
+                        elif path is None:
+                            path = self.stage_handle(handle, token)
+                        self._publish(handle, slot, key, path, handle['remote_md5'], growing)
+                    except CacheFull as e:
+                        logger.warning('Not staging Shock node {}: {}'.format(handle['id'], e))
+                    finally:
+                        self.cache.release(key)
+                libs.append(lib)
+            staged[kind] = libs
+        for kind, libs in split.items():
+            if libs:
+                staged[kind] = (staged.get(kind) or []) + libs
+        return staged
+
+    def check_input(self, assembly_input, token, checker):
+        '''
+        Stage and check the reads of every library of a kbase_assembly_input
+        with checker. Libraries that passed are not checked again.
+        '''
+        libraries = []
+        held = []
+        try:
+            for kind in ('paired_end_libs', 'single_end_libs'):
+                for lib in assembly_input.get(kind) or []:
+                    layout, slots = layout_of(lib)
+                    keys = tuple(self.cache.key(lib[slot]) for slot in slots)
+                    if layout is None or None in keys or keys in self._checked:
+                        continue
+                    for key in keys:
+                        self.cache.hold(key)
+                        held.append(key)
+                    try:
+                        paths = [self.stage_handle(lib[slot], token) for slot in slots]
+                    except CacheFull as e:
+                        logger.warning('Not checking the reads of {}: {}'.format(
+                            ', '.join(lib[slot]['id'] for slot in slots), e))
+                        continue
+                    names = [lib[slot].get('file_name') or slot for slot in slots]
+                    libraries.append((keys, (layout, paths, names)))
+            if not libraries:
+                return
+            problems = checker.check([library for _, library in libraries])
+        finally:
+            for key in held:
+                self.cache.release(key)
+        if problems:
+            raise ValueError('The input reads failed their integrity check:\n' +
+                             '\n'.join(problems))
+        with self._lock:
+            self._checked.update(keys for keys, _ in libraries)
+
+    def _publish(self, handle, slot, key, path, md5, growing=None):
+        self.cache.hold(key)
+        node_id = self.local_shock.register(
+            path, {'file_name': handle.get('file_name') or slot, 'remote_md5': md5},
+            on_serve=lambda: self.cache.get(key), growing=growing)
+        with self._lock:
+            self._nodes[node_id] = key
+        handle['id'] = node_id
+        handle['url'] = self.local_shock.url
+        handle['remote_md5'] = md5
+
+    def nodes_of(self, assembly_input):
+        '''Return the ids of the LocalShock nodes a staged kbase_assembly_input points at'''
+        node_ids = []
+        for kind in ('paired_end_libs', 'single_end_libs', 'references'):
+            for lib in assembly_input.get(kind) or []:
+                for slot in _HANDLE_SLOTS:
+                    handle = lib.get(slot)
+                    if isinstance(handle, dict) and handle.get('url') == self.local_shock.url:
+                        node_ids.append(handle['id'])
+        return node_ids
+
+    def release(self, node_ids):
+        '''
+        Stop serving LocalShock nodes once the job they were published to
+        finished, and let their reads be evicted. Unknown ids are ignored.
+        '''
+        for node_id in node_ids:
+            with self._lock:
+                key = self._nodes.pop(node_id, None)
+            if key is None:
+                continue
+            self.local_shock.unregister(node_id)
+            self.cache.release(key)
+
+    def _evicted(self, key):
+        with self._lock:
+            node_ids = [node_id for node_id, node_key in self._nodes.items() if node_key == key]
+        self.release(node_ids)
+
+    def _preprocess(self, lib, token, stages, on_stage):
+        '''
+        Run a library through stages. Return (layout, lib) of the libraries
+        its reads end up in, lib itself among them unless a stage left it
+        empty, or None if its reads cannot be cached or the cache is full.
+        '''
+        layout, slots = layout_of(lib)
+        keys = [self.cache.key(lib[slot]) for slot in slots]
+        if layout is None:
+            logger.warning('Not preprocessing a library with no reads')
+            return None
+        if None in keys:
+            logger.warning('Not preprocessing a library without remote_md5')
+            return None
+        # every file is held until published, lest it be evicted while in use
+        held = list(keys)
+        for key in held:
+            self.cache.hold(key)
+        try:
+            templates = [dict(lib[slot]) for slot in slots]
+            try:
+                paths = [self.stage_handle(lib[slot], token) for slot in slots]
+                parts = self._run_stages(layout, keys, paths, stages, on_stage, held)
+            except CacheFull as e:
+                logger.warning('Not preprocessing the reads of {}: {}'.format(
+                    ', '.join(template['id'] for template in templates), e))
+                return None
+
+            libs = []
+            for n, (part_layout, label, part_keys, part_paths) in enumerate(parts):
+                # a library every read of which went elsewhere, such as into merged reads
+                if all(os.path.getsize(path) == 0 for path in part_paths) and \
+                        (n or len(parts) > 1):
+                    continue
+                part_lib = lib if label is None else {}
+                if part_layout == INTERLEAVED:
+                    part_lib['interleaved'] = 1
+                for m, slot in enumerate(slots_of(part_layout)):
+                    handle = lib[slot] if label is None else dict(templates[min(m, len(templates) - 1)])
+                    name = handle.get('file_name') or slot
+                    if name.endswith('.gz'):
+                        name = name[:-len('.gz')]
+                    handle['file_name'] = name if label is None else '{}_{}'.format(label, name)
+                    part_lib[slot] = handle
+                    self._publish(handle, slot, part_keys[m], part_paths[m], self._md5(part_keys[m]))
+                libs.append((part_layout, part_lib))
+            return libs
+        finally:
+            for key in held:
+                self.cache.release(key)
+
+    def _run_stages(self, layout, keys, paths, stages, on_stage, held):
+        '''
+        Run the cached files of one library through stages, holding every
+        output in held. Return (layout, label, keys, paths) of every library
+        the reads end up in.
+        '''
+        parts = [(layout, None, keys, paths)]
+        for stage in stages:
+            processed = []
+            for part_layout, label, part_keys, part_paths in parts:
+                if not stage.applies_to(part_layout):
+                    processed.append((part_layout, label, part_keys, part_paths))
+                    continue
+                out_keys, out_paths = self.run_stage(stage, part_layout, part_keys, part_paths)
+                for key in out_keys:
+                    self.cache.hold(key)
+                    held.append(key)
+                if on_stage is not None:
+                    on_stage(stage.describe(self.cache.meta(out_keys[0])['stats']))
+                first = 0
+                for out_layout, out_label in stage.output_layouts(part_layout):
+                    last = first + len(slots_of(out_layout))
+                    processed.append((out_layout, out_label or label,
+                                      out_keys[first:last], out_paths[first:last]))
+                    first = last
+            parts = processed
+        return parts
+
+    def _md5(self, key):
+        '''Return the MD5 of cached reads, downloaded or written by a stage'''
+        meta = self.cache.meta(key)
+        return meta['md5s'][key] if 'md5s' in meta else meta['remote_md5']
+
+    def run_stage(self, stage, layout, keys, paths):
+        '''
+        Run a stage on the cached files of one library, with cache keys keys,
+        and return the cache keys and paths of its output, the files of
+        every library of stage.output_layouts in turn.
+        '''
+        group = hashlib.sha1('|'.join([stage.key()] + keys)).hexdigest()
+        count = sum(len(slots_of(out_layout)) for out_layout, _ in stage.output_layouts(layout))
+        out_keys = [hashlib.sha1('{}:{}'.format(group, n)).hexdigest() for n in range(count)]
+
+        def fetch(outputs):
+            logger.info('Running {} on {}'.format(stage.name, ', '.join(paths)))
+            stats = stage.run(layout, paths, outputs)
+            return {'stats': stats,
+                    'md5s': dict((key, file_md5(path)) for key, path in zip(out_keys, outputs))}
+
+        out_paths = self.cache.put_group(out_keys, fetch, {'stage': stage.key(), 'inputs': keys})
+        return out_keys, out_paths
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Per-call execution context.
+
+The server runs several calls at once in one process (uwsgi --threads), so
+nothing a call depends on may live in process-global state such as
+os.environ. A RequestContext carries the caller's token, user id, ARAST
+url, scratch directory and console log, and hands every client exactly
+the credentials of its own call.
+"""
+import logging
+
+from AssemblyRAST.arast_client import ArastClient
+from AssemblyRAST.console_log import ConsoleLog
+
+logger = logging.getLogger(__name__)
+
+
+class RequestContext(object):
+    '''
+    Everything one call needs that is not shared with other calls. Fields:
+    token - the KBase authentication token of the caller.
+    user_id - the KBase user id of the caller.
+    arast_url - the ARAST router url.
+    scratch - the scratch directory.
+    call_id - the JSON-RPC call id, used to tag log messages.
+    console - the ConsoleLog collecting the log messages of the call.
+    '''
+
+    def __init__(self, token, user_id, arast_url, scratch, call_id=None,
+                 console=None):
+        if not token:
+            raise ValueError('An authentication token is required')
+        if not user_id:
+            raise ValueError('The user id of the caller is required')
+        self.token = token
+        self.user_id = user_id
+        self.arast_url = arast_url
+        self.scratch = scratch
+        self.call_id = call_id
+        self.console = console if console is not None else ConsoleLog(
+            call_id=call_id)
+
+    @classmethod
+    def from_ctx(cls, ctx, arast_url, scratch, console=None):
+        '''Build the context of a call from the server's MethodContext'''
+        return cls(ctx.get('token'), ctx.get('user_id'), arast_url, scratch,
+                   call_id=ctx.get('call_id'), console=console)
+
+    def arast_client(self):
+        return ArastClient(self.arast_url, self.user_id, self.token)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of finished assemblies.
+
+An entry holds the filtered contigs, their statistics and the ARAST report
+of one assembly. It is keyed on the MD5s of the input reads, the way they
+were assembled and the ARAST version. Entries live on local disk and the
+least recently used ones are evicted once the cache grows past its byte
+quota.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from AssemblyRAST.contig_stats import ContigStats
+
+logger = logging.getLogger(__name__)
+
+_HANDLE_SLOTS = ('handle_1', 'handle_2', 'interleaved', 'handle')
+
+
+def _library_signature(kind, lib):
+    md5s = []
+    for slot in _HANDLE_SLOTS:
+        handle = lib.get(slot)
+        if not isinstance(handle, dict):
+            continue
+        if not handle.get('remote_md5'):
+            return None
+        md5s.append('{}:{}'.format(slot, handle['remote_md5']))
+    if not md5s:
+        return None
+    return kind + '(' + ','.join(md5s) + ')'
+
+
+def make_key(assembly_input, assembler=None, pipeline=None, recipe=None,
+             extra_params=None, min_contig_len=None, arast_version=None):
+    '''
+    Return the cache key for an assembly, or None if any input read lacks a
+    remote_md5 and the assembly can therefore not be cached.
+    '''
+    signatures = []
+    for kind in ('paired_end_libs', 'single_end_libs', 'references'):
+        for lib in assembly_input.get(kind) or []:
+            sig = _library_signature(kind, lib)
+            if sig is None:
+                return None
+            signatures.append(sig)
+    if not signatures:
+        return None
+    if assembler:
+        mode = ['assembler', assembler]
+    elif pipeline:
+        mode = ['pipeline', pipeline]
+    else:
+        mode = ['recipe', recipe or 'auto']
+    key = {'reads': sorted(signatures),
+           'mode': mode,
+           'extra_params': list(extra_params or []),
+           'min_contig_len': min_contig_len,
+           'arast_version': arast_version}
+    return hashlib.sha256(json.dumps(key, sort_keys=True)).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache(object):
+    '''
+    root - the cache directory
+    max_bytes - evict least recently used entries beyond this size
+    '''
+
+    CONTIGS = 'contigs.fa'
+    STATS = 'stats.bin'
+    META = 'meta.json'
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key, output_dir):
+        '''
+        Look up key; on a hit link its contigs into output_dir and return a
+        dict with 'output_contigs', 'stats', 'ar_report' and 'job_id'.
+        '''
+        entry = self._entry(key)
+        meta_path = os.path.join(entry, self.META)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            stats = ContigStats.load(os.path.join(entry, self.STATS))
+            output_contigs = os.path.join(output_dir, self.CONTIGS)
+            _link_or_copy(os.path.join(entry, self.CONTIGS), output_contigs)
+        except (IOError, OSError, ValueError):
+            return None
+        # the meta file's mtime is the entry's last use for LRU eviction
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+        logger.info('Result cache hit {}'.format(key))
+        return {'output_contigs': output_contigs,
+                'stats': stats,
+                'ar_report': meta['ar_report'],
+                'job_id': meta['job_id']}
+
+    def put(self, key, output_contigs, stats, ar_report, job_id):
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        parent = os.path.dirname(entry)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass
+        tmp = tempfile.mkdtemp(prefix='.tmp.', dir=parent)
+        try:
+            _link_or_copy(output_contigs, os.path.join(tmp, self.CONTIGS))
+            stats.save(os.path.join(tmp, self.STATS))
+            with open(os.path.join(tmp, self.META), 'w') as f:
+                json.dump({'ar_report': ar_report, 'job_id': job_id,
+                           'created': time.time()}, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # another worker stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        '''Return (last_used, size, path) for every entry, oldest first'''
+        result = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.startswith('.tmp.'):
+                    continue
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    last_used = os.path.getmtime(os.path.join(entry, self.META))
+                except OSError:
+                    continue
+                result.append((last_used, _dir_size(entry), entry))
+        result.sort()
+        return result
+
+    def evict(self):
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                logger.info('Evicting cached result {}'.format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
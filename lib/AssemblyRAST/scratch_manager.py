@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Quota-aware lifecycle management of per-call scratch directories.
+
+Every assembly gets its own directory under scratch. While a call is using
+a directory it is marked active; once released it becomes a candidate for
+least recently used eviction whenever the managed directories exceed the
+byte quota. Pinned directories (e.g. contigs a journal will resume from,
+or an upload in flight) are never evicted.
+
+State is kept in marker files inside each directory so that several server
+processes sharing one scratch volume agree on what may be evicted.
+"""
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchManager(object):
+    '''
+    root - the scratch directory
+    quota_bytes - evict released directories beyond this total size
+    prefix - name prefix of the managed directories
+    pin_ttl - seconds after which a forgotten pin no longer protects a
+        directory
+    '''
+
+    ACTIVE = '.active'
+    PIN = '.pin.'
+
+    def __init__(self, root, quota_bytes, prefix='output.',
+                 pin_ttl=7 * 24 * 3600):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.prefix = prefix
+        self.pin_ttl = pin_ttl
+        self._lock = threading.Lock()
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def allocate(self, name, expected_bytes=0):
+        '''Create and return a new active directory for one assembly'''
+        self.evict(expected_bytes)
+        path = tempfile.mkdtemp(prefix='{}{}.'.format(self.prefix, name),
+                                dir=self.root)
+        with open(os.path.join(path, self.ACTIVE), 'w') as f:
+            f.write(str(os.getpid()))
+        return path
+
+    def release(self, path):
+        '''Mark a directory as finished with; it may now be evicted'''
+        try:
+            os.remove(os.path.join(path, self.ACTIVE))
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.evict()
+
+    def discard(self, path):
+        '''Remove a directory right away'''
+        shutil.rmtree(path, ignore_errors=True)
+
+    def pin(self, path, holder):
+        open(os.path.join(path, self.PIN + holder), 'w').close()
+
+    def unpin(self, path, holder):
+        try:
+            os.remove(os.path.join(path, self.PIN + holder))
+        except OSError:
+            pass
+
+    @contextmanager
+    def pinned(self, path, holder):
+        self.pin(path, holder)
+        try:
+            yield path
+        finally:
+            self.unpin(path, holder)
+
+    def _state(self, path):
+        '''Return 'active', 'pinned' or 'released' for a managed directory'''
+        now = time.time()
+        state = 'released'
+        for name in os.listdir(path):
+            marker = os.path.join(path, name)
+            if name == self.ACTIVE:
+                try:
+                    with open(marker) as f:
+                        pid = int(f.read().strip() or 0)
+                except (IOError, ValueError):
+                    pid = 0
+                if pid and _pid_alive(pid):
+                    return 'active'
+            elif name.startswith(self.PIN):
+                try:
+                    if now - os.path.getmtime(marker) < self.pin_ttl:
+                        state = 'pinned'
+                except OSError:
+                    pass
+        return state
+
+    def items(self):
+        '''Return (last_used, size, state, path) per directory, oldest first'''
+        result = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(self.prefix) or not os.path.isdir(path):
+                continue
+            try:
+                result.append((os.path.getmtime(path), _dir_size(path),
+                               self._state(path), path))
+            except OSError:
+                continue
+        result.sort()
+        return result
+
+    def evict(self, needed_bytes=0):
+        '''Evict released directories, oldest first, to fit in the quota'''
+        with self._lock:
+            items = self.items()
+            total = sum(size for _, size, _, _ in items)
+            for _, size, state, path in items:
+                if total + needed_bytes <= self.quota_bytes:
+                    break
+                if state != 'released':
+                    continue
+                logger.info('Evicting scratch directory {} ({} bytes)'.format(
+                    path, size))
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            if total + needed_bytes > self.quota_bytes:
+                logger.warning('Scratch usage {} bytes exceeds quota {} bytes'
+                               .format(total + needed_bytes, self.quota_bytes))
+
+    def usage(self):
+        items = self.items()
+        usage = {'used_bytes': sum(size for _, size, _, _ in items),
+                 'quota_bytes': self.quota_bytes,
+                 'directories': len(items),
+                 'active': 0, 'pinned': 0, 'released': 0}
+        for _, _, state, _ in items:
+            usage[state] += 1
+        return usage
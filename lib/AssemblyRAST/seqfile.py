@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Batch reading of FASTQ and FASTA files without a Python object per record.
+
+A file is memory mapped and cut into RecordBatches at record boundaries. A
+batch is a numpy view of its bytes plus arrays of offsets: where each
+record, its sequence and its qualities start and end. Statistics such as
+lengths, GC counts and quality sums are computed for the whole batch with
+numpy, and records are written out as slices of the mapping, so reads are
+never copied into strings unless a caller asks for one.
+
+Gzipped files cannot be mapped and are decompressed as a stream instead,
+into buffers that are parsed the same way.
+
+FASTQ records must have their sequence and qualities on one line each.
+FASTA sequences may span several lines, which are then part of their
+sequence slice; lengths and GC counts leave the line breaks out.
+"""
+import gzip
+import os
+
+import numpy as np
+
+FASTQ = 'fastq'
+FASTA = 'fasta'
+
+_NEWLINE = ord('\n')
+_RETURN = ord('\r')
+
+_GC = np.zeros(256, dtype=bool)
+for _base in 'GCgc':
+    _GC[ord(_base)] = True
+
+_BREAK = np.zeros(256, dtype=bool)
+_BREAK[_NEWLINE] = _BREAK[_RETURN] = True
+
+
+def _prefix_sum(mask):
+    '''Return cumulative counts with a leading 0, so counts of [a, b) are c[b] - c[a]'''
+    counts = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=counts[1:])
+    return counts
+
+
+class RecordBatch(object):
+    '''
+    Consecutive records of one file. Fields:
+    buffer - the bytes of the records, a uint8 numpy array.
+    format - FASTQ or FASTA.
+    starts, ends - where each record starts and ends, including its last line break.
+    seq_starts, seq_ends - where each sequence starts and ends.
+    qual_starts, qual_ends - where each quality string starts and ends,
+        None for FASTA.
+    lengths - the number of bases of each record.
+    '''
+
+    def __init__(self, buffer, format, starts, ends, seq_starts, seq_ends,
+                 qual_starts=None, qual_ends=None):
+        self.buffer = buffer
+        self.format = format
+        self.starts = starts
+        self.ends = ends
+        self.seq_starts = seq_starts
+        self.seq_ends = seq_ends
+        self.qual_starts = qual_starts
+        self.qual_ends = qual_ends
+        if format == FASTA:
+            breaks = _prefix_sum(_BREAK[buffer])
+            self.lengths = (seq_ends - seq_starts) - (breaks[seq_ends] - breaks[seq_starts])
+        else:
+            self.lengths = seq_ends - seq_starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def nbytes(self):
+        return int(self.ends[-1] - self.starts[0]) if len(self) else 0
+
+    def take(self, n):
+        '''Return a batch of the first n records'''
+        quals = (None, None) if self.qual_starts is None else \
+            (self.qual_starts[:n], self.qual_ends[:n])
+        return RecordBatch(self.buffer, self.format, self.starts[:n], self.ends[:n],
+                           self.seq_starts[:n], self.seq_ends[:n], *quals)
+
+    def subset(self, index):
+        '''Return a batch of the records at an array of indices'''
+        quals = (None, None) if self.qual_starts is None else \
+            (self.qual_starts[index], self.qual_ends[index])
+        return RecordBatch(self.buffer, self.format, self.starts[index], self.ends[index],
+                           self.seq_starts[index], self.seq_ends[index], *quals)
+
+    def record(self, i):
+        '''Return the bytes of a record as a memoryview'''
+        return memoryview(self.buffer[self.starts[i]:self.ends[i]])
+
+    def seq(self, i):
+        '''Return the sequence of a record as a memoryview'''
+        return memoryview(self.buffer[self.seq_starts[i]:self.seq_ends[i]])
+
+    def qual(self, i):
+        '''Return the qualities of a FASTQ record as a memoryview'''
+        return memoryview(self.buffer[self.qual_starts[i]:self.qual_ends[i]])
+
+    def name(self, i):
+        '''Return the name of a record, its header up to the first whitespace'''
+        header = self.buffer[self.starts[i] + 1:self.seq_starts[i]].tostring()
+        return header.split(None, 1)[0] if header.strip() else ''
+
+    def name_bounds(self):
+        '''Return (starts, ends) of the names of all records, headers up to the first whitespace'''
+        buf = self.buffer
+        starts = self.starts + 1
+        # the header line ends before the break in front of the sequence
+        header_ends = self.seq_starts - (buf[np.maximum(self.seq_starts - 1, 0)] == _NEWLINE)
+        header_ends = np.maximum(_strip_return(buf, starts, header_ends), starts)
+        spaces = np.flatnonzero((buf == ord(' ')) | (buf == ord('\t')))
+        if not len(spaces):
+            return starts, header_ends
+        first = spaces[np.minimum(np.searchsorted(spaces, starts), len(spaces) - 1)]
+        return starts, np.where((first >= starts) & (first < header_ends), first, header_ends)
+
+    def qual_lengths(self):
+        '''Return the length of the quality string of each FASTQ record'''
+        return self.qual_ends - self.qual_starts
+
+    def gc_counts(self):
+        '''Return the number of G and C bases of each record'''
+        gc = _prefix_sum(_GC[self.buffer])
+        return gc[self.seq_ends] - gc[self.seq_starts]
+
+    def quality_sums(self, offset=33):
+        '''Return the sum of the Phred scores of each FASTQ record'''
+        if self.qual_starts is None:
+            raise ValueError('FASTA records have no qualities')
+        scores = _prefix_sum(self.buffer)
+        return scores[self.qual_ends] - scores[self.qual_starts] - \
+            offset * (self.qual_ends - self.qual_starts)
+
+    def _mask(self, starts, ends):
+        edges = np.zeros(len(self.buffer) + 1, dtype=np.int64)
+        np.add.at(edges, starts, 1)
+        np.add.at(edges, ends, -1)
+        return np.cumsum(edges[:-1]) > 0
+
+    def seq_mask(self):
+        '''Return a bool array over buffer marking the bytes of sequences'''
+        return self._mask(self.seq_starts, self.seq_ends)
+
+    def qual_mask(self):
+        '''Return a bool array over buffer marking the bytes of FASTQ qualities'''
+        return self._mask(self.qual_starts, self.qual_ends)
+
+    def record_of(self, offsets):
+        '''Return the index of the record each of an array of buffer offsets falls in'''
+        return np.searchsorted(self.starts, offsets, side='right') - 1
+
+    def write(self, f, keep=None):
+        '''
+        Write the records to a file object, only those where the bool array
+        keep is set if given. Runs of consecutive records go out as one slice.
+        '''
+        if not len(self):
+            return
+        if keep is None:
+            f.write(memoryview(self.buffer[self.starts[0]:self.ends[-1]]))
+            return
+        keep = np.asarray(keep, dtype=bool)
+        changes = np.flatnonzero(np.diff(np.concatenate(([False], keep, [False])).astype(np.int8)))
+        for first, last in zip(changes[0::2], changes[1::2]):
+            f.write(memoryview(self.buffer[self.starts[first]:self.ends[last - 1]]))
+
+    def write_trimmed(self, f, lengths, keep=None):
+        '''
+        Write FASTQ records cut down to the first lengths bases, only those
+        where the bool array keep is set if given. The separator line is
+        written as a bare "+".
+        '''
+        if self.format != FASTQ:
+            raise ValueError('Only FASTQ records can be trimmed')
+        index = np.arange(len(self)) if keep is None else np.flatnonzero(keep)
+        if not len(index):
+            return
+        lengths = np.asarray(lengths, dtype=np.int64)[index]
+        literal = len(self.buffer)
+        # each record is its header line, the trimmed sequence, "\n+\n", the
+        # trimmed qualities and "\n"; gathered from the buffer with the
+        # separators appended after it
+        sources = np.column_stack((self.starts[index], np.full(len(index), literal),
+                                   self.qual_starts[index], np.full(len(index), literal)))
+        sizes = np.column_stack((self.seq_starts[index] + lengths - self.starts[index],
+                                 np.full(len(index), 3), lengths, np.ones(len(index), np.int64)))
+        extended = np.concatenate((self.buffer, np.frombuffer(b'\n+\n', dtype=np.uint8)))
+        f.write(memoryview(gather(extended, sources.ravel(), sizes.ravel())))
+
+
+def gather(source, starts, sizes):
+    '''Return the slices [starts, starts + sizes) of the array source one after the other'''
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return source[np.repeat(starts - offsets, sizes) + np.arange(int(np.sum(sizes)))]
+
+
+def _line_bounds(buf, eof):
+    '''Return (starts, ends) of the complete lines of buf, ends excluding the break'''
+    ends = np.flatnonzero(buf == _NEWLINE)
+    if eof and len(buf) and buf[-1] != _NEWLINE:
+        ends = np.append(ends, len(buf))
+    ends = ends.astype(np.int64)
+    starts = np.concatenate(([0], ends[:-1] + 1)) if len(ends) else ends
+    return starts.astype(np.int64), ends
+
+
+def _strip_return(buf, starts, ends):
+    '''Move line ends before a trailing carriage return'''
+    if len(ends):
+        ends = ends - ((ends > starts) & (buf[np.maximum(ends - 1, 0)] == _RETURN))
+    return ends
+
+
+def parse_buffer(buf, eof, max_records=None, format=None):
+    '''
+    Parse the complete records at the start of buf, a uint8 array. Unless
+    eof, the last record is taken to be cut off. Return (batch, consumed),
+    consumed being the number of bytes of the records in batch.
+    '''
+    starts, ends = _line_bounds(buf, eof)
+    if format is None and len(starts):
+        format = FASTA if buf[starts[0]] == ord('>') else FASTQ
+    if eof:
+        # blank lines at the end of a file
+        blank = len(ends)
+        while blank and _strip_return(buf, starts[blank - 1:blank], ends[blank - 1:blank])[0] == \
+                starts[blank - 1]:
+            blank -= 1
+        if format == FASTQ and blank:
+            # the empty sequence or qualities of the last record are blank lines too
+            blank = min(len(ends), -(-blank // 4) * 4)
+        starts, ends = starts[:blank], ends[:blank]
+    if not len(starts):
+        return None, 0
+    if format == FASTQ:
+        batch = _parse_fastq(buf, starts, ends, eof, max_records)
+    else:
+        batch = _parse_fasta(buf, starts, ends, eof, max_records)
+    if batch is None or not len(batch):
+        return None, 0
+    consumed = int(batch.ends[-1])
+    # the rest of buf belongs to the next batch
+    batch.buffer = buf[:consumed]
+    return batch, consumed
+
+
+def _parse_fastq(buf, starts, ends, eof, max_records):
+    n = len(starts) // 4
+    if eof and len(starts) % 4:
+        raise ValueError('FASTQ data ends in a truncated record')
+    if max_records is not None:
+        n = min(n, max_records)
+    if not n:
+        return None
+    starts, ends = starts[:4 * n], ends[:4 * n]
+    if not (buf[starts[0::4]] == ord('@')).all() or not (buf[starts[2::4]] == ord('+')).all():
+        bad = np.flatnonzero((buf[starts[0::4]] != ord('@')) | (buf[starts[2::4]] != ord('+')))[0]
+        raise ValueError('Malformed FASTQ record at byte {}'.format(starts[4 * bad]))
+    record_ends = np.minimum(ends[3::4] + 1, len(buf))
+    return RecordBatch(buf, FASTQ, starts[0::4], record_ends, starts[1::4],
+                       _strip_return(buf, starts[1::4], ends[1::4]), starts[3::4],
+                       _strip_return(buf, starts[3::4], ends[3::4]))
+
+
+def _parse_fasta(buf, starts, ends, eof, max_records):
+    headers = np.flatnonzero(buf[starts] == ord('>'))
+    if not len(headers) or headers[0] != 0:
+        raise ValueError('FASTA data does not start with a header')
+    record_starts = starts[headers]
+    seq_starts = np.minimum(ends[headers] + 1, len(buf))
+    record_ends = np.append(record_starts[1:], min(ends[-1] + 1, len(buf)))
+    if not eof:
+        # the sequence of the last record may go on beyond buf
+        record_starts, seq_starts, record_ends = record_starts[:-1], seq_starts[:-1], record_ends[:-1]
+    if max_records is not None:
+        record_starts, seq_starts, record_ends = (record_starts[:max_records], seq_starts[:max_records],
+                                                  record_ends[:max_records])
+    if not len(record_starts):
+        return None
+    # the sequence ends before the line break of its last line
+    seq_ends = np.maximum(record_ends - 1, seq_starts)
+    seq_ends -= (seq_ends > seq_starts) & (buf[np.maximum(seq_ends - 1, 0)] == _RETURN)
+    at_break = (record_ends > seq_starts) & (buf[np.maximum(record_ends - 1, 0)] != _NEWLINE)
+    seq_ends = np.where(at_break, record_ends, seq_ends)
+    return RecordBatch(buf, FASTA, record_starts, record_ends, seq_starts, seq_ends)
+
+
+class _MappedSource(object):
+
+    def __init__(self, path):
+        size = os.path.getsize(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r') if size else np.zeros(0, np.uint8)
+        self.pos = 0
+
+    def peek(self, size):
+        end = min(self.pos + size, len(self.data))
+        return self.data[self.pos:end], end == len(self.data)
+
+    def advance(self, n):
+        self.pos += n
+
+    def close(self):
+        pass
+
+
+class _StreamSource(object):
+
+    def __init__(self, f):
+        self.f = f
+        self.data = b''
+        self.eof = False
+
+    def peek(self, size):
+        while len(self.data) < size and not self.eof:
+            chunk = self.f.read(max(size - len(self.data), 1 << 20))
+            if not chunk:
+                self.eof = True
+            self.data += chunk
+        return np.frombuffer(self.data[:size], dtype=np.uint8), \
+            self.eof and len(self.data) <= size
+
+    def advance(self, n):
+        self.data = self.data[n:]
+
+    def close(self):
+        self.f.close()
+
+
+def is_gzip(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def iter_batches(path, max_records=None, batch_bytes=16 * 1024**2):
+    '''
+    Yield the records of a FASTQ or FASTA file in RecordBatches of about
+    batch_bytes, or of exactly max_records but for the last one if given.
+    '''
+    source = _StreamSource(gzip.open(path, 'rb')) if is_gzip(path) else _MappedSource(path)
+    try:
+        size = batch_bytes
+        format = None
+        while True:
+            buf, eof = source.peek(size)
+            if not len(buf):
+                return
+            batch, consumed = parse_buffer(buf, eof, max_records, format)
+            if batch is None or (max_records is not None and len(batch) < max_records and not eof):
+                if eof:
+                    if batch is None:
+                        return
+                else:
+                    # a record longer than the window, or too few for max_records
+                    size *= 2
+                    continue
+            format = batch.format
+            yield batch
+            source.advance(consumed)
+            size = batch_bytes
+            if max_records is not None:
+                # the next max_records most likely take about as many bytes
+                size = min(batch_bytes, consumed + consumed // 8 + 1024)
+    finally:
+        source.close()
+
+
+def count_records(path, batch_bytes=16 * 1024**2):
+    '''Return the number of records of a FASTQ or FASTA file'''
+    return sum(len(batch) for batch in iter_batches(path, batch_bytes=batch_bytes))
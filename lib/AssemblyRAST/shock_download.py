@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, resumable downloads of Shock nodes.
+
+A large node is split into byte ranges fetched concurrently over a pooled
+set of connections and written in place into a preallocated file. Finished
+ranges are recorded next to the file, so a download that failed part way
+picks up where it stopped. The assembled file is checked against the
+handle's remote_md5. Small nodes, and servers that ignore Range requests,
+get a plain single stream download.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(ValueError):
+    '''A Shock node could not be downloaded or failed verification'''
+
+
+class _NoRanges(Exception):
+    '''The server answered a Range request with the whole file'''
+
+
+def _node_url(handle):
+    url = handle['url'].rstrip('/')
+    if not url.startswith('http'):
+        url = 'http://' + url
+    return '{}/node/{}'.format(url, handle['id'])
+
+
+def file_md5(path, chunk_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class RangedDownloader(object):
+    '''
+    parallelism - the number of ranges fetched at once
+    part_size - the size of a range in bytes
+    min_ranged_bytes - nodes smaller than this are fetched in one stream
+    retries - attempts per range before the download fails
+    timeout - seconds before an individual request fails
+    '''
+
+    PROGRESS = '.progress'
+
+    def __init__(self, parallelism=4, part_size=64 * 1024**2,
+                 min_ranged_bytes=128 * 1024**2, retries=3, timeout=300,
+                 session=None):
+        if parallelism < 1:
+            raise ValueError('parallelism must be at least 1')
+        self.parallelism = parallelism
+        self.part_size = part_size
+        self.min_ranged_bytes = min_ranged_bytes
+        self.retries = retries
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=parallelism,
+                                  pool_maxsize=parallelism)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def _headers(self, token):
+        if token:
+            return {'Authorization': 'OAuth {}'.format(token)}
+        return {}
+
+    def node_size(self, handle, token):
+        '''Return the size of a node from its Shock metadata, None if unknown'''
+        try:
+            resp = self.session.get(_node_url(handle), headers=self._headers(token),
+                                    timeout=self.timeout)
+            resp.raise_for_status()
+            return int(resp.json()['data']['file']['size'])
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            return None
+
+    def read_head(self, handle, token, max_bytes):
+        '''Return up to the first max_bytes of a node, without fetching the rest'''
+        headers = self._headers(token)
+        headers['Range'] = 'bytes=0-{}'.format(max_bytes - 1)
+        try:
+            resp = self.session.get(_node_url(handle) + '?download', headers=headers,
+                                    stream=True, timeout=self.timeout)
+            try:
+                resp.raise_for_status()
+                chunks = []
+                length = 0
+                # a server ignoring Range sends everything; stop reading early
+                for chunk in resp.iter_content(1 << 16):
+                    chunks.append(chunk)
+                    length += len(chunk)
+                    if length >= max_bytes:
+                        break
+            finally:
+                resp.close()
+        except requests.RequestException as e:
+            raise DownloadError('Unable to read Shock node {}: {}'.format(handle['id'], e))
+        return b''.join(chunks)[:max_bytes]
+
+    def download(self, handle, token, path, progress=None, size=None):
+        '''
+        Download the node of a Shock handle to path. A partial download
+        left at path by an earlier attempt is resumed. size is the size of
+        the node if the caller already knows it. With a progress callback,
+        progress(bytes) is called as the part of the file written front to
+        back grows; ranges are then fetched in order, at most parallelism
+        of them beyond that part, trading some of the concurrency for a
+        file that can be read while it arrives.
+        '''
+        if size is None:
+            size = self.node_size(handle, token)
+        try:
+            if size is None or size < self.min_ranged_bytes:
+                self._download_stream(handle, token, path, progress)
+            else:
+                try:
+                    self._download_ranges(handle, token, path, size, progress)
+                except _NoRanges:
+                    logger.info('Shock at {} ignores Range requests'.format(handle['url']))
+                    self._download_stream(handle, token, path, progress)
+        except requests.RequestException as e:
+            raise DownloadError('Unable to download Shock node {}: {}'.format(
+                handle['id'], e))
+        if handle.get('remote_md5'):
+            md5 = file_md5(path)
+            if md5 != handle['remote_md5']:
+                self.discard(path)
+                raise DownloadError('Shock node {} has MD5 {}, expected {}'.format(
+                    handle['id'], md5, handle['remote_md5']))
+        self._remove(path + self.PROGRESS)
+
+    def discard(self, path):
+        '''Remove a partial download so the next attempt starts afresh'''
+        self._remove(path)
+        self._remove(path + self.PROGRESS)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _download_stream(self, handle, token, path, progress=None):
+        resp = self.session.get(_node_url(handle) + '?download',
+                                headers=self._headers(token), stream=True,
+                                timeout=self.timeout)
+        resp.raise_for_status()
+        written = 0
+        with open(path, 'wb') as f:
+            for chunk in resp.iter_content(1 << 20):
+                f.write(chunk)
+                if progress is not None:
+                    f.flush()
+                    written += len(chunk)
+                    progress(written)
+
+    def _load_progress(self, path, size):
+        try:
+            with open(path + self.PROGRESS) as f:
+                progress = json.load(f)
+            if progress['size'] == size and progress['part_size'] == self.part_size \
+                    and os.path.getsize(path) == size:
+                return set(progress['done'])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _save_progress(self, path, size, done):
+        tmp = path + self.PROGRESS + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': size, 'part_size': self.part_size,
+                       'done': sorted(done)}, f)
+        os.rename(tmp, path + self.PROGRESS)
+
+    def _download_ranges(self, handle, token, path, size, progress=None):
+        parts = [(start, min(start + self.part_size, size) - 1)
+                 for start in range(0, size, self.part_size)]
+        done = self._load_progress(path, size)
+        if done is None:
+            done = set()
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        else:
+            logger.info('Resuming download of Shock node {}, {} of {} ranges done'.format(
+                handle['id'], len(done), len(parts)))
+        lock = threading.Lock()
+        url = _node_url(handle) + '?download'
+
+        def fetch(index):
+            start, end = parts[index]
+            attempt = 0
+            while True:
+                try:
+                    self._fetch_range(url, token, path, start, end)
+                    break
+                except requests.RequestException as e:
+                    attempt += 1
+                    if attempt >= self.retries:
+                        raise
+                    logger.warning('Retrying bytes {}-{} of Shock node {}: {}'.format(
+                        start, end, handle['id'], e))
+                    time.sleep(2 ** attempt)
+            with lock:
+                done.add(index)
+                self._save_progress(path, size, done)
+
+        def report():
+            with lock:
+                missing = next((n for n in range(len(parts)) if n not in done), len(parts))
+            progress(min(missing * self.part_size, size))
+
+        todo = [n for n in range(len(parts)) if n not in done]
+        pool = ThreadPool(min(self.parallelism, len(todo)) or 1)
+        try:
+            if progress is None:
+                pool.map(fetch, todo)
+            else:
+                report()
+                fetching = collections.deque()
+                for index in todo:
+                    if len(fetching) == self.parallelism:
+                        fetching.popleft().get()
+                        report()
+                    fetching.append(pool.apply_async(fetch, (index,)))
+                while fetching:
+                    fetching.popleft().get()
+                    report()
+        finally:
+            pool.close()
+            pool.join()
+
+    def _fetch_range(self, url, token, path, start, end):
+        headers = self._headers(token)
+        headers['Range'] = 'bytes={}-{}'.format(start, end)
+        resp = self.session.get(url, headers=headers, stream=True,
+                                timeout=self.timeout)
+        try:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise _NoRanges()
+            written = 0
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                for chunk in resp.iter_content(1 << 20):
+                    f.write(chunk)
+                    written += len(chunk)
+            if written != end - start + 1:
+                raise requests.RequestException(
+                    'Got {} of {} bytes'.format(written, end - start + 1))
+        finally:
+            resp.close()
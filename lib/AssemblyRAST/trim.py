@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Adapter and quality trimming of reads before assembly.
+
+Reads are cut at the first occurrence of the adapter, or at a prefix of
+it running off their end, and their low quality tail is cut the way BWA
+and cutadapt do: going back from the end, the tail kept off is the one
+where the sum of (cutoff - quality) is largest, looking no further than
+where that sum first turns negative. Reads left shorter than min_length
+are dropped, and with them their mate, so that libraries stay paired.
+
+Trimming is a ChunkedStage: chunks of reads or pairs, cut at record
+boundaries, are trimmed in a pool of worker processes with numpy and
+written out in their original order. FASTA reads have no qualities and are
+passed through unchanged, however short.
+"""
+import io
+import logging
+
+import numpy as np
+
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED, ChunkedStage
+from AssemblyRAST.seqfile import FASTQ
+
+logger = logging.getLogger(__name__)
+
+# the start of the adapters of Illumina TruSeq and Nextera libraries
+ADAPTERS = {'truseq': 'AGATCGGAAGAGC', 'nextera': 'CTGTCTCTTATACACATCT'}
+
+
+def _segments(lengths):
+    '''Return the start of consecutive segments of lengths, and the position of every element in its segment'''
+    firsts = np.concatenate(([0], np.cumsum(lengths)))
+    within = np.arange(int(firsts[-1])) - np.repeat(firsts[:-1], lengths)
+    return firsts, within
+
+
+def adapter_cuts(batch, adapter, min_overlap=3):
+    '''
+    Return the number of bases of each read of a RecordBatch before the
+    adapter, or before a prefix of at least min_overlap bases of it at the
+    end of the read, the read length if neither is found.
+    '''
+    buf = batch.buffer
+    starts, ends = batch.seq_starts, batch.seq_ends
+    cuts = (ends - starts).copy()
+    bases = np.frombuffer(adapter, dtype=np.uint8)
+    size = len(bases)
+    if len(buf) >= size:
+        found = np.ones(len(buf) - size + 1, dtype=bool)
+        for j in range(size):
+            found &= buf[j:len(buf) - size + 1 + j] == bases[j]
+        hits = np.flatnonzero(found)
+        reads = np.searchsorted(starts, hits, side='right') - 1
+        inside = (reads >= 0) & (hits + size <= ends[np.maximum(reads, 0)])
+        hits, reads = hits[inside], reads[inside]
+        # hits are in order, so the first of each read is its first hit
+        reads, first = np.unique(reads, return_index=True)
+        cuts[reads] = hits[first] - starts[reads]
+    for overlap in range(min_overlap, size):
+        at = ends - overlap
+        match = at >= starts
+        for j in range(overlap):
+            match &= buf[np.clip(at + j, 0, len(buf) - 1)] == bases[j]
+        cuts = np.where(match, np.minimum(cuts, at - starts), cuts)
+    return cuts
+
+
+def quality_cuts(batch, cutoff, offset=33):
+    '''
+    Return the number of bases of each read of a FASTQ RecordBatch left
+    after cutting its low quality tail.
+    '''
+    lengths = batch.qual_lengths()
+    firsts, within = _segments(lengths)
+    scores = cutoff - (batch.buffer[np.repeat(batch.qual_starts, lengths) + within]
+                       .astype(np.int64) - offset)
+    totals = np.concatenate(([0], np.cumsum(scores)))
+    # tails[k] is the sum of the scores from k to the end, for k = 0..length
+    points = lengths + 1
+    starts, at = _segments(points)
+    read = np.repeat(np.arange(len(lengths)), points)
+    tails = totals[firsts[1:]][read] - totals[firsts[:-1][read] + at]
+    # look no further back than the last point where the sum is negative
+    boundary = np.maximum.reduceat(np.where(tails < 0, at, -1), starts[:-1])
+    candidate = at > boundary[read]
+    best = np.maximum.reduceat(np.where(candidate, tails, -1), starts[:-1])
+    # of equal sums the one cutting least, which is the read length if nothing pays off
+    return np.maximum.reduceat(np.where(candidate & (tails == best[read]), at, -1), starts[:-1])
+
+
+class Trimming(ChunkedStage):
+    '''
+    adapter - the start of the adapter sequence, None not to cut adapters
+    quality - the quality cutoff of tails, None not to trim them
+    min_length - reads shorter than this after trimming are dropped
+    workers - the number of chunks trimmed at once in pool
+    pool - the multiprocessing.Pool chunks are trimmed in, None to trim in this process
+    chunk_size - the number of reads or pairs trimmed by a worker at once
+    '''
+
+    name = 'trim'
+    stat_keys = ('reads_in', 'reads_kept', 'bases_in', 'bases_kept')
+
+    def __init__(self, adapter=None, quality=None, min_length=30, workers=4, chunk_size=50000,
+                 pool=None):
+        if adapter is None and quality is None:
+            raise ValueError('Trimming needs an adapter or a quality cutoff')
+        if adapter is not None:
+            adapter = ADAPTERS.get(adapter.lower(), adapter).upper()
+            if not adapter or set(adapter) - set('ACGT'):
+                raise ValueError('The adapter must be a DNA sequence or one of ' +
+                                 ', '.join(sorted(ADAPTERS)))
+        self.adapter = adapter
+        self.quality = quality
+        self.min_length = min_length
+        self.workers = workers
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+    def key(self):
+        return 'trim:adapter={}:quality={}:min_length={}'.format(
+            self.adapter, self.quality, self.min_length)
+
+    def cuts(self, batch):
+        '''Return the number of bases of each read of a RecordBatch left after trimming'''
+        cuts = batch.lengths
+        if batch.format != FASTQ:
+            return cuts
+        if self.adapter is not None:
+            cuts = np.minimum(cuts, adapter_cuts(batch, self.adapter))
+        if self.quality is not None:
+            cuts = np.minimum(cuts, quality_cuts(batch, self.quality))
+        return cuts
+
+    def process_chunk(self, layout, batches):
+        lengths = [self.cuts(batch) for batch in batches]
+        # FASTA reads are not trimmed, so the length filter leaves them alone too
+        long_enough = [cut >= self.min_length if batch.format == FASTQ
+                       else np.ones(len(batch), dtype=bool)
+                       for batch, cut in zip(batches, lengths)]
+        if layout == PAIRED:
+            keep = [long_enough[0] & long_enough[1]] * 2
+        elif layout == INTERLEAVED:
+            keep = [np.repeat(long_enough[0][0::2] & long_enough[0][1::2], 2)]
+        else:
+            keep = long_enough
+        stats = dict((key, 0) for key in self.stat_keys)
+        outputs = []
+        for batch, cut, kept in zip(batches, lengths, keep):
+            stats['reads_in'] += len(batch)
+            stats['reads_kept'] += int(kept.sum())
+            stats['bases_in'] += int(batch.lengths.sum())
+            stats['bases_kept'] += int(cut[kept].sum())
+            out = io.BytesIO()
+            if batch.format == FASTQ:
+                batch.write_trimmed(out, cut, kept)
+            else:
+                batch.write(out, kept)
+            outputs.append(out.getvalue())
+        return outputs, stats
+
+    def run(self, layout, inputs, outputs):
+        stats = ChunkedStage.run(self, layout, inputs, outputs)
+        logger.info('Trimmed {} reads to {}'.format(stats['reads_in'], stats['reads_kept']))
+        return stats
+
+    def describe(self, stats):
+        settings = []
+        if self.adapter is not None:
+            settings.append('adapter {}'.format(self.adapter))
+        if self.quality is not None:
+            settings.append('quality {}'.format(self.quality))
+        settings.append('min length {}'.format(self.min_length))
+        return 'Trimming ({}): removed {} of {} reads and {} of {} bp'.format(
+            ', '.join(settings), stats['reads_in'] - stats['reads_kept'], stats['reads_in'],
+            stats['bases_in'] - stats['bases_kept'], stats['bases_in'])
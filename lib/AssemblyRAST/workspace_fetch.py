@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Fetching read library objects from the Workspace.
+
+Only the handle fields combine_read_libs looks at are requested, so large
+libraries with embedded metadata or QC results are not downloaded in full.
+Objects addressed by a versioned reference never change, so they can be
+kept in a process wide ObjectCache and shared between calls. Long object
+lists are split into chunks fetched concurrently, each retried on its own
+when the connection to the Workspace fails.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# the object paths combine_read_libs reads, for KBaseFile and KBaseAssembly
+# paired and single end libraries
+READ_LIBRARY_PATHS = ['lib1/file', 'lib2/file', 'handle_1', 'handle_2',
+                      'interleaved', 'lib/file', 'handle']
+
+_HANDLE_KEYS = ('lib1', 'lib2', 'handle_1', 'handle_2', 'lib', 'handle')
+
+# seconds before the first retry of a chunk, doubled for every further one
+RETRY_DELAY = 1.0
+
+
+def _versioned_ref(info):
+    return '{}/{}/{}'.format(info[6], info[0], info[4])
+
+
+class ObjectCache(object):
+    '''
+    A thread safe LRU cache of Workspace objects keyed on their versioned
+    reference. Objects are stored serialized, so every get returns a copy
+    the caller is free to modify.
+
+    max_entries - the maximum number of cached objects
+    max_bytes - the maximum total size of the serialized objects
+    '''
+
+    def __init__(self, max_entries=1000, max_bytes=256 * 1024**2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ref):
+        with self._lock:
+            value = self._entries.pop(ref, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[ref] = value
+            self.hits += 1
+        return json.loads(value)
+
+    def put(self, ref, obj):
+        value = json.dumps(obj)
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(ref, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[ref] = value
+            self.bytes += len(value)
+            while len(self._entries) > self.max_entries or \
+                    self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def _chunked(method, result_key, specs, chunk_size, workers, retries):
+    '''
+    Call a Workspace method such as get_objects2 on specs in chunks of
+    chunk_size, at most workers at a time, and return the results in the
+    order of specs. A chunk failing with a connection error or an HTTP
+    error status is retried up to retries times.
+    '''
+    chunks = [specs[i:i + chunk_size] for i in range(0, len(specs), chunk_size)]
+
+    def call(chunk):
+        attempt = 0
+        while True:
+            try:
+                return method({'objects': chunk})[result_key]
+            except requests.RequestException as e:
+                if attempt >= retries:
+                    raise
+                logger.warning('Retrying a chunk of {} objects after: {}'.format(
+                    len(chunk), e))
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+                attempt += 1
+
+    if len(chunks) <= 1:
+        results = [call(chunk) for chunk in chunks]
+    else:
+        pool = ThreadPool(min(workers, len(chunks)))
+        try:
+            results = pool.map(call, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    return [obj for chunk in results for obj in chunk]
+
+
+def fetch_read_libs(ws, refs, cache=None, chunk_size=100, workers=4, retries=2):
+    '''
+    Return the read library objects for refs, in order, with their data
+    restricted to READ_LIBRARY_PATHS. An object with none of those paths
+    is of a type we do not know the layout of, and is fetched in full.
+
+    With a cache, refs are first resolved to versioned references through
+    the caller's ws client. That cheap call also confirms the caller may
+    read every object, so cached objects are never handed to a user who
+    could not have fetched them.
+
+    chunk_size, workers and retries control how long lists of refs are
+    split into concurrent Workspace requests.
+    '''
+    opts = {'chunk_size': chunk_size, 'workers': workers, 'retries': retries}
+    if cache is None:
+        return _fetch_read_libs(ws, refs, opts)
+    infos = _chunked(ws.get_object_info3, 'infos', [{'ref': ref} for ref in refs], **opts)
+    objects = [cache.get(_versioned_ref(info)) for info in infos]
+    missing = [n for n, obj in enumerate(objects) if obj is None]
+    if missing:
+        fetched = _fetch_read_libs(ws, [refs[n] for n in missing], opts)
+        for n, obj in zip(missing, fetched):
+            cache.put(_versioned_ref(obj['info']), obj)
+            objects[n] = obj
+    return objects
+
+
+def _fetch_read_libs(ws, refs, opts):
+    specs = [{'ref': ref, 'included': READ_LIBRARY_PATHS} for ref in refs]
+    objects = _chunked(ws.get_objects2, 'data', specs, **opts)
+    unknown = [n for n, obj in enumerate(objects)
+               if not any(key in obj['data'] for key in _HANDLE_KEYS)]
+    if unknown:
+        logger.info('Fetching {} objects of unknown layout in full: {}'.format(
+            len(unknown), ', '.join(objects[n]['info'][2] for n in unknown)))
+        full = _chunked(ws.get_objects2, 'data',
+                        [{'ref': _versioned_ref(objects[n]['info'])} for n in unknown], **opts)
+        for n, obj in zip(unknown, full):
+            objects[n] = obj
+    return objects
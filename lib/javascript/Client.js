@@ -162,6 +162,19 @@ function AssemblyRAST(url, auth, auth_cb, timeout, async_job_check_time_ms, serv
             [params], 1, _callback, _errorCallback);
     };
   
+    this.run_arast_batch = function (params, _callback, _errorCallback) {
+        if (typeof params === 'function')
+            throw 'Argument params can not be a function';
+        if (_callback && typeof _callback !== 'function')
+            throw 'Argument _callback must be a function if defined';
+        if (_errorCallback && typeof _errorCallback !== 'function')
+            throw 'Argument _errorCallback must be a function if defined';
+        if (typeof arguments === 'function' && arguments.length > 1+2)
+            throw 'Too many arguments ('+arguments.length+' instead of '+(1+2)+')';
+        return json_call_ajax(_url, "AssemblyRAST.run_arast_batch",
+            [params], 1, _callback, _errorCallback);
+    };
+ 
     this.status = function (_callback, _errorCallback) {
         if (_callback && typeof _callback !== 'function')
             throw 'Argument _callback must be a function if defined';
@@ -19,12 +19,32 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
  * workspace_name - the name of the workspace for input/output
  * read_library_name - the name of the PE read library (SE library support in the future)
  * output_contig_set_name - the name of the output contigset
- * extra_params - assembler specific parameters
+ * extra_params - key=value options preprocessing the reads before
+ *                assembly: trim_adapter, trim_quality, trim_min_length,
+ *                merge_pairs, merge_min_overlap, merge_max_mismatch_rate,
+ *                normalize_coverage and normalize_k; the server must
+ *                have stage-reads enabled
  * min_contig_length - minimum length of contigs to output, default 200
+ * assemblers - several assemblers to run concurrently on the same input;
+ *              one assembly is saved per assembler, named
+ *              <output_contigset_name>.<assembler>, with a single
+ *              comparative report
+ * race - run the assemblers (default megahit, velvet, miniasm) and keep
+ *        the first assembly meeting the thresholds below; the other
+ *        ARAST jobs are cancelled
+ * min_n50 - minimum N50 of an acceptable assembly when racing
+ * min_total_len - minimum total contig length when racing
+ * max_contigs - maximum number of contigs when racing
  * @optional recipe
  * @optional assembler
+ * @optional assemblers
  * @optional pipeline
  * @optional min_contig_len
+ * @optional race
+ * @optional min_n50
+ * @optional min_total_len
+ * @optional max_contigs
+ * @optional extra_params
  * </pre>
  * 
  */
@@ -37,8 +57,14 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
     "output_contigset_name",
     "recipe",
     "assembler",
+    "assemblers",
     "pipeline",
-    "min_contig_len"
+    "min_contig_len",
+    "race",
+    "min_n50",
+    "min_total_len",
+    "max_contigs",
+    "extra_params"
 })
 public class ArastParams {
 
@@ -54,10 +80,22 @@ public class ArastParams {
     private java.lang.String recipe;
     @JsonProperty("assembler")
     private java.lang.String assembler;
+    @JsonProperty("assemblers")
+    private List<String> assemblers;
     @JsonProperty("pipeline")
     private java.lang.String pipeline;
     @JsonProperty("min_contig_len")
     private Long minContigLen;
+    @JsonProperty("race")
+    private Long race;
+    @JsonProperty("min_n50")
+    private Long minN50;
+    @JsonProperty("min_total_len")
+    private Long minTotalLen;
+    @JsonProperty("max_contigs")
+    private Long maxContigs;
+    @JsonProperty("extra_params")
+    private List<String> extraParams;
     private Map<java.lang.String, Object> additionalProperties = new HashMap<java.lang.String, Object>();
 
     @JsonProperty("workspace_name")
@@ -150,6 +188,21 @@ public class ArastParams {
         return this;
     }
 
+    @JsonProperty("assemblers")
+    public List<String> getAssemblers() {
+        return assemblers;
+    }
+
+    @JsonProperty("assemblers")
+    public void setAssemblers(List<String> assemblers) {
+        this.assemblers = assemblers;
+    }
+
+    public ArastParams withAssemblers(List<String> assemblers) {
+        this.assemblers = assemblers;
+        return this;
+    }
+
     @JsonProperty("pipeline")
     public java.lang.String getPipeline() {
         return pipeline;
@@ -180,6 +233,81 @@ public class ArastParams {
         return this;
     }
 
+    @JsonProperty("race")
+    public Long getRace() {
+        return race;
+    }
+
+    @JsonProperty("race")
+    public void setRace(Long race) {
+        this.race = race;
+    }
+
+    public ArastParams withRace(Long race) {
+        this.race = race;
+        return this;
+    }
+
+    @JsonProperty("min_n50")
+    public Long getMinN50() {
+        return minN50;
+    }
+
+    @JsonProperty("min_n50")
+    public void setMinN50(Long minN50) {
+        this.minN50 = minN50;
+    }
+
+    public ArastParams withMinN50(Long minN50) {
+        this.minN50 = minN50;
+        return this;
+    }
+
+    @JsonProperty("min_total_len")
+    public Long getMinTotalLen() {
+        return minTotalLen;
+    }
+
+    @JsonProperty("min_total_len")
+    public void setMinTotalLen(Long minTotalLen) {
+        this.minTotalLen = minTotalLen;
+    }
+
+    public ArastParams withMinTotalLen(Long minTotalLen) {
+        this.minTotalLen = minTotalLen;
+        return this;
+    }
+
+    @JsonProperty("max_contigs")
+    public Long getMaxContigs() {
+        return maxContigs;
+    }
+
+    @JsonProperty("max_contigs")
+    public void setMaxContigs(Long maxContigs) {
+        this.maxContigs = maxContigs;
+    }
+
+    public ArastParams withMaxContigs(Long maxContigs) {
+        this.maxContigs = maxContigs;
+        return this;
+    }
+
+    @JsonProperty("extra_params")
+    public List<String> getExtraParams() {
+        return extraParams;
+    }
+
+    @JsonProperty("extra_params")
+    public void setExtraParams(List<String> extraParams) {
+        this.extraParams = extraParams;
+    }
+
+    public ArastParams withExtraParams(List<String> extraParams) {
+        this.extraParams = extraParams;
+        return this;
+    }
+
     @JsonAnyGetter
     public Map<java.lang.String, Object> getAdditionalProperties() {
         return this.additionalProperties;
@@ -192,7 +320,7 @@ public class ArastParams {
 
     @Override
     public java.lang.String toString() {
-        return ((((((((((((((((((("ArastParams"+" [workspaceName=")+ workspaceName)+", readLibraryNames=")+ readLibraryNames)+", readLibraryRefs=")+ readLibraryRefs)+", outputContigsetName=")+ outputContigsetName)+", recipe=")+ recipe)+", assembler=")+ assembler)+", pipeline=")+ pipeline)+", minContigLen=")+ minContigLen)+", additionalProperties=")+ additionalProperties)+"]");
+        return ((((((((((((((((((((((((((((((("ArastParams"+" [workspaceName=")+ workspaceName)+", readLibraryNames=")+ readLibraryNames)+", readLibraryRefs=")+ readLibraryRefs)+", outputContigsetName=")+ outputContigsetName)+", recipe=")+ recipe)+", assembler=")+ assembler)+", assemblers=")+ assemblers)+", pipeline=")+ pipeline)+", minContigLen=")+ minContigLen)+", race=")+ race)+", minN50=")+ minN50)+", minTotalLen=")+ minTotalLen)+", maxContigs=")+ maxContigs)+", extraParams=")+ extraParams)+", additionalProperties=")+ additionalProperties)+"]");
     }
 
 }
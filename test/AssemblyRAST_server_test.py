@@ -305,6 +305,53 @@ class AssemblyRASTTest(unittest.TestCase):
         pprint(result)
 
 
+    def test_run_arast_compare(self):
+        pe_lib_info = self.getPairedEndLibInfo()
+        pe_lib_ref = str(pe_lib_info[6]) + '/' + str(pe_lib_info[1]) + '/' + str(pe_lib_info[4])
+
+        params = {
+            'workspace_name': pe_lib_info[7],
+            'read_library_refs': [pe_lib_ref],
+            'output_contigset_name': 'output.contigset',
+            'min_contig_length': 350,
+            'assemblers': ['kiki', 'velvet']
+        }
+
+        result = self.getImpl().run_arast(self.getContext(), params)[0]
+        self.assertIn('report_name', result)
+        self.assertIn('report_ref', result)
+        for assembler in params['assemblers']:
+            info = self.getWsClient().get_object_info_new({'objects': [
+                {'ref': pe_lib_info[7] + '/output.contigset.' + assembler}]})[0]
+            self.assertTrue(info[2].startswith('KBaseGenomeAnnotations.Assembly'))
+        print('COMPARE RESULT:')
+        pprint(result)
+
+
+    def test_run_arast_batch(self):
+        pe_lib_info = self.getPairedEndLibInfo()
+        pe_lib_ref = str(pe_lib_info[6]) + '/' + str(pe_lib_info[1]) + '/' + str(pe_lib_info[4])
+
+        params = {
+            'workspace_name': pe_lib_info[7],
+            'items': [
+                {'read_library_refs': [pe_lib_ref],
+                 'output_contigset_name': 'batch.kiki',
+                 'assembler': 'kiki'},
+                {'read_library_refs': [pe_lib_ref],
+                 'output_contigset_name': 'batch.velvet',
+                 'assembler': 'velvet'}
+            ],
+            'max_concurrency': 2
+        }
+
+        result = self.getImpl().run_arast_batch(self.getContext(), params)[0]
+        self.assertIn('report_name', result)
+        self.assertIn('report_ref', result)
+        print('BATCH RESULT:')
+        pprint(result)
+
+
     def test_run_kiki(self):
 
         # figure out where the test data lives
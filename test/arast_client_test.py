@@ -0,0 +1,94 @@
+import json
+import threading
+import unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from AssemblyRAST.arast_client import ArastClient, ArastError
+
+
+CONTIGS = '>contig_1 len=12\nACGTACGT\nACGT\n>contig_2\nGGCC\n'
+
+
+class FakeArastHandler(BaseHTTPRequestHandler):
+    '''Just enough of the arastd router and Shock to exercise the client'''
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, code=200):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        self.server.submitted.append(json.loads(self.rfile.read(length)))
+        self.server.auth.append(self.headers.getheader('authorization'))
+        self._send('42')
+
+    def do_GET(self):
+        url = 'http://localhost:{}'.format(self.server.server_port)
+        routes = {
+            '/user/alice/job/42/status': 'Complete',
+            '/user/alice/job/42/log': 'assembly log\nstage 2\n',
+            '/user/alice/job/42/report': 'N50: 12',
+            '/user/alice/job/42/assemblies': json.dumps(
+                [{'filename': 'contigs.fa', 'shock_url': url,
+                  'shock_id': 'node1'}]),
+            '/node/node1?download': CONTIGS,
+        }
+        if self.path in routes:
+            self._send(routes[self.path])
+        else:
+            self._send('not found', 404)
+
+
+class ArastClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('localhost', 0), FakeArastHandler)
+        cls.server.submitted = []
+        cls.server.auth = []
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://localhost:{}/'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_submit_job(self):
+        client = ArastClient(self.url, 'alice', 'token')
+        job_id = client.submit_job({'paired_end_libs': []}, recipe='kiki')
+        self.assertEqual(job_id, '42')
+        msg = self.server.submitted[-1]
+        self.assertEqual(msg['recipe'], ['kiki'])
+        self.assertEqual(msg['kbase_assembly_input'], {'paired_end_libs': []})
+        self.assertEqual(self.server.auth[-1], 'token')
+
+    def test_job_results(self):
+        client = ArastClient(self.url, 'alice', 'token')
+        self.assertEqual(client.get_status('42'), 'Complete')
+        self.assertEqual(client.get_log('42'), 'assembly log\nstage 2\n')
+        self.assertEqual(list(client.iter_log_lines('42')),
+                         ['assembly log', 'stage 2'])
+        self.assertEqual(client.get_report('42'), 'N50: 12')
+        self.assertEqual(list(client.iter_contigs('42')),
+                         [('contig_1 len=12', 'ACGTACGTACGT'),
+                          ('contig_2', 'GGCC')])
+
+    def test_error(self):
+        client = ArastClient(self.url, 'alice', 'token')
+        with self.assertRaises(ArastError) as cm:
+            client.get_log('7')
+        self.assertEqual(cm.exception.status_code, 404)
+        self.assertEqual(cm.exception.job_id, '7')
+
+    def test_parse_job_id(self):
+        self.assertEqual(ArastClient._parse_job_id('Job ID: 12\n'), '12')
+        self.assertEqual(ArastClient._parse_job_id('{"job_id": 3}'), '3')
+        self.assertRaises(ArastError, ArastClient._parse_job_id, 'oops')
@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from AssemblyRAST.console_log import ConsoleLog
+
+
+class ConsoleLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_ring_buffer_and_batching(self):
+        out = StringIO()
+        console = ConsoleLog(max_lines=3, flush_lines=4, flush_interval=60, stream=out)
+        for n in range(5):
+            console.append('line {}'.format(n))
+        self.assertEqual(out.getvalue(), 'line 0\nline 1\nline 2\nline 3\n')
+        self.assertEqual(console.tail(), ['line 2', 'line 3', 'line 4'])
+        self.assertEqual(console.tail(1), ['line 4'])
+        self.assertEqual(console.count, 5)
+        console.close()
+        self.assertTrue(out.getvalue().endswith('line 4\n'))
+
+    def test_flush_interval(self):
+        out = StringIO()
+        console = ConsoleLog(flush_lines=100, flush_interval=0, stream=out)
+        console.append('now')
+        self.assertEqual(out.getvalue(), 'now\n')
+
+    def test_flush_timer(self):
+        out = StringIO()
+        console = ConsoleLog(flush_lines=100, flush_interval=0.1, stream=out)
+        console.append('waiting')
+        self.assertEqual(out.getvalue(), '')
+        # written out with no further message, as when the call blocks
+        deadline = time.time() + 5
+        while not out.getvalue() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(out.getvalue(), 'waiting\n')
+        console.close()
+
+    def test_spill_json_lines(self):
+        path = os.path.join(self.dir, 'console.log.gz')
+        closed = []
+        console = ConsoleLog(max_lines=1, spill_path=path, json_lines=True,
+                             call_id='7', stream=StringIO(), on_close=lambda: closed.append(1))
+        console.append('first')
+        console.append('second')
+        console.close()
+        console.close()
+        self.assertEqual(closed, [1])
+        with gzip.open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['message'] for r in records], ['first', 'second'])
+        self.assertEqual(records[0]['call_id'], '7')
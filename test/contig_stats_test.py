@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from AssemblyRAST.contig_stats import (ContigStats, check_thresholds,
+                                       filter_contigs, format_stats)
+
+
+class ContigStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_filter_contigs(self):
+        contigs = [('c1', 'A' * 100), ('c2', 'GC' * 10), ('c3', 'ACGT' * 50),
+                   ('c4', 'ggcc' * 75)]
+        out_path = os.path.join(self.tmpdir, 'contigs.fa')
+        kept, removed = filter_contigs(iter(contigs), out_path, 50)
+        self.assertEqual(kept.count, 3)
+        self.assertEqual(removed.count, 1)
+        self.assertEqual(kept.total_length, 600)
+        self.assertEqual(kept.gc_count, 100 + 300)
+        with open(out_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], '>c1')
+        self.assertEqual(lines[2:4], ['>c3', 'ACGT' * 50])
+        self.assertEqual(len(lines), 6)
+
+    def test_n50(self):
+        stats = ContigStats()
+        for n in [2, 3, 4, 5, 6, 7, 8, 9, 10]:
+            stats.add_length(n)
+        self.assertEqual(stats.n50(), (8, 3))
+        self.assertEqual(ContigStats().n50(), (0, 0))
+
+    def test_format_stats(self):
+        stats = ContigStats()
+        stats.add('ACGT')
+        stats.add('AAAAAAAA')
+        report = format_stats(stats, bins=2)
+        self.assertIn('Assembled into 2 contigs.', report)
+        self.assertIn('N50: 8 bp, L50: 1.', report)
+        self.assertIn('GC Content: 16.67%', report)
+
+    def test_check_thresholds(self):
+        stats = ContigStats()
+        for n in [100, 200, 300]:
+            stats.add_length(n)
+        self.assertEqual(check_thresholds(stats, min_n50=200,
+                                          min_total_length=600,
+                                          max_contigs=3), [])
+        self.assertEqual(len(check_thresholds(stats, min_n50=301,
+                                              min_total_length=601,
+                                              max_contigs=2)), 3)
+        self.assertEqual(check_thresholds(ContigStats()), ['no contigs'])
@@ -0,0 +1,120 @@
+import os
+import random
+import shutil
+import string
+import tempfile
+import unittest
+
+import numpy as np
+
+from AssemblyRAST.diginorm import (CountMinSketch, DigitalNormalization, kmer_hashes,
+                                   median_abundance)
+from AssemblyRAST.preprocess import PAIRED, SINGLE
+from AssemblyRAST.seqfile import count_records, iter_batches, parse_buffer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+COMPLEMENT = string.maketrans('ACGT', 'TGCA')
+
+
+def revcomp(seq):
+    return seq[::-1].translate(COMPLEMENT)
+
+
+def batch(*seqs):
+    text = ''.join('>r{}\n{}\n'.format(n, seq) for n, seq in enumerate(seqs))
+    return parse_buffer(np.frombuffer(text, dtype=np.uint8), True)[0]
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_counts(self):
+        sketch = CountMinSketch(bits=10)
+        keys = np.array([1, 2, 2, 3, 3, 3], dtype=np.uint64)
+        sketch.add(keys)
+        self.assertEqual(list(sketch.get(np.array([1, 2, 3], dtype=np.uint64))), [1, 2, 3])
+        self.assertEqual(sketch.get(np.array([4], dtype=np.uint64))[0], 0)
+
+    def test_saturates(self):
+        sketch = CountMinSketch(bits=4, depth=1)
+        for _ in range(2):
+            sketch.add(np.array([7] * 40000, dtype=np.uint64))
+        self.assertEqual(sketch.get(np.array([7], dtype=np.uint64))[0], 65535)
+
+    def test_for_bytes(self):
+        self.assertLessEqual(CountMinSketch.for_bytes(1 << 20).nbytes, 1 << 20)
+
+
+class KmerTest(unittest.TestCase):
+
+    def test_canonical(self):
+        seq = 'ACGTTGCAAGGCTTAACCGGTA'
+        forward, _ = kmer_hashes(batch(seq), 5)
+        reverse, _ = kmer_hashes(batch(revcomp(seq)), 5)
+        self.assertEqual(sorted(forward), sorted(reverse))
+
+    def test_boundaries(self):
+        keys, read = kmer_hashes(batch('ACGTA', 'CCNCCCC', 'AC'), 3)
+        # 3 k-mers in the first read, 2 after the N in the second, none in the third
+        self.assertEqual(list(read), [0, 0, 0, 1, 1])
+
+    def test_median(self):
+        sketch = CountMinSketch(bits=12)
+        medians, keys, read = median_abundance(sketch, batch('GATTACAGGC', 'AC'), 4)
+        self.assertEqual(list(medians), [0, -1])
+        sketch.add(keys)
+        sketch.add(keys)
+        medians, _, _ = median_abundance(sketch, batch('GATTACAGGC'), 4)
+        self.assertEqual(medians[0], 2)
+
+
+class DigitalNormalizationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_caps_coverage(self):
+        rng = random.Random(1)
+        genome = ''.join(rng.choice('ACGT') for _ in range(2000))
+        with open(self.path('in.fq'), 'w') as f:
+            for n in range(10000):
+                start = rng.randint(0, len(genome) - 100)
+                seq = genome[start:start + 100]
+                if rng.random() < 0.5:
+                    seq = revcomp(seq)
+                f.write('@r{}\n{}\n+\n{}\n'.format(n, seq, 'I' * 100))
+        stage = DigitalNormalization(target=20, k=20, sketch_bytes=1 << 20, batch_size=100)
+        stats = stage.run(SINGLE, [self.path('in.fq')], [self.path('out.fq')])
+        self.assertEqual(stats['units_in'], 10000)
+        # 500x coverage is capped near 20x, about 400 reads
+        self.assertLess(stats['units_kept'], 1500)
+        self.assertGreater(stats['units_kept'], 200)
+        self.assertEqual(count_records(self.path('out.fq')), stats['units_kept'])
+        self.assertIn('kept {} of 10000'.format(stats['units_kept']), stage.describe(stats))
+
+    def test_pairs_kept_together(self):
+        inputs = [os.path.join(DATA_DIR, 'small.forward.fq'),
+                  os.path.join(DATA_DIR, 'small.reverse.fq')]
+        outputs = [self.path('1.fq'), self.path('2.fq')]
+        stats = DigitalNormalization(target=5, sketch_bytes=1 << 20).run(PAIRED, inputs, outputs)
+        forward = [b.name(i) for b in iter_batches(outputs[0]) for i in range(len(b))]
+        reverse = [b.name(i) for b in iter_batches(outputs[1]) for i in range(len(b))]
+        self.assertEqual(len(forward), stats['units_kept'])
+        self.assertEqual([name[:-2] for name in forward], [name[:-2] for name in reverse])
+        self.assertLessEqual(stats['units_kept'], stats['units_in'])
+
+    def test_mismatched_pairs(self):
+        with open(self.path('a.fq'), 'w') as f:
+            f.write('@a/1\nACGT\n+\nIIII\n' * 2)
+        with open(self.path('b.fq'), 'w') as f:
+            f.write('@a/2\nACGT\n+\nIIII\n')
+        stage = DigitalNormalization()
+        self.assertRaises(ValueError, stage.run, PAIRED, [self.path('a.fq'), self.path('b.fq')],
+                          [self.path('1.fq'), self.path('2.fq')])
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from AssemblyRAST.AssemblyRASTImpl import AssemblyRAST
+from AssemblyRAST.console_log import ConsoleLog
+from AssemblyRAST.job_journal import (JobJournal, SUBMITTED, CONTIGS_FETCHED,
+                                      REPORT_SAVED)
+from AssemblyRAST.job_loop import run_sync
+from AssemblyRAST.read_stager import LocalShock
+
+READS = '@r1\nACGT\n+\nIIII\n' * 100
+
+
+class JobJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def journal(self, params, **kwargs):
+        return JobJournal.for_call(self.tmpdir, 'alice', 'velvet', params,
+                                   **kwargs)
+
+    def test_resume(self):
+        journal = self.journal({'a': 1})
+        self.assertIsNone(journal.last_stage())
+        journal.record(SUBMITTED, job_id='7')
+        journal.record(CONTIGS_FETCHED, job_id='7', output_contigs='x')
+
+        retry = self.journal({'a': 1})
+        self.assertEqual(retry.last_stage(), CONTIGS_FETCHED)
+        self.assertEqual(retry.get(SUBMITTED)['job_id'], '7')
+
+        other = self.journal({'a': 2})
+        self.assertFalse(other.done(SUBMITTED))
+
+    def test_clear(self):
+        journal = self.journal({'a': 1})
+        journal.record(SUBMITTED, job_id='7')
+        journal.clear()
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertFalse(self.journal({'a': 1}).done(SUBMITTED))
+
+    def test_finished_ttl(self):
+        journal = self.journal({'a': 1})
+        journal.record(REPORT_SAVED, output={'report_name': 'r'})
+        self.assertTrue(self.journal({'a': 1}).done(REPORT_SAVED))
+        journal.stages[REPORT_SAVED]['time'] = time.time() - 7200
+        journal.record(SUBMITTED, job_id='7')
+        self.assertFalse(self.journal({'a': 1}).done(SUBMITTED))
+
+    def test_sweep(self):
+        finished = self.journal({'a': 1})
+        finished.record(REPORT_SAVED, output={'report_name': 'r'})
+        finished.stages[REPORT_SAVED]['time'] = time.time() - 7200
+        finished.record(SUBMITTED, job_id='7')
+        stale = self.journal({'a': 2})
+        stale.record(SUBMITTED, job_id='8')
+        old = time.time() - 8 * 24 * 3600
+        os.utime(stale.path, (old, old))
+        running = self.journal({'a': 3})
+        running.record(SUBMITTED, job_id='9')
+
+        self.journal({'a': 4})
+        self.assertFalse(os.path.exists(finished.path))
+        self.assertFalse(os.path.exists(stale.path))
+        self.assertTrue(os.path.exists(running.path))
+
+
+class Restart(Exception):
+    '''The job runner going down while it waits for a job'''
+
+
+class FakeArast(object):
+    '''An ARAST server whose jobs report statuses[job_id] in turn'''
+
+    token = 'token'
+
+    def __init__(self, statuses, next_id=11):
+        self.statuses = statuses
+        self.next_id = next_id
+        self.submitted = []
+        self.killed = []
+
+    def submit_job(self, assembly_input, **kwargs):
+        self.submitted.append(assembly_input)
+        self.next_id += 1
+        return str(self.next_id - 1)
+
+    def get_status(self, job_id):
+        status = self.statuses[job_id].pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+    def kill_job(self, job_id):
+        self.killed.append(job_id)
+
+    def iter_log_lines(self, job_id):
+        return iter(['assembling'])
+
+    def iter_contigs(self, job_id):
+        return iter([('contig_1', 'ACGT' * 100)])
+
+    def get_report(self, job_id):
+        return 'report of job {}'.format(job_id)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.callback_url = os.environ.get('SDK_CALLBACK_URL')
+        os.environ['SDK_CALLBACK_URL'] = 'http://localhost:5000'
+        path = os.path.join(self.dir, 'upstream.fq')
+        with open(path, 'w') as f:
+            f.write(READS)
+        md5 = hashlib.md5(READS).hexdigest()
+        self.shock = LocalShock()
+        node = self.shock.register(path, {'file_name': 'reads.fq', 'remote_md5': md5})
+        self.input = {'paired_end_libs': [], 'references': [], 'single_end_libs': [
+            {'handle': {'id': node, 'url': self.shock.url, 'type': 'shock',
+                        'file_name': 'reads.fq', 'remote_md5': md5}}]}
+        self.impls = []
+
+    def tearDown(self):
+        for impl in self.impls:
+            impl.read_stager.local_shock.close()
+            impl.worker_pool.terminate()
+            impl.worker_pool.join()
+        self.shock.close()
+        if self.callback_url is None:
+            del os.environ['SDK_CALLBACK_URL']
+        else:
+            os.environ['SDK_CALLBACK_URL'] = self.callback_url
+        shutil.rmtree(self.dir)
+
+    def impl(self):
+        impl = AssemblyRAST({'workspace-url': 'http://localhost:7058', 'stage-reads': 'true',
+                             'scratch': os.path.join(self.dir, 'scratch')})
+        self.impls.append(impl)
+        return impl
+
+    def journal(self):
+        return JobJournal.for_call(os.path.join(self.dir, 'scratch', 'journal'), 'alice', 'kiki',
+                                   {'a': 1})
+
+    def run_job(self, impl, arast):
+        console = ConsoleLog(stream=StringIO())
+        try:
+            return run_sync(impl.arast_job_co(arast, self.input, {}, 'kiki', console,
+                                              journal=self.journal()))
+        finally:
+            console.close()
+
+    def restart(self, status):
+        '''Submit job 11 with staged reads and go down while it is in status'''
+        self.assertRaises(Restart, self.run_job, self.impl(),
+                          FakeArast({'11': [status, Restart()]}))
+        entry = self.journal().get(SUBMITTED)
+        self.assertNotIn('local_nodes', entry)
+        self.assertTrue(entry['staged'])
+        self.impls[0].read_stager.local_shock.close()
+        return self.impl()
+
+    def test_queued_job_resubmitted_after_restart(self):
+        restarted = self.restart('queued')
+        arast = FakeArast({'11': ['queued'], '12': ['complete']}, next_id=12)
+        result = self.run_job(restarted, arast)
+        self.assertEqual(arast.killed, ['11'])
+        self.assertEqual(result['job_id'], '12')
+        handle = arast.submitted[0]['single_end_libs'][0]['handle']
+        self.assertEqual(handle['url'], restarted.read_stager.local_shock.url)
+        self.assertEqual(self.journal().get(SUBMITTED)['job_id'], '12')
+
+    def test_running_job_reattached_after_restart(self):
+        restarted = self.restart('running')
+        arast = FakeArast({'11': ['running', 'running', 'complete']})
+        result = self.run_job(restarted, arast)
+        self.assertEqual((arast.killed, arast.submitted), ([], []))
+        self.assertEqual(result['job_id'], '11')
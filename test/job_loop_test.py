@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+
+from AssemblyRAST.job_loop import Call, JobLoop, Return, Sleep, run_sync
+
+
+def job(name, waits, calls):
+    for _ in range(waits):
+        yield Sleep(0.05)
+    thread = yield Call(lambda: threading.current_thread().name)
+    calls.append(thread)
+    raise Return(name)
+
+
+def outer(calls):
+    value = yield job('inner', 1, calls)
+    raise Return('outer ' + value)
+
+
+def failing():
+    yield Sleep(0)
+    raise ValueError('boom')
+
+
+class JobLoopTest(unittest.TestCase):
+
+    def test_run_sync(self):
+        calls = []
+        self.assertEqual(run_sync(outer(calls)), 'outer inner')
+        self.assertEqual(calls, [threading.current_thread().name])
+
+    def test_many_jobs_share_few_threads(self):
+        calls = []
+        start = time.time()
+        results = JobLoop(workers=2).run(job(n, 4, calls) for n in range(40))
+        self.assertEqual(results, range(40))
+        # the 40 jobs wait concurrently rather than one after another
+        self.assertLess(time.time() - start, 2)
+        self.assertLessEqual(len(set(calls)), 2)
+
+    def test_limit(self):
+        running = []
+        peak = []
+
+        def limited():
+            running.append(1)
+            peak.append(len(running))
+            yield Sleep(0.01)
+            running.pop()
+
+        JobLoop().run((limited() for _ in range(10)), limit=3)
+        self.assertEqual(max(peak), 3)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+
+        def waiter():
+            yield Sleep(60, cancel=cancel)
+            raise Return(cancel.is_set())
+
+        def canceller():
+            yield Sleep(0.01)
+            cancel.set()
+
+        start = time.time()
+        self.assertEqual(JobLoop().run([waiter(), canceller()]), [True, None])
+        self.assertLess(time.time() - start, 5)
+
+    def test_exceptions(self):
+        def catches():
+            try:
+                yield Call(int, 'x')
+            except ValueError:
+                raise Return('caught')
+
+        self.assertEqual(JobLoop().run([catches()]), ['caught'])
+        self.assertRaises(ValueError, JobLoop().run, [failing(), outer([])])
+        self.assertRaises(ValueError, run_sync, failing())
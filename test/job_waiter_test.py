@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+
+from AssemblyRAST.arast_client import ArastError
+from AssemblyRAST.job_waiter import (ArastJobCancelled, ArastJobFailed,
+                                     EventNotifier, JobWaiter,
+                                     classify_status, COMPLETE, FAILED,
+                                     QUEUED, RUNNING)
+
+
+class FakeClient(object):
+    '''A local stand-in backend that walks a job through a list of statuses'''
+
+    def __init__(self, statuses, log='line 1\nline 2\nboom'):
+        self.statuses = list(statuses)
+        self.log = log
+        self.polls = 0
+
+    def get_status(self, job_id):
+        self.polls += 1
+        if len(self.statuses) > 1:
+            return self.statuses.pop(0)
+        return self.statuses[0]
+
+    def iter_log_lines(self, job_id):
+        return iter(self.log.splitlines())
+
+
+class JobWaiterTest(unittest.TestCase):
+
+    def test_classify_status(self):
+        self.assertEqual(classify_status('queued'), QUEUED)
+        self.assertEqual(classify_status('Stage 2/3: velvet'), RUNNING)
+        self.assertEqual(classify_status('Complete'), COMPLETE)
+        self.assertEqual(classify_status('Complete with errors'), COMPLETE)
+        self.assertEqual(classify_status('FAILED'), FAILED)
+        self.assertEqual(classify_status('Terminated by user'), FAILED)
+        self.assertEqual(classify_status('Killed'), FAILED)
+        self.assertEqual(classify_status('Exception: out of memory'), FAILED)
+        self.assertEqual(classify_status('Running error correction'), RUNNING)
+        self.assertEqual(classify_status('Stage 1/3: kmergenie (skill level auto)'), RUNNING)
+        self.assertEqual(classify_status('Stage 3/3: filtering failed reads'), RUNNING)
+
+    def test_wait_complete(self):
+        client = FakeClient(['queued', 'Running', 'Running', 'Complete'])
+        states = []
+        waiter = JobWaiter(client, initial_interval=0.001, max_interval=0.01)
+        status = waiter.wait('1', on_state=lambda s, _: states.append(s))
+        self.assertEqual(status, 'Complete')
+        self.assertEqual(states, [QUEUED, RUNNING, COMPLETE])
+
+    def test_wait_fails_fast(self):
+        client = FakeClient(['queued', 'FAILED: bad reads'])
+        waiter = JobWaiter(client, initial_interval=0.001, log_lines=1)
+        with self.assertRaises(ArastJobFailed) as cm:
+            waiter.wait('1')
+        self.assertEqual(cm.exception.status, 'FAILED: bad reads')
+        self.assertEqual(cm.exception.log, 'boom')
+        self.assertEqual(client.polls, 2)
+
+    def test_max_wait(self):
+        waiter = JobWaiter(FakeClient(['Running']), initial_interval=0.01,
+                           max_wait=0.05)
+        self.assertRaises(ArastError, waiter.wait, '1')
+
+    def test_event_notifier(self):
+        notifier = EventNotifier()
+        client = FakeClient(['Running', 'Complete'])
+        waiter = JobWaiter(client, notifier=notifier, initial_interval=30)
+        timer = threading.Timer(0.05, notifier.notify, ['1'])
+        timer.start()
+        start = time.time()
+        self.assertEqual(waiter.wait('1'), 'Complete')
+        self.assertLess(time.time() - start, 5)
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        waiter = JobWaiter(FakeClient(['Running']), initial_interval=30)
+        threading.Timer(0.05, cancel.set).start()
+        start = time.time()
+        self.assertRaises(ArastJobCancelled, waiter.wait, '1', cancel=cancel)
+        self.assertLess(time.time() - start, 5)
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import random
+import shutil
+import string
+import tempfile
+import unittest
+
+import numpy as np
+
+from AssemblyRAST.merge import PairMerging, merge_pairs
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED, SINGLE
+from AssemblyRAST.seqfile import iter_batches, parse_buffer
+
+COMPLEMENT = string.maketrans('ACGT', 'TGCA')
+
+
+def revcomp(seq):
+    return seq[::-1].translate(COMPLEMENT)
+
+
+def fastq(*reads):
+    return ''.join('@{}\n{}\n+\n{}\n'.format(name, seq, qual) for name, seq, qual in reads)
+
+
+def batch(*reads):
+    return parse_buffer(np.frombuffer(fastq(*reads), dtype=np.uint8), True)[0]
+
+
+class MergePairsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(2)
+        self.fragment = ''.join(rng.choice('ACGT') for _ in range(150))
+
+    def test_merge(self):
+        read_2 = revcomp(self.fragment[-100:])
+        # a sequencing error in the overlap, called with low quality
+        read_2 = read_2[:70] + read_2[70].translate(string.maketrans('ACGT', 'CATG')) + read_2[71:]
+        mates_1 = batch(('p/1', self.fragment[:100], 'I' * 100), ('q/1', 'A' * 50, 'I' * 50))
+        mates_2 = batch(('p/2', read_2, 'I' * 70 + '#' + 'I' * 29), ('q/2', 'C' * 60, 'I' * 60))
+        merged, lengths, data = merge_pairs(mates_1, mates_2)
+        self.assertEqual(list(merged), [True, False])
+        self.assertEqual(list(lengths), [150])
+        self.assertEqual(data, fastq(('p', self.fragment, 'I' * 150)))
+
+    def test_min_overlap(self):
+        mates_1 = batch(('p', self.fragment[:80], 'I' * 80))
+        mates_2 = batch(('p', revcomp(self.fragment[-80:]), 'I' * 80))
+        self.assertTrue(merge_pairs(mates_1, mates_2, min_overlap=10)[0][0])
+        self.assertFalse(merge_pairs(mates_1, mates_2, min_overlap=11)[0][0])
+
+
+class PairMergingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = random.Random(3)
+        self.pairs = []
+        for n in range(200):
+            fragment = ''.join(rng.choice('ACGT') for _ in range(rng.choice((150, 400))))
+            self.pairs.append(('r{}/1'.format(n), fragment[:100], 'r{}/2'.format(n),
+                               revcomp(fragment[-100:])))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name, content=None):
+        path = os.path.join(self.dir, name)
+        if content is not None:
+            with open(path, 'w') as f:
+                f.write(content)
+        return path
+
+    def outputs(self, paths):
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(f.read())
+        return contents
+
+    def test_paired(self):
+        inputs = [self.path('1.fq', fastq(*[(n1, s1, 'I' * 100) for n1, s1, _, _ in self.pairs])),
+                  self.path('2.fq', fastq(*[(n2, s2, 'I' * 100) for _, _, n2, s2 in self.pairs]))]
+        stage = PairMerging(chunk_size=64, workers=1)
+        self.assertEqual(stage.output_layouts(PAIRED), [(PAIRED, None), (SINGLE, 'merged')])
+        results = []
+        stage.pool = multiprocessing.Pool(3)
+        try:
+            for workers in (1, 3):
+                stage.workers = workers
+                outputs = [self.path('{}.{}.fq'.format(workers, n)) for n in range(3)]
+                results.append((stage.run(PAIRED, inputs, outputs), self.outputs(outputs)))
+        finally:
+            stage.pool.terminate()
+            stage.pool.join()
+        self.assertEqual(results[0], results[1])
+        stats, (unmerged_1, unmerged_2, merged) = results[0]
+        self.assertEqual(stats['pairs_in'], 200)
+        self.assertEqual(stats['pairs_merged'], merged.count('\n') // 4)
+        self.assertGreater(stats['pairs_merged'], 50)
+        self.assertEqual(stats['merged_bases'], 150 * stats['pairs_merged'])
+        self.assertEqual(unmerged_1.count('\n') // 4, 200 - stats['pairs_merged'])
+        self.assertEqual(unmerged_2.count('\n') // 4, 200 - stats['pairs_merged'])
+        self.assertIn('merged {} of 200 pairs'.format(stats['pairs_merged']), stage.describe(stats))
+        self.assertTrue(merged.startswith('@r'))
+        self.assertNotIn('/1', merged)
+
+    def test_interleaved(self):
+        reads = []
+        for n1, s1, n2, s2 in self.pairs[:20]:
+            reads.extend([(n1, s1, 'I' * 100), (n2, s2, 'I' * 100)])
+        inputs = [self.path('i.fq', fastq(*reads))]
+        outputs = [self.path('out.fq'), self.path('merged.fq')]
+        stats = PairMerging(workers=1).run(INTERLEAVED, inputs, outputs)
+        names = [b.name(i) for b in iter_batches(outputs[0]) for i in range(len(b))]
+        self.assertEqual(len(names), 2 * (20 - stats['pairs_merged']))
+        self.assertEqual([name[:-2] for name in names[0::2]], [name[:-2] for name in names[1::2]])
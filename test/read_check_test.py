@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED, SINGLE
+from AssemblyRAST.read_check import ReadChecker, pair_keys
+from AssemblyRAST.seqfile import parse_buffer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+FORWARD = os.path.join(DATA_DIR, 'small.forward.fq')
+REVERSE = os.path.join(DATA_DIR, 'small.reverse.fq')
+
+
+def fastq(*names):
+    return ''.join('@{}\nACGT\n+\nIIII\n'.format(name) for name in names)
+
+
+class PairKeysTest(unittest.TestCase):
+
+    def test_mates_match(self):
+        text = fastq('a/1 x', 'a/2', 'b 1:N:0', 'b 2:N:0', 'a/3', 'ab', 'ba', '')
+        batch = parse_buffer(np.frombuffer(text, dtype=np.uint8), True)[0]
+        keys = pair_keys(batch)
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(keys[2], keys[3])
+        self.assertEqual(len(set(keys[[0, 2, 4, 5, 6, 7]])), 6)
+
+
+class ReadCheckerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = multiprocessing.Pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.terminate()
+        cls.pool.join()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_fixtures_pass(self):
+        # two files, so they are checked in worker processes
+        checker = ReadChecker(workers=2, pool=self.pool)
+        self.assertEqual(checker.check([(PAIRED, [FORWARD, REVERSE], ['f.fq', 'r.fq'])]), [])
+
+    def test_counts_differ(self):
+        with open(REVERSE) as f:
+            lines = [line for line in f if line.strip()]
+        truncated = self.path('r.fq', ''.join(lines[:-8]))
+        problems = ReadChecker(workers=2, pool=self.pool).check([(PAIRED, [FORWARD, truncated], ['f.fq', 'r.fq'])])
+        self.assertEqual(problems, ['f.fq and r.fq have different numbers of reads, 12500 and 12498'])
+
+    def test_out_of_step(self):
+        names = ['r{}/1'.format(n) for n in range(10)]
+        mates = ['r{}/2'.format(n) for n in range(10)]
+        mates[7], mates[8] = mates[8], mates[7]
+        paths = [self.path('1.fq', fastq(*names)), self.path('2.fq', fastq(*mates))]
+        problems = ReadChecker(workers=1, block=4).check([(PAIRED, paths, ['1.fq', '2.fq'])])
+        self.assertEqual(problems, ['1.fq and 2.fq are out of step: '
+                                    'read 8 is r7/1 in one file and r8/2 in the other'])
+
+    def test_file_problems(self):
+        interleaved = self.path('i.fq', fastq('a/1', 'a/2', 'b/1', 'c/2', 'c/1'))
+        truncated = self.path('t.fq', fastq('a') + '@b\nAC\n')
+        lengths = self.path('l.fq', '@a\nACGT\n+\nIII\n')
+        problems = ReadChecker(workers=1).check([(INTERLEAVED, [interleaved], ['i.fq']),
+                                                 (SINGLE, [truncated], ['t.fq']),
+                                                 (SINGLE, [lengths], ['l.fq'])])
+        self.assertEqual(problems[:2], ['i.fq: read 3 (b/1) is followed by c/2 instead of its mate',
+                                        'i.fq: has an odd number of reads, 5, for an interleaved library'])
+        self.assertEqual(problems[2], 't.fq: cannot be read: FASTQ data ends in a truncated record')
+        self.assertEqual(problems[3], 'l.fq: read 1 (a) has 4 bases but 3 qualities')
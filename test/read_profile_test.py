@@ -0,0 +1,102 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from AssemblyRAST.read_profile import (ReadProfiler, choose_assembler, estimate_costs,
+                                       format_profile, profile_sample)
+from AssemblyRAST.read_stager import LocalShock
+from AssemblyRAST.shock_download import RangedDownloader
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def profile(bases, read_len=100, quality=35.0):
+    return {'libraries': [], 'estimated_bases': bases, 'mean_read_length': read_len,
+            'mean_quality': quality, 'max_read_length': read_len, 'paired': True}
+
+
+class ReadProfilerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shock = LocalShock()
+        cls.dir = tempfile.mkdtemp()
+        cls.handles = {}
+        for name in ('small.forward.fq', 'small.reverse.fq'):
+            path = os.path.join(DATA_DIR, name)
+            cls.handles[name] = {'id': cls.shock.register(path, {'file_name': name, 'remote_md5': None}),
+                                 'url': cls.shock.url, 'file_name': name}
+        gz_path = os.path.join(cls.dir, 'reads.fq.gz')
+        with open(os.path.join(DATA_DIR, 'small.forward.fq')) as src:
+            with gzip.open(gz_path, 'wb') as dst:
+                dst.write(src.read())
+        cls.handles['gz'] = {'id': cls.shock.register(gz_path, {'file_name': 'reads.fq.gz',
+                                                                'remote_md5': None}),
+                             'url': cls.shock.url, 'file_name': 'reads.fq.gz'}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.shock.close()
+        shutil.rmtree(cls.dir)
+
+    def test_whole_file(self):
+        profiler = ReadProfiler(RangedDownloader(), sample_bytes=8 * 1024**2)
+        p = profiler.profile_handle(self.handles['small.forward.fq'], None)
+        self.assertTrue(p['exact'])
+        self.assertEqual(p['format'], 'fastq')
+        self.assertEqual(p['estimated_reads'], 12500)
+        self.assertEqual(p['estimated_bases'], 1250000)
+        self.assertEqual((p['min_length'], p['max_length']), (100, 100))
+        self.assertGreater(p['mean_quality'], 20)
+
+    def test_sampled_estimate(self):
+        profiler = ReadProfiler(RangedDownloader(), sample_bytes=100000)
+        for name in ('small.forward.fq', 'gz'):
+            p = profiler.profile_handle(self.handles[name], None)
+            self.assertFalse(p['exact'])
+            self.assertLess(p['sampled_reads'], 12500)
+            self.assertAlmostEqual(p['estimated_reads'], 12500, delta=12500 * 0.1)
+
+    def test_profile_input(self):
+        profiler = ReadProfiler(RangedDownloader(), sample_bytes=8 * 1024**2)
+        p = profiler.profile({'paired_end_libs': [{'handle_1': self.handles['small.forward.fq'],
+                                                   'handle_2': self.handles['small.reverse.fq']}],
+                              'single_end_libs': [{'handle': self.handles['gz']}]}, None)
+        self.assertEqual([lib['layout'] for lib in p['libraries']], ['paired', 'single'])
+        self.assertEqual(p['libraries'][0]['estimated_reads'], 25000)
+        self.assertEqual(p['estimated_bases'], 3750000)
+        self.assertEqual(p['mean_read_length'], 100)
+        self.assertTrue(p['paired'])
+        self.assertIn('Library 2: single', format_profile(p))
+
+    def test_fasta(self):
+        head = '>r1\nACGT\nAC\n>r2\nACGTACGT\n>r3\nAC'
+        p = profile_sample(head, len(head))
+        self.assertEqual(p['format'], 'fasta')
+        self.assertEqual(p['sampled_reads'], 3)
+        self.assertIsNone(p['mean_quality'])
+        # a cut sample drops the last, possibly partial, record
+        self.assertEqual(profile_sample(head, 1000)['sampled_reads'], 2)
+
+
+class CostModelTest(unittest.TestCase):
+
+    def test_small_isolate(self):
+        self.assertEqual(choose_assembler(profile(0.5e9)), 'velvet')
+
+    def test_large_input(self):
+        self.assertEqual(choose_assembler(profile(8e9)), 'megahit')
+
+    def test_long_reads(self):
+        self.assertEqual(choose_assembler(profile(1e9, read_len=8000)), 'miniasm')
+
+    def test_low_quality(self):
+        self.assertEqual(choose_assembler(profile(0.5e9, quality=12)), 'spades')
+        reasons = dict((a, r) for a, _, r in estimate_costs(profile(0.5e9, quality=12)))
+        self.assertEqual(reasons['velvet'], 'mean quality below 20')
+
+    def test_nothing_fits(self):
+        self.assertIsNone(choose_assembler(profile(0)))
+        self.assertIsNone(choose_assembler(profile(50e9, quality=12)))
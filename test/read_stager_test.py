@@ -0,0 +1,303 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from AssemblyRAST.AssemblyRASTImpl import AssemblyRAST
+from AssemblyRAST.diginorm import DigitalNormalization
+from AssemblyRAST.merge import PairMerging
+from AssemblyRAST.preprocess import INTERLEAVED, layout_of
+from AssemblyRAST.read_check import ReadChecker
+from AssemblyRAST.read_stager import CacheFull, GrowingFile, LocalShock, ReadCache, ReadStager
+from AssemblyRAST.shock_download import DownloadError
+
+
+READS = '@r1\nACGT\n+\nIIII\n' * 100
+
+
+class ReadStagerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # a LocalShock also makes a good stand-in for the real Shock
+        cls.shock = LocalShock()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.shock.close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.served = []
+        path = os.path.join(self.dir, 'upstream.fq')
+        with open(path, 'w') as f:
+            f.write(READS)
+        self.md5 = hashlib.md5(READS).hexdigest()
+        self.node = self.shock.register(path, {'file_name': 'reads.fq', 'remote_md5': self.md5},
+                                        on_serve=lambda: self.served.append(1))
+        self.local = LocalShock()
+        self.stager = ReadStager(ReadCache(os.path.join(self.dir, 'cache'), 1 << 20), self.local)
+
+    def tearDown(self):
+        self.local.close()
+        shutil.rmtree(self.dir)
+
+    def handle(self, md5=None):
+        return {'id': self.node, 'url': self.shock.url, 'type': 'shock',
+                'file_name': 'reads.fq', 'remote_md5': md5 or self.md5}
+
+    def test_stage_input(self):
+        assembly_input = {'paired_end_libs': [], 'references': [],
+                          'single_end_libs': [{'handle': self.handle()}]}
+        staged = self.stager.stage_input(assembly_input, 'token')
+        served = len(self.served)
+        self.stager.stage_input(assembly_input, 'token')
+        self.assertEqual(len(self.served), served)
+        handle = staged['single_end_libs'][0]['handle']
+        self.assertEqual(handle['url'], self.local.url)
+        self.assertEqual(handle['remote_md5'], self.md5)
+        self.assertEqual(assembly_input['single_end_libs'][0]['handle']['id'], self.node)
+        resp = requests.get('{}/node/{}?download'.format(handle['url'], handle['id']))
+        self.assertEqual(resp.content, READS)
+        info = requests.get('{}/node/{}'.format(handle['url'], handle['id'])).json()
+        self.assertEqual(info['data']['file']['size'], len(READS))
+
+    def test_stages(self):
+        assembly_input = {'paired_end_libs': [{'handle_1': self.handle(), 'handle_2': self.handle()}],
+                          'single_end_libs': [], 'references': []}
+        messages = []
+        stage = DigitalNormalization(target=5, k=4, sketch_bytes=1 << 16, batch_size=1)
+        staged = self.stager.stage_input(assembly_input, 'token', stages=[stage],
+                                         on_stage=messages.append)
+        self.assertEqual(len(messages), 1)
+        # every pair adds two counts of the only k-mer, ACGT
+        self.assertIn('kept 3 of 100', messages[0])
+        lib = staged['paired_end_libs'][0]
+        for slot in ('handle_1', 'handle_2'):
+            content = requests.get('{}/node/{}?download'.format(
+                lib[slot]['url'], lib[slot]['id'])).content
+            self.assertEqual(content, '@r1\nACGT\n+\nIIII\n' * 3)
+            self.assertEqual(lib[slot]['remote_md5'], hashlib.md5(content).hexdigest())
+        # the normalized reads are cached, so the stage is not run again
+        stage.run = None
+        self.stager.stage_input(assembly_input, 'token', stages=[stage], on_stage=messages.append)
+        self.assertEqual(messages[0], messages[1])
+
+    def test_split_library(self):
+        # ACGT is its own reverse complement, so every pair merges into one read
+        assembly_input = {'paired_end_libs': [{'handle_1': self.handle(), 'handle_2': self.handle()}],
+                          'single_end_libs': [{'handle': self.handle()}], 'references': []}
+        messages = []
+        stage = PairMerging(min_overlap=2, workers=1)
+        staged = self.stager.stage_input(assembly_input, 'token', stages=[stage],
+                                         on_stage=messages.append)
+        self.assertEqual(messages, ['Pair merging (min overlap 2): merged 100 of 100 pairs, '
+                                    '800 bp of mates into 400 bp'])
+        self.assertEqual(staged['paired_end_libs'], [])
+        single, merged = staged['single_end_libs']
+        self.assertEqual(single['handle']['file_name'], 'reads.fq')
+        self.assertEqual(merged['handle']['file_name'], 'merged_reads.fq')
+        content = requests.get('{}/node/{}?download'.format(
+            merged['handle']['url'], merged['handle']['id'])).content
+        self.assertEqual(content, '@r1\nACGT\n+\nIIII\n' * 100)
+
+    def test_check_input(self):
+        odd = READS + '@r2\nACGT\n+\nIII\n'
+        path = os.path.join(self.dir, 'odd.fq')
+        with open(path, 'w') as f:
+            f.write(odd)
+        md5 = hashlib.md5(odd).hexdigest()
+        handle = {'id': self.shock.register(path, {'file_name': 'odd.fq', 'remote_md5': md5}),
+                  'url': self.shock.url, 'type': 'shock', 'file_name': 'odd.fq', 'remote_md5': md5}
+        # an interleaved library as combine_read_libs builds it from a
+        # PairedEndLibrary; it makes no use of self
+        obj = {'data': {'lib1': {'file': handle}, 'interleaved': 1},
+               'info': [1, 'odd', 'KBaseFile.PairedEndLibrary-2.0']}
+        assembly_input = AssemblyRAST.combine_read_libs.__func__(None, [obj])
+        self.assertEqual(layout_of(assembly_input['paired_end_libs'][0]),
+                         (INTERLEAVED, ('handle_1',)))
+        checker = ReadChecker(workers=1)
+        with self.assertRaises(ValueError) as raised:
+            self.stager.stage_input(assembly_input, 'token', stream=True, checker=checker)
+        message = str(raised.exception)
+        self.assertIn('odd.fq: read 101 (r2) has 4 bases but 3 qualities', message)
+        self.assertIn('odd.fq: has an odd number of reads, 101', message)
+        assembly_input = {'paired_end_libs': [{'handle_1': self.handle(), 'handle_2': self.handle()}],
+                          'single_end_libs': [], 'references': []}
+        staged = self.stager.stage_input(assembly_input, 'token', stream=True, checker=checker)
+        self.assertEqual(staged['paired_end_libs'][0]['handle_1']['url'], self.local.url)
+        # checked libraries are not checked again
+        checker.check = None
+        self.stager.stage_input(assembly_input, 'token', checker=checker)
+
+    def test_md5_mismatch(self):
+        self.assertRaises(DownloadError, self.stager.stage_handle, self.handle('0' * 32), 'token')
+        self.assertEqual(self.stager.cache.entries(), [])
+
+    def test_unaddressable_handle(self):
+        handle = self.handle()
+        del handle['remote_md5']
+        self.assertIsNone(self.stager.stage_handle(handle, 'token'))
+
+    def test_eviction(self):
+        cache = ReadCache(os.path.join(self.dir, 'evict'), len(READS) * 2, hold_seconds=0)
+
+        def fetch(path):
+            with open(path, 'w') as f:
+                f.write(READS)
+
+        paths = []
+        for n in range(3):
+            paths.append(cache.put(str(n) * 40, fetch, {}))
+            used = time.time() - 100 + n
+            os.utime(os.path.join(os.path.dirname(paths[-1]), cache.META), (used, used))
+        self.assertEqual([os.path.exists(p) for p in paths], [False, True, True])
+
+
+    def test_holds(self):
+        cache = ReadCache(os.path.join(self.dir, 'hold'), len(READS) * 2)
+
+        def fetch(path):
+            with open(path, 'w') as f:
+                f.write(READS)
+
+        keys = [str(n) * 40 for n in range(3)]
+        cache.hold(keys[0])
+        paths = []
+        for n, key in enumerate(keys):
+            paths.append(cache.put(key, fetch, {}))
+            used = time.time() - 100 + n
+            os.utime(os.path.join(os.path.dirname(paths[-1]), cache.META), (used, used))
+        # the oldest is held, so the next oldest goes instead
+        self.assertEqual([os.path.exists(p) for p in paths], [True, False, True])
+        cache.hold(keys[2])
+        self.assertTrue(cache.full())
+        self.assertRaises(CacheFull, cache.put, '3' * 40, fetch, {})
+        cache.release(keys[0])
+        paths.append(cache.put('3' * 40, fetch, {}))
+        self.assertEqual([os.path.exists(p) for p in paths], [False, False, True, True])
+
+    def test_release(self):
+        assembly_input = {'paired_end_libs': [], 'references': [],
+                          'single_end_libs': [{'handle': self.handle()}]}
+        staged = self.stager.stage_input(assembly_input, 'token')
+        handle = staged['single_end_libs'][0]['handle']
+        url = '{}/node/{}?download'.format(handle['url'], handle['id'])
+        self.assertEqual(requests.get(url).content, READS)
+        key = ReadCache.key(self.handle())
+        self.assertTrue(self.stager.cache._held(key, time.time()))
+        self.stager.release(self.stager.nodes_of(staged))
+        self.assertEqual(requests.get(url).status_code, 404)
+        self.assertFalse(self.stager.cache._held(key, time.time()))
+
+    def test_full_cache_passes_through(self):
+        self.stager.cache.max_bytes = 0
+        assembly_input = {'paired_end_libs': [], 'references': [],
+                          'single_end_libs': [{'handle': self.handle()}]}
+        staged = self.stager.stage_input(assembly_input, 'token')
+        self.assertEqual(staged['single_end_libs'][0]['handle'], self.handle())
+        self.assertEqual(self.stager.nodes_of(staged), [])
+
+    def test_full_cache_skips_stages_and_checks(self):
+        cache = self.stager.cache
+
+        def fetch(path):
+            with open(path, 'w') as f:
+                f.write(READS)
+
+        # the reads of a queued job fill the cache
+        cache.put('f' * 40, fetch, {})
+        cache.hold('f' * 40)
+        cache.max_bytes = len(READS)
+        assembly_input = {'paired_end_libs': [{'handle_1': self.handle(), 'handle_2': self.handle()}],
+                          'single_end_libs': [], 'references': []}
+        checker = ReadChecker(workers=1)
+        checker.check = None
+        messages = []
+        stage = DigitalNormalization(target=5, k=4, sketch_bytes=1 << 16, batch_size=1)
+        staged = self.stager.stage_input(assembly_input, 'token', stages=[stage],
+                                         on_stage=messages.append, checker=checker)
+        self.assertEqual(messages, [])
+        lib = staged['paired_end_libs'][0]
+        self.assertEqual((lib['handle_1'], lib['handle_2']), (self.handle(), self.handle()))
+        self.assertEqual(self.stager.nodes_of(staged), [])
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.shock = LocalShock()
+
+    def tearDown(self):
+        self.shock.close()
+        shutil.rmtree(self.dir)
+
+    def follow(self, growing, results):
+        node = self.shock.register(growing.path, {'file_name': 'r.fq', 'remote_md5': None},
+                                   growing=growing)
+        url = '{}/node/{}?download'.format(self.shock.url, node)
+
+        def read():
+            try:
+                results.append(requests.get(url).content)
+            except requests.RequestException as e:
+                results.append(e)
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        return thread
+
+    def test_served_while_growing(self):
+        path = os.path.join(self.dir, 'partial')
+        growing = GrowingFile(path, len(READS))
+        results = []
+        with open(path, 'wb') as f:
+            thread = self.follow(growing, results)
+            for n in range(0, len(READS), 500):
+                f.write(READS[n:n + 500])
+                f.flush()
+                growing.advance(min(n + 500, len(READS)))
+            # everything but the last byte has arrived, which waits for finish
+            time.sleep(0.2)
+            self.assertEqual(results, [])
+        growing.finish(path)
+        thread.join(5)
+        self.assertEqual(results, [READS])
+
+    def test_failed_download_cuts_transfer(self):
+        path = os.path.join(self.dir, 'partial')
+        growing = GrowingFile(path, len(READS))
+        results = []
+        with open(path, 'wb') as f:
+            f.write(READS)
+        growing.advance(len(READS))
+        thread = self.follow(growing, results)
+        time.sleep(0.1)
+        growing.fail(ValueError('bad MD5'))
+        thread.join(5)
+        self.assertNotEqual(results[0], READS)
+
+    def test_stage_input_streaming(self):
+        upstream = os.path.join(self.dir, 'upstream.fq')
+        with open(upstream, 'w') as f:
+            f.write(READS)
+        md5 = hashlib.md5(READS).hexdigest()
+        node = self.shock.register(upstream, {'file_name': 'r.fq', 'remote_md5': md5})
+        local = LocalShock()
+        try:
+            stager = ReadStager(ReadCache(os.path.join(self.dir, 'cache'), 1 << 20), local)
+            staged = stager.stage_input({'single_end_libs': [{'handle': {
+                'id': node, 'url': self.shock.url, 'remote_md5': md5}}]}, 'token', stream=True)
+            handle = staged['single_end_libs'][0]['handle']
+            resp = requests.get('{}/node/{}?download'.format(handle['url'], handle['id']))
+            self.assertEqual(resp.content, READS)
+            self.assertIsNotNone(stager.cache.get(ReadCache.key(
+                {'id': node, 'remote_md5': md5})))
+        finally:
+            local.close()
@@ -0,0 +1,48 @@
+import os
+import threading
+import unittest
+
+from AssemblyRAST.request_context import RequestContext
+
+
+class RequestContextTest(unittest.TestCase):
+
+    def test_from_ctx(self):
+        rctx = RequestContext.from_ctx({'token': 't1', 'user_id': 'alice', 'call_id': '7'},
+                                       'http://arast/', '/tmp')
+        self.assertEqual(rctx.user_id, 'alice')
+        self.assertEqual(rctx.call_id, '7')
+        client = rctx.arast_client()
+        self.assertEqual(client.token, 't1')
+        self.assertEqual(client.user, 'alice')
+        client.close()
+
+    def test_token_required(self):
+        self.assertRaises(ValueError, RequestContext.from_ctx, {'user_id': 'alice'},
+                          'http://arast/', '/tmp')
+
+    def test_user_id_required(self):
+        # never taken from the server's environment, which other calls share
+        os.environ['KB_AUTH_USER_ID'] = 'leaked'
+        try:
+            self.assertRaises(ValueError, RequestContext.from_ctx, {'token': 't1'},
+                              'http://arast/', '/tmp')
+        finally:
+            del os.environ['KB_AUTH_USER_ID']
+
+    def test_calls_isolated(self):
+        clients = {}
+
+        def build(user):
+            rctx = RequestContext.from_ctx({'token': 'token-' + user, 'user_id': user},
+                                           'http://arast/', '/tmp')
+            clients[user] = rctx.arast_client()
+
+        threads = [threading.Thread(target=build, args=(u,)) for u in ('alice', 'bob')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for user, client in clients.items():
+            self.assertEqual((client.user, client.token), (user, 'token-' + user))
+            client.close()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from AssemblyRAST.contig_stats import ContigStats
+from AssemblyRAST.result_cache import ResultCache, make_key
+
+
+def assembly_input(md5_1='a' * 32, md5_2='b' * 32):
+    return {'paired_end_libs': [{'handle_1': {'id': 'n1', 'remote_md5': md5_1},
+                                 'handle_2': {'id': 'n2', 'remote_md5': md5_2}}],
+            'single_end_libs': [],
+            'references': []}
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_contigs(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write('>c1\n' + 'A' * size + '\n')
+        return path
+
+    def test_make_key(self):
+        key = make_key(assembly_input(), assembler='velvet')
+        self.assertEqual(key, make_key(assembly_input(), assembler='velvet'))
+        self.assertNotEqual(key, make_key(assembly_input(), assembler='spades'))
+        self.assertNotEqual(key, make_key(assembly_input('b' * 32, 'a' * 32),
+                                          assembler='velvet'))
+        self.assertNotEqual(key, make_key(assembly_input(), assembler='velvet',
+                                          extra_params=['-k 23']))
+        self.assertIsNone(make_key(assembly_input(md5_2=None),
+                                   assembler='velvet'))
+
+    def test_put_get(self):
+        cache = ResultCache(os.path.join(self.tmpdir, 'cache'), 1 << 20)
+        stats = ContigStats()
+        stats.add('ACGTAC')
+        contigs = self.write_contigs('contigs.fa', 6)
+        cache.put('abcd', contigs, stats, 'report', '12')
+        out_dir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(out_dir)
+        hit = cache.get('abcd', out_dir)
+        self.assertEqual(hit['job_id'], '12')
+        self.assertEqual(hit['ar_report'], 'report')
+        self.assertEqual(hit['stats'].to_dict(), stats.to_dict())
+        with open(hit['output_contigs']) as f:
+            self.assertEqual(f.read(), '>c1\nAAAAAA\n')
+        self.assertIsNone(cache.get('ffff', out_dir))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(os.path.join(self.tmpdir, 'cache'), 2500)
+        stats = ContigStats()
+        for n, key in enumerate(['aa01', 'bb02', 'cc03']):
+            cache.put(key, self.write_contigs('c{}.fa'.format(n), 1000),
+                      stats, '', str(n))
+            if key == 'bb02':
+                # touch the first entry so the second is the oldest
+                os.utime(os.path.join(cache._entry('aa01'), cache.META),
+                         (time.time() + 10, time.time() + 10))
+        keys = [os.path.basename(e) for _, _, e in cache.entries()]
+        self.assertEqual(sorted(keys), ['aa01', 'cc03'])
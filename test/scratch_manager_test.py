@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from StringIO import StringIO
+
+from AssemblyRAST.AssemblyRASTImpl import AssemblyRAST
+from AssemblyRAST.console_log import ConsoleLog
+from AssemblyRAST.scratch_manager import ScratchManager
+
+
+class FailingArast(object):
+    '''An ARAST job whose log comes through but whose contigs cannot be fetched'''
+
+    def iter_log_lines(self, job_id):
+        return iter(['assembling'])
+
+    def iter_contigs(self, job_id):
+        yield 'contig_1', 'ACGT' * 100
+        raise IOError('connection reset')
+
+
+class ScratchManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.callback_url = os.environ.get('SDK_CALLBACK_URL')
+
+    def tearDown(self):
+        if self.callback_url is None:
+            os.environ.pop('SDK_CALLBACK_URL', None)
+        else:
+            os.environ['SDK_CALLBACK_URL'] = self.callback_url
+        shutil.rmtree(self.root)
+
+    def impl(self, **config):
+        os.environ['SDK_CALLBACK_URL'] = 'http://localhost:5000'
+        config.update({'workspace-url': 'http://localhost:7058', 'scratch': self.root})
+        return AssemblyRAST(config)
+
+    def _fill(self, path, size, age):
+        with open(os.path.join(path, 'contigs.fa'), 'w') as f:
+            f.write('A' * size)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def test_allocate_release(self):
+        manager = ScratchManager(self.root, 1000)
+        path = manager.allocate('1.42')
+        self.assertTrue(os.path.basename(path).startswith('output.1.42.'))
+        self.assertEqual(manager._state(path), 'active')
+        manager.release(path)
+        self.assertEqual(manager._state(path), 'released')
+        manager.discard(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_evicts_released_oldest_first(self):
+        manager = ScratchManager(self.root, 250)
+        old = manager.allocate('old')
+        new = manager.allocate('new')
+        active = manager.allocate('active')
+        for path in (old, new):
+            manager.release(path)
+        self._fill(old, 100, 300)
+        self._fill(new, 100, 200)
+        self._fill(active, 100, 400)
+        manager.evict()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(active))
+
+    def test_pinned_is_kept(self):
+        manager = ScratchManager(self.root, 0)
+        path = manager.allocate('pinned')
+        self._fill(path, 10, 100)
+        with manager.pinned(path, 'upload'):
+            manager.release(path)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(manager.usage()['pinned'], 1)
+        manager.evict()
+        self.assertFalse(os.path.exists(path))
+
+    def test_usage(self):
+        manager = ScratchManager(self.root, 1000)
+        path = manager.allocate('a')
+        self._fill(path, 50, 0)
+        usage = manager.usage()
+        self.assertEqual(usage['directories'], 1)
+        self.assertEqual(usage['active'], 1)
+        self.assertTrue(usage['used_bytes'] >= 50)
+
+    def test_failed_fetch_is_discarded(self):
+        impl = self.impl()
+        before = impl.scratch_manager.usage()
+        job = {'job_id': '42', 'mode': 'kiki'}
+        console = ConsoleLog(stream=StringIO())
+        self.assertRaises(IOError, impl.arast_fetch, FailingArast(), job, {}, console)
+        console.close()
+        usage = impl.scratch_manager.usage()
+        self.assertEqual(usage['directories'], before['directories'])
+        self.assertEqual(usage['used_bytes'], before['used_bytes'])
+
+    def test_console_spill_is_released(self):
+        impl = self.impl(**{'console-spill': 'true'})
+        rctx = impl.request_context({'token': 'token', 'user_id': 'alice'}, 'http://localhost:8000/')
+        spill_dir = os.path.dirname(rctx.console.spill_path)
+        self.assertEqual(impl.scratch_manager._state(spill_dir), 'active')
+        rctx.console.close()
+        self.assertEqual(impl.scratch_manager._state(spill_dir), 'released')
+        impl.scratch_manager.quota_bytes = 0
+        impl.scratch_manager.evict()
+        self.assertFalse(os.path.exists(spill_dir))
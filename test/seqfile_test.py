@@ -0,0 +1,114 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from AssemblyRAST.seqfile import FASTA, FASTQ, count_records, iter_batches, parse_buffer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+FIXTURES = [os.path.join(DATA_DIR, name) for name in ('small.forward.fq', 'small.reverse.fq')]
+
+
+def naive_fastq(path):
+    '''The fixture parsed record by record, as the reference'''
+    with open(path) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    return [(lines[i][1:].split()[0], lines[i + 1], lines[i + 3]) for i in range(0, len(lines), 4)]
+
+
+def batch_arrays(batches):
+    return {'lengths': np.concatenate([b.lengths for b in batches]),
+            'gc': np.concatenate([b.gc_counts() for b in batches]),
+            'quality': np.concatenate([b.quality_sums() for b in batches])}
+
+
+class SeqFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name, content=None):
+        path = os.path.join(self.dir, name)
+        if content is not None:
+            with open(path, 'wb') as f:
+                f.write(content)
+        return path
+
+    def test_fixtures(self):
+        for path in FIXTURES:
+            reference = naive_fastq(path)
+            # small windows, so records are cut at window edges many times over
+            batches = list(iter_batches(path, batch_bytes=65536))
+            self.assertGreater(len(batches), 10)
+            self.assertTrue(all(b.format == FASTQ for b in batches))
+            arrays = batch_arrays(batches)
+            self.assertEqual(len(arrays['lengths']), len(reference))
+            self.assertEqual(list(arrays['lengths']), [len(seq) for _, seq, _ in reference])
+            self.assertEqual(list(arrays['gc']), [seq.count('G') + seq.count('C')
+                                                  for _, seq, _ in reference])
+            self.assertEqual(list(arrays['quality']), [sum(ord(c) - 33 for c in qual)
+                                                       for _, _, qual in reference])
+            first = batches[0]
+            self.assertEqual(first.name(0), reference[0][0])
+            self.assertEqual(first.seq(0).tobytes(), reference[0][1])
+            self.assertEqual(first.qual(0).tobytes(), reference[0][2])
+
+    def test_gzip_fallback(self):
+        gz_path = self.path('reads.fq.gz')
+        with open(FIXTURES[0], 'rb') as src:
+            with gzip.open(gz_path, 'wb') as dst:
+                dst.write(src.read())
+        mapped = batch_arrays(list(iter_batches(FIXTURES[0])))
+        streamed = batch_arrays(list(iter_batches(gz_path, batch_bytes=100000)))
+        for key in mapped:
+            self.assertTrue(np.array_equal(mapped[key], streamed[key]))
+
+    def test_max_records(self):
+        sizes = [len(b) for b in iter_batches(FIXTURES[1], max_records=3000)]
+        self.assertEqual(sizes, [3000, 3000, 3000, 3000, 500])
+
+    def test_write_subset(self):
+        batch = next(iter_batches(FIXTURES[0], max_records=10))
+        keep = np.array([True, True, False, True] + [False] * 5 + [True])
+        out = self.path('out.fq')
+        with open(out, 'wb') as f:
+            batch.write(f, keep)
+        reference = naive_fastq(FIXTURES[0])
+        self.assertEqual([name for name, _, _ in naive_fastq(out)],
+                         [reference[i][0] for i in (0, 1, 3, 9)])
+
+    def test_fasta(self):
+        path = self.path('contigs.fa', '>c1 first\nACGT\nGG\n>c2\r\nAT\r\n>c3\n\n>c4\nCCCA')
+        batch, = iter_batches(path)
+        self.assertEqual(batch.format, FASTA)
+        self.assertEqual(list(batch.lengths), [6, 2, 0, 4])
+        self.assertEqual(list(batch.gc_counts()), [4, 0, 0, 3])
+        self.assertEqual([batch.name(i) for i in range(4)], ['c1', 'c2', 'c3', 'c4'])
+        self.assertEqual(count_records(path), 4)
+
+    def test_cut_and_truncated(self):
+        data = np.frombuffer('@r1\nACGT\n+\nIIII\n@r2\nAC', dtype=np.uint8)
+        batch, consumed = parse_buffer(data, False)
+        self.assertEqual((len(batch), consumed), (1, 16))
+        self.assertRaises(ValueError, parse_buffer, data, True)
+        self.assertRaises(ValueError, list, iter_batches(self.path('bad.fq', 'r1\nACGT\n+\nIIII\n')))
+
+    def test_empty_reads(self):
+        for data in ('@r\n\n+\n\n', '@r\n\n+\n\n\n\n', '@q\nAC\n+\nII\n@r\n\n+\n\r\n'):
+            batches = list(iter_batches(self.path('empty_read.fq', data)))
+            self.assertEqual(len(batches), 1)
+            batch = batches[0]
+            self.assertEqual(batch.name(len(batch) - 1), 'r')
+            self.assertEqual(batch.lengths[-1], 0)
+            self.assertEqual(batch.qual_lengths()[-1], 0)
+        self.assertRaises(ValueError, list, iter_batches(self.path('cut.fq', '@r\nAC\n\n')))
+
+    def test_empty(self):
+        self.assertEqual(list(iter_batches(self.path('empty.fq', ''))), [])
+        self.assertEqual(list(iter_batches(self.path('blank.fq', '\n\n'))), [])
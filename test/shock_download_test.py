@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from AssemblyRAST.read_stager import LocalShock
+from AssemblyRAST.shock_download import DownloadError, RangedDownloader
+
+
+DATA = ''.join(chr(n % 251) for n in range(100000))
+
+
+class FlakySession(requests.Session):
+    '''Fails the first ranged request for the given start offset'''
+
+    def __init__(self, fail_start):
+        super(FlakySession, self).__init__()
+        self.fail_start = fail_start
+        self.ranges = []
+
+    def get(self, url, **kwargs):
+        rng = kwargs.get('headers', {}).get('Range')
+        if rng:
+            self.ranges.append(rng)
+            if rng.startswith('bytes={}-'.format(self.fail_start)) and self.fail_start is not None:
+                self.fail_start = None
+                raise requests.ConnectionError('reset')
+        return super(FlakySession, self).get(url, **kwargs)
+
+
+class RangedDownloaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shock = LocalShock()
+        cls.dir = tempfile.mkdtemp()
+        path = os.path.join(cls.dir, 'node')
+        with open(path, 'wb') as f:
+            f.write(DATA)
+        cls.md5 = hashlib.md5(DATA).hexdigest()
+        cls.node = cls.shock.register(path, {'file_name': 'reads.fq', 'remote_md5': cls.md5})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.shock.close()
+        shutil.rmtree(cls.dir)
+
+    def handle(self, md5=None):
+        return {'id': self.node, 'url': self.shock.url, 'remote_md5': md5 or self.md5}
+
+    def out(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_ranged(self):
+        session = FlakySession(None)
+        downloader = RangedDownloader(parallelism=3, part_size=30000, min_ranged_bytes=0,
+                                      session=session)
+        downloader.download(self.handle(), 'token', self.out('ranged'))
+        with open(self.out('ranged'), 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(len(session.ranges), 4)
+        self.assertFalse(os.path.exists(self.out('ranged') + RangedDownloader.PROGRESS))
+
+    def test_ranged_progress(self):
+        session = FlakySession(None)
+        downloader = RangedDownloader(parallelism=2, part_size=30000, min_ranged_bytes=0,
+                                      session=session)
+        progress = []
+        downloader.download(self.handle(), 'token', self.out('progress'), progress=progress.append)
+        with open(self.out('progress'), 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        # ranged even with a progress callback, which sees the file grow front to back
+        self.assertEqual(len(session.ranges), 4)
+        self.assertEqual(progress, sorted(progress))
+        self.assertTrue(set(progress) <= set([0, 30000, 60000, 90000, 100000]))
+        self.assertEqual(progress[-1], len(DATA))
+
+    def test_resume(self):
+        path = self.out('resume')
+        session = FlakySession(60000)
+        downloader = RangedDownloader(parallelism=1, part_size=30000, min_ranged_bytes=0,
+                                      retries=1, session=session)
+        self.assertRaises(DownloadError, downloader.download, self.handle(), 'token', path)
+        with open(path + RangedDownloader.PROGRESS) as f:
+            self.assertEqual(json.load(f)['done'], [0, 1, 3])
+        session.ranges = []
+        downloader.download(self.handle(), 'token', path)
+        self.assertEqual(session.ranges, ['bytes=60000-89999'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    def test_small_and_md5(self):
+        downloader = RangedDownloader()
+        downloader.download(self.handle(), 'token', self.out('small'))
+        with open(self.out('small'), 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertRaises(DownloadError, downloader.download, self.handle('0' * 32),
+                          'token', self.out('bad'))
+        self.assertFalse(os.path.exists(self.out('bad')))
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from AssemblyRAST.preprocess import INTERLEAVED, PAIRED, SINGLE
+from AssemblyRAST.seqfile import iter_batches, parse_buffer
+from AssemblyRAST.trim import Trimming, adapter_cuts, quality_cuts
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def fastq(*reads):
+    return ''.join('@r{}\n{}\n+\n{}\n'.format(n, seq, qual) for n, (seq, qual) in enumerate(reads))
+
+
+def batch(*reads):
+    return parse_buffer(np.frombuffer(fastq(*reads), dtype=np.uint8), True)[0]
+
+
+class CutsTest(unittest.TestCase):
+
+    def test_adapter(self):
+        reads = batch(('ACGTACGTAGATCGGAAGAGCTTT', 'I' * 24),
+                      ('ACGTACGTAGATC', 'I' * 13),
+                      ('ACGTACGTAG', 'I' * 10),
+                      ('AGATCGGAAGAGC', 'I' * 13))
+        self.assertEqual(list(adapter_cuts(reads, 'AGATCGGAAGAGC')), [8, 8, 10, 0])
+
+    def test_quality(self):
+        # Q40 scores -20 against a cutoff of 20, Q2 scores +18
+        reads = batch(('ACGTACGTAG', 'IIIIII####'), ('ACGT', '#I##'), ('', ''), ('AC', 'II'))
+        self.assertEqual(list(quality_cuts(reads, 20)), [6, 2, 0, 2])
+
+
+class TrimmingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name, content=None):
+        path = os.path.join(self.dir, name)
+        if content is not None:
+            with open(path, 'w') as f:
+                f.write(content)
+        return path
+
+    def test_pairs_dropped_together(self):
+        inputs = [self.path('1.fq', fastq(('ACGTAGATCGGAAGAGC', 'I' * 17), ('ACGTACGT', '########'),
+                                          ('ACGTACGT', 'IIIIIIII'))),
+                  self.path('2.fq', fastq(('ACGTACGT', 'IIIIIIII'), ('ACGTACGT', 'IIIIIIII'),
+                                          ('ACGTACGT', 'IIIII###')))]
+        outputs = [self.path('out1.fq'), self.path('out2.fq')]
+        stage = Trimming(adapter='truseq', quality=20, min_length=4, workers=1)
+        stats = stage.run(PAIRED, inputs, outputs)
+        self.assertEqual(stats, {'reads_in': 6, 'reads_kept': 4, 'bases_in': 57, 'bases_kept': 25})
+        with open(outputs[0]) as f:
+            self.assertEqual(f.read(), '@r0\nACGT\n+\nIIII\n@r2\nACGTACGT\n+\nIIIIIIII\n')
+        with open(outputs[1]) as f:
+            self.assertEqual(f.read(), '@r0\nACGTACGT\n+\nIIIIIIII\n@r2\nACGTA\n+\nIIIII\n')
+        self.assertEqual(stage.describe(stats), 'Trimming (adapter AGATCGGAAGAGC, quality 20, '
+                                                'min length 4): removed 2 of 6 reads and 32 of 57 bp')
+
+    def test_fasta_passed_through(self):
+        reads = '>r0\nACGTAGATCGGAAGAGC\n>r1\nAC\n'
+        inputs = [self.path('in.fa', reads)]
+        outputs = [self.path('out.fa')]
+        stage = Trimming(adapter='truseq', quality=20, min_length=4, workers=1)
+        stats = stage.run(SINGLE, inputs, outputs)
+        self.assertEqual(stats, {'reads_in': 2, 'reads_kept': 2, 'bases_in': 19, 'bases_kept': 19})
+        with open(outputs[0]) as f:
+            self.assertEqual(f.read(), reads)
+
+    def test_workers_match_serial(self):
+        inputs = [os.path.join(DATA_DIR, 'small.forward.fq'), os.path.join(DATA_DIR, 'small.reverse.fq')]
+        results = []
+        pool = multiprocessing.Pool(3)
+        try:
+            for workers in (1, 3):
+                outputs = [self.path('{}.1.fq'.format(workers)), self.path('{}.2.fq'.format(workers))]
+                stage = Trimming(adapter='truseq', quality=30, workers=workers, chunk_size=1000,
+                                 pool=pool)
+                stats = stage.run(PAIRED, inputs, outputs)
+                contents = []
+                for path in outputs:
+                    with open(path) as f:
+                        contents.append(f.read())
+                results.append((stats, contents))
+            # the pool stays in this process when the stage goes to a worker
+            self.assertIsNone(pickle.loads(pickle.dumps(stage)).pool)
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual(results[0], results[1])
+        stats = results[0][0]
+        self.assertEqual(stats['reads_in'], 25000)
+        self.assertLess(stats['bases_kept'], stats['bases_in'])
+        kept = [sum(len(b) for b in iter_batches(path)) for path in outputs]
+        self.assertEqual(kept, [stats['reads_kept'] // 2] * 2)
+
+    def test_interleaved(self):
+        inputs = [self.path('i.fq', fastq(('ACGTACGT', 'IIIIIIII'), ('ACGTACGT', '########'),
+                                          ('ACGTACGT', 'IIIIIIII'), ('ACGTACGT', 'IIIIIIII')))]
+        stats = Trimming(quality=20, min_length=4, workers=1).run(INTERLEAVED, inputs,
+                                                                   [self.path('out.fq')])
+        self.assertEqual((stats['reads_in'], stats['reads_kept']), (4, 2))
+
+    def test_settings(self):
+        self.assertRaises(ValueError, Trimming)
+        self.assertRaises(ValueError, Trimming, adapter='AGATXX')
+        self.assertEqual(Trimming(adapter='Nextera').adapter, 'CTGTCTCTTATACACATCT')
@@ -0,0 +1,114 @@
+import unittest
+
+import requests
+
+from AssemblyRAST import workspace_fetch
+from AssemblyRAST.workspace_fetch import (READ_LIBRARY_PATHS, ObjectCache,
+                                          fetch_read_libs)
+
+
+class FakeWorkspace(object):
+    '''Serves objects from a dict, honouring top level included paths'''
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.calls = []
+
+    def get_objects2(self, params):
+        self.calls.append(params['objects'])
+        data = []
+        for spec in params['objects']:
+            info, obj = self.objects[spec['ref']]
+            if 'included' in spec:
+                keys = set(path.split('/')[0] for path in spec['included'])
+                obj = dict((k, v) for k, v in obj.items() if k in keys)
+            data.append({'info': info, 'data': obj})
+        return {'data': data}
+
+    def get_object_info3(self, params):
+        self.calls.append('info')
+        infos = []
+        for spec in params['objects']:
+            if spec['ref'] not in self.objects:
+                raise ValueError('Object {} cannot be accessed'.format(spec['ref']))
+            infos.append(self.objects[spec['ref']][0])
+        return {'infos': infos}
+
+
+def info(objid, type_name):
+    return [objid, 'name', type_name, None, 1, None, 5]
+
+
+class WorkspaceFetchTest(unittest.TestCase):
+
+    def test_projection(self):
+        ws = FakeWorkspace({
+            'ws/pe': (info(1, 'KBaseFile.PairedEndLibrary-2.0'),
+                      {'lib1': {'file': {'id': 'a'}}, 'qc': 'x' * 1000}),
+            'ws/se': (info(2, 'KBaseFile.SingleEndLibrary-2.0'),
+                      {'lib': {'file': {'id': 'b'}}, 'metadata': {}})})
+        libs = fetch_read_libs(ws, ['ws/pe', 'ws/se'])
+        self.assertEqual(libs[0]['data'], {'lib1': {'file': {'id': 'a'}}})
+        self.assertEqual(libs[1]['data'], {'lib': {'file': {'id': 'b'}}})
+        self.assertEqual(ws.calls[0][0]['included'], READ_LIBRARY_PATHS)
+        self.assertEqual(len(ws.calls), 1)
+
+    def test_unknown_type_fetched_in_full(self):
+        ws = FakeWorkspace({
+            'ws/odd': (info(3, 'Other.Reads-1.0'), {'reads': 'r'}),
+            '5/3/1': (info(3, 'Other.Reads-1.0'), {'reads': 'r'})})
+        libs = fetch_read_libs(ws, ['ws/odd'])
+        self.assertEqual(libs[0]['data'], {'reads': 'r'})
+        self.assertEqual(ws.calls[1], [{'ref': '5/3/1'}])
+
+    def test_cache(self):
+        pe = (info(1, 'KBaseFile.PairedEndLibrary-2.0'), {'lib1': {'file': {'id': 'a'}}})
+        ws = FakeWorkspace({'ws/pe': pe, '5/1/1': pe})
+        cache = ObjectCache()
+        first = fetch_read_libs(ws, ['ws/pe'], cache=cache)
+        first[0]['data']['lib1']['file']['file_name'] = 'lib1.fq'
+        second = fetch_read_libs(ws, ['5/1/1'], cache=cache)
+        self.assertEqual(second[0]['data'], {'lib1': {'file': {'id': 'a'}}})
+        self.assertEqual(ws.calls.count('info'), 2)
+        self.assertEqual(len(ws.calls), 3)
+        self.assertEqual(cache.stats()['hits'], 1)
+        # a user who cannot see the object gets nothing from the cache
+        other = FakeWorkspace({})
+        self.assertRaises(ValueError, fetch_read_libs, other, ['5/1/1'], cache=cache)
+
+    def test_cache_bounds(self):
+        cache = ObjectCache(max_entries=2, max_bytes=60)
+        for n in range(3):
+            cache.put('1/{}/1'.format(n), {'data': n})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('1/0/1'))
+        cache.get('1/1/1')
+        cache.put('1/3/1', {'data': 'x' * 30})
+        self.assertIsNotNone(cache.get('1/3/1'))
+        self.assertIsNone(cache.get('1/2/1'))
+        self.assertLessEqual(cache.bytes, 60)
+
+    def test_chunks_in_order_with_retry(self):
+        objects = dict(('ws/{}'.format(n), (info(n, 'KBaseFile.SingleEndLibrary-2.0'),
+                                            {'lib': {'file': {'id': n}}}))
+                       for n in range(25))
+        ws = FakeWorkspace(objects)
+        fetch = ws.get_objects2
+        failures = []
+
+        def flaky(params):
+            if not failures:
+                failures.append(1)
+                raise requests.ConnectionError('reset')
+            return fetch(params)
+
+        ws.get_objects2 = flaky
+        delay, workspace_fetch.RETRY_DELAY = workspace_fetch.RETRY_DELAY, 0
+        try:
+            refs = ['ws/{}'.format(n) for n in range(25)]
+            libs = fetch_read_libs(ws, refs, chunk_size=10, workers=3)
+        finally:
+            workspace_fetch.RETRY_DELAY = delay
+        self.assertEqual([lib['data']['lib']['file']['id'] for lib in libs], range(25))
+        self.assertEqual(sorted(len(chunk) for chunk in ws.calls), [5, 10, 10])
+        self.assertEqual(len(failures), 1)